@@ -1,8 +1,17 @@
+from concurrent.futures import Future
+from functools import partial
+
+import numpy as np
 import pandas as pd
-from typing import Optional, List, Union, Literal
+from typing import Optional, Union, Literal
 
-from algo_code.datatypes import Pivot, Candle
+from algo_code.candle_frame import CandleFrame
+from algo_code.datatypes import Candle, Pivot
+from algo_code import zigzag_engine
+from algo_code.zigzag_index import ZigzagIndex
 from algo_code.general_utils import make_set_width
+from algo_code.h_o_zigzag_state import HOZigzagState
+from algo_code.ob_candidates import OrderBlockCandidates
 from algo_code.order_block import OrderBlock
 from algo_code.segment import Segment
 from algo_code.position import Position
@@ -11,12 +20,25 @@ from utils.logger import logger
 
 
 class Algo:
-    def __init__(self, pair_df: pd.DataFrame,
+    def __init__(self, pair_df: Union[pd.DataFrame, CandleFrame],
                  symbol: str):
 
-        self.pair_df: pd.DataFrame = pair_df
+        # The candles are kept as a CandleFrame, which the hot paths of the algorithm work on. If the candles are given as a CandleFrame, pair_df is
+        # only materialized if it is accessed.
+        self.candles: CandleFrame = CandleFrame.create(pair_df)
+        self.__pair_df: Optional[pd.DataFrame] = pair_df if isinstance(pair_df, pd.DataFrame) else None
+
         self.symbol: str = symbol
-        self.zigzag_df: Optional[pd.DataFrame] = None
+
+        # The pivots of the zigzag, as a structured array with the zigzag_engine.pivot_dtype dtype, and the index used to look them up. zigzag_df
+        # is only a pandas view of the pivots for debugging, built when it is accessed.
+        self.zigzag_pivots: Optional[np.ndarray] = None
+        self.zigzag_index: Optional[ZigzagIndex] = None
+        self.__zigzag_df: Optional[pd.DataFrame] = None
+
+        # The PDI before which the pivots of the zigzag are final, which is the tentative pivot of the closed candles. It is only known if the zigzag
+        # is calculated from a ZigzagState, and is used for checkpointing the higher order zigzag.
+        self.stable_pivot_end_pdi: Optional[int] = None
 
         # pbos_indices and choch_indices is a list which stores the PBOS and CHOCH's being moved due to shadows breaking the most recent lows/highs
         self.pbos_indices: list[int] = []
@@ -40,94 +62,62 @@ class Algo:
         # executed in the calc_h_o_zigzag method.
         self.starting_pdi = 0
 
-    def init_zigzag(self, last_pivot_type=None, last_pivot_candle_pdi=None) -> None:
-        """
-            Method to identify turning points in a candlestick chart.
-            It compares each candle to its previous pivot to determine if it's a new pivot point.
-            This implementation is less optimized than the deprecated version, as it doesn't use
-            vectorized operations, but it is what it is
-
-            Returns:
-            pd.DataFrame: A DataFrame containing the identified turning points.
-            """
-
-        if last_pivot_type is None:
-            # Find the first candle that has a higher high or a lower low than its previous candle
-            # and set it as the first pivot. Also set the type of the pivot (peak or valley)
-
-            last_pivot_candle_series = \
-                self.pair_df[(self.pair_df['high'] > self.pair_df['high'].shift(1)) | (
-                        self.pair_df['low'] < self.pair_df['low'].shift(1))].iloc[0]
+    @property
+    def pair_df(self) -> pd.DataFrame:
+        if self.__pair_df is None:
+            self.__pair_df = self.candles.to_pair_df()
 
-            last_pivot_type: str = 'valley'
-            if last_pivot_candle_series.high > self.pair_df.iloc[last_pivot_candle_series.name - 1].high:
-                last_pivot_type = 'peak'
+        return self.__pair_df
 
-        # If a first candle is already given
-        else:
-            last_pivot_candle_series = self.pair_df.loc[last_pivot_candle_pdi]
-
-        last_pivot_candle: Candle = Candle.create(last_pivot_candle_series)
-        pivots: List[Pivot] = []
-
-        # Start at the candle right after the last (first) pivot
-        for row in self.pair_df.iloc[last_pivot_candle.pdi + 1:].itertuples():
-
-            # Conditions to check if the current candle is an extension of the last pivot or a reversal
-            peak_extension_condition: bool = row.high > last_pivot_candle.high and last_pivot_type == 'peak'
-            valley_extension_condition: bool = row.low < last_pivot_candle.low and last_pivot_type == 'valley'
-
-            reversal_from_peak_condition = row.low < last_pivot_candle.low and last_pivot_type == 'peak'
-            reversal_from_valley_condition = row.high > last_pivot_candle.high and last_pivot_type == 'valley'
+    @property
+    def zigzag_df(self) -> Optional[pd.DataFrame]:
+        if self.__zigzag_df is None and self.zigzag_pivots is not None:
+            pivots = self.zigzag_pivots
+            self.__zigzag_df = pd.DataFrame({
+                "pdi": pivots["pdi"],
+                "time": self.candles.to_datetimes(pivots["time"]),
+                "pivot_value": pivots["pivot_value"],
+                "pivot_type": np.where(pivots["pivot_type"] == zigzag_engine.PEAK, "peak", "valley").astype(object)
+            })
 
-            # Does the candle register both a higher high AND a lower low?
-            if (reversal_from_valley_condition and valley_extension_condition) or (
-                    peak_extension_condition and reversal_from_peak_condition):
+        return self.__zigzag_df
 
-                # INITIAL NAIVE IMPLEMENTATION
-                # Add the last previous pivot to the list
-                # pivots.append(Pivot.create((last_pivot_candle, last_pivot_type)))
-
-                # Update the last pivot's type and value
-                # last_pivot_candle = Candle.create(row)
-                # last_pivot_type = 'valley' if last_pivot_type == 'peak' else 'peak'
-
-                # JUDGING BASED ON CANDLE COLOR
-                # If the candle is green, that means the low value was probably hit before the high value
-                # If the candle is red, that means the high value was probably hit before the low value
-                # This means that if the candle is green, we can extend a peak, and if it's red, we can extend a valley
-                # Otherwise the direction must flip
-                if (row.candle_color == 'green' and last_pivot_type == 'valley') or (
-                        row.candle_color == 'red' and last_pivot_type == 'peak'):
-                    # Add the last previous pivot to the list of pivots
-                    pivots.append(Pivot.create((last_pivot_candle, last_pivot_type)))
-
-                    # Update the last pivot's type and value
-                    last_pivot_candle = Candle.create(row)
-                    last_pivot_type = 'valley' if last_pivot_type == 'peak' else 'peak'
+    def init_zigzag(self, last_pivot_type=None, last_pivot_candle_pdi=None, zigzag_state: zigzag_engine.ZigzagState = None) -> None:
+        """
+        Method to identify turning points in a candlestick chart.
+        It compares each candle to its previous pivot to determine if it's a new pivot point. The walk over the candles is done by the zigzag engine
+        on the raw price arrays, which returns the pivots as a structured array. The pivots are stored as that array and indexed for the lookups of
+        the algorithm.
 
-                else:
-                    last_pivot_candle = Candle.create(row)
+        Args:
+            last_pivot_type (str): The type of the first pivot, "peak" or "valley". If None, the first pivot is detected from the candles.
+            last_pivot_candle_pdi (int): The PDI of the first pivot.
+            zigzag_state (ZigzagState): The persistent zigzag state of the pair. If given, only the candles which closed since the last call are
+                                        processed, and last_pivot_type and last_pivot_candle_pdi are ignored.
+        """
 
-            # Has a same direction pivot been found?
-            if peak_extension_condition or valley_extension_condition:
-                # Don't change the direction of the last pivot found, just update its value
-                last_pivot_candle = Candle.create(row)
+        candles = self.candles
 
-            # Has a pivot in the opposite direction been found?
-            elif reversal_from_valley_condition or reversal_from_peak_condition:
-                # Add the last previous pivot to the list of pivots
-                pivots.append(Pivot.create((last_pivot_candle, last_pivot_type)))
+        if zigzag_state is not None:
+            pivots: np.ndarray = zigzag_state.get_pivots(candles)
+            self.stable_pivot_end_pdi = zigzag_state.last_pivot_pdi
 
-                # Update the last pivot's type and value
-                last_pivot_candle = Candle.create(row)
-                last_pivot_type = 'valley' if last_pivot_type == 'peak' else 'peak'
+        else:
+            if last_pivot_type is None:
+                # Find the first candle that has a higher high or a lower low than its previous candle
+                # and set it as the first pivot. Also set the type of the pivot (peak or valley)
+                last_pivot_candle_pdi, last_pivot_type_code = zigzag_engine.find_first_pivot(candles.high, candles.low)
+            else:
+                last_pivot_type_code = zigzag_engine.pivot_type_codes[last_pivot_type]
 
-        # Convert the pivot list to zigzag_df
-        # noinspection PyTypeChecker
-        zigzag_df = pd.DataFrame.from_dict(pivot._asdict() for pivot in pivots)
+            pivot_pdis, pivot_types, _, _ = zigzag_engine.run_zigzag(candles.high, candles.low, candles.is_green,
+                                                                    last_pivot_pdi=last_pivot_candle_pdi,
+                                                                    last_pivot_type=last_pivot_type_code)
+            pivots: np.ndarray = zigzag_engine.make_pivot_array(pivot_pdis, pivot_types, candles.times_ms, candles.high, candles.low)
 
-        self.zigzag_df = zigzag_df
+        self.zigzag_pivots = pivots
+        self.zigzag_index = ZigzagIndex(pivots, timezone=candles.timezone)
+        self.__zigzag_df = None
 
     def find_relative_pivot(self, pivot_pdi: int, delta: int) -> int:
         """
@@ -141,12 +131,9 @@ class Algo:
             int: The pdi of the relative pivot.
         """
 
-        # zigzag_idx is the zigzag_df index of the current pivot
-        zigzag_idx = self.zigzag_df[self.zigzag_df.pdi == pivot_pdi].first_valid_index()
-
-        return self.zigzag_df.iloc[zigzag_idx + delta].pdi
+        return self.zigzag_index.get_relative_pivot_pdi(pivot_pdi, delta)
 
-    def detect_first_broken_lpl(self, search_window_start_pdi: int) -> Union[None, tuple[pd.Series, int]]:
+    def detect_first_broken_lpl(self, search_window_start_pdi: int) -> Union[None, tuple[Pivot, int]]:
         """
         Calculates the LPL's and then broken LPL's in a series of zigzag pivots.
 
@@ -158,11 +145,18 @@ class Algo:
             search_window_start_pdi (int): The pdi of the pivot to start the search from.
 
         Returns:
-            pd.Series: a row of zigzag_df which contains the broken LPL
+            Pivot: The broken LPL, and the PDI of the candle which broke it
             None: If no broke LPL is found
         """
 
-        starting_pivot = self.zigzag_df[self.zigzag_df.pdi == search_window_start_pdi].iloc[0]
+        broken_lpl_data = self.__find_first_broken_lpl(search_window_start_pdi)
+
+        return broken_lpl_data[:2] if broken_lpl_data is not None else None
+
+    def __find_first_broken_lpl(self, search_window_start_pdi: int) -> Union[None, tuple[Pivot, int, int]]:
+        # The implementation of detect_first_broken_lpl, which also returns the PDI of the pivot which broke the LPL.
+
+        starting_pivot = self.zigzag_index.get_pivot(search_window_start_pdi)
         trend_type = "ascending" if starting_pivot.pivot_type == "valley" else "descending"
         # Breaking and extension pdi and values represent the values to surpass for registering a higher high (extension) of a lower low (breaking)
         breaking_pdi = search_window_start_pdi
@@ -171,7 +165,7 @@ class Algo:
         try:
             extension_pdi = self.find_relative_pivot(search_window_start_pdi, 1)
 
-            extension_value: float = self.zigzag_df.loc[self.zigzag_df.pdi == extension_pdi].iloc[0].pivot_value
+            extension_value: float = self.zigzag_index.get_value(extension_pdi)
 
             check_start_pdi = self.find_relative_pivot(search_window_start_pdi, 2)
 
@@ -179,7 +173,10 @@ class Algo:
         except IndexError:
             return None
 
-        for row in self.zigzag_df[self.zigzag_df.pdi >= check_start_pdi].iloc[:-1].itertuples():
+        # The last pivot is excluded from the check
+        for zigzag_row in range(self.zigzag_index.get_row(check_start_pdi), len(self.zigzag_index) - 1):
+            row: Pivot = self.zigzag_index.get_pivot_at_row(zigzag_row)
+
             if trend_type == "ascending":
                 extension_condition = row.pivot_type == "peak" and row.pivot_value >= extension_value
                 breaking_condition = row.pivot_type == "valley" and row.pivot_value <= breaking_value
@@ -196,34 +193,31 @@ class Algo:
                 # The candle search range starts at the pivot before the LPL-breaking pivot (which is typically a higher order pivot) PDI and the
                 # breaking pivot PDI.
                 pivot_before_breaking_pivot: int = self.find_relative_pivot(row.pdi, -1)
-                breaking_candle_search_window: pd.DataFrame = self.pair_df.loc[pivot_before_breaking_pivot + 1:row.pdi + 1]
+                breaking_candle_search_window: CandleFrame = self.candles.window(pivot_before_breaking_pivot + 1, row.pdi + 2)
 
                 # If the trend is ascending, it means the search window should be checked for the first candle that breaks the LPL by having a lower
                 # low than the breaking_value.
                 if trend_type == "ascending":
-                    lpl_breaking_candles = breaking_candle_search_window[breaking_candle_search_window.low < breaking_value]
+                    breaking_candle_pdi = breaking_candle_search_window.first_pdi_where(breaking_candle_search_window.low < breaking_value)
 
                 # If the trend is descending, the breaking candle must have a higher high than the breaking value.
                 else:
-                    lpl_breaking_candles = breaking_candle_search_window[breaking_candle_search_window.high > breaking_value]
-
-                breaking_candle_pdi = lpl_breaking_candles.first_valid_index()
+                    breaking_candle_pdi = breaking_candle_search_window.first_pdi_where(breaking_candle_search_window.high > breaking_value)
 
                 # If the search window for the breaking candle is empty, return the pivot as the breaking candle
                 if breaking_candle_pdi is None:
                     breaking_candle_pdi = row.pdi
 
-                return self.zigzag_df[self.zigzag_df.pdi == breaking_pdi].iloc[0], breaking_candle_pdi
+                return self.zigzag_index.get_pivot(breaking_pdi), breaking_candle_pdi, row.pdi
 
             # Extension
             if extension_condition:
                 # If a higher high is found, extend and update the pattern
 
                 prev_pivot_pdi = self.find_relative_pivot(row.pdi, -1)
-                prev_pivot = self.zigzag_df[self.zigzag_df.pdi == prev_pivot_pdi].iloc[0]
 
-                breaking_pdi = prev_pivot.pdi
-                breaking_value = prev_pivot.pivot_value
+                breaking_pdi = prev_pivot_pdi
+                breaking_value = self.zigzag_index.get_value(prev_pivot_pdi)
                 extension_value = row.pivot_value
 
             # If a break or extension has happened, the next LPL is the pivot at the breaking pivot
@@ -255,26 +249,23 @@ class Algo:
         """
 
         # We only go up to the second last candle in the pair_df, aka the last non-realtime candle, because otherwise, the close value of the candle
-        # might change and incorrectly register a break.
-        search_window: pd.DataFrame = self.pair_df.iloc[latest_pbos_pdi + 1:-1]
+        # might change and incorrectly register a break. The first crossings are found with the extrema tables of the candles, which are built once
+        # per Algo and queried in O(log n), instead of masking the whole window for every update of the thresholds.
+        search_start_pdi = latest_pbos_pdi + 1
+        search_end_pdi = self.candles.last_pdi
 
         # The definition of "breaking" is different whether the PBOS is a peak or a valley
         if trend_type == "ascending":
-            pbos_shadow_breaking_candles = search_window[search_window.high > latest_pbos_value]
-            pbos_close_breaking_candles = search_window[search_window.close > latest_pbos_value]
-            choch_shadow_breaking_candles = search_window[search_window.low < latest_choch_value]
-            choch_close_breaking_candles = search_window[search_window.close < latest_choch_value]
+            pbos_shadow_index = self.candles.first_pdi_above("high", latest_pbos_value, search_start_pdi, search_end_pdi)
+            pbos_close_index = self.candles.first_pdi_above("close", latest_pbos_value, search_start_pdi, search_end_pdi)
+            choch_shadow_index = self.candles.first_pdi_below("low", latest_choch_value, search_start_pdi, search_end_pdi)
+            choch_close_index = self.candles.first_pdi_below("close", latest_choch_value, search_start_pdi, search_end_pdi)
 
         else:
-            pbos_shadow_breaking_candles = search_window[search_window.low < latest_pbos_value]
-            pbos_close_breaking_candles = search_window[search_window.close < latest_pbos_value]
-            choch_shadow_breaking_candles = search_window[search_window.high > latest_choch_value]
-            choch_close_breaking_candles = search_window[search_window.close > latest_choch_value]
-
-        pbos_close_index = pbos_close_breaking_candles.first_valid_index()
-        pbos_shadow_index = pbos_shadow_breaking_candles.first_valid_index()
-        choch_shadow_index = choch_shadow_breaking_candles.first_valid_index()
-        choch_close_index = choch_close_breaking_candles.first_valid_index()
+            pbos_shadow_index = self.candles.first_pdi_below("low", latest_pbos_value, search_start_pdi, search_end_pdi)
+            pbos_close_index = self.candles.first_pdi_below("close", latest_pbos_value, search_start_pdi, search_end_pdi)
+            choch_shadow_index = self.candles.first_pdi_above("high", latest_choch_value, search_start_pdi, search_end_pdi)
+            choch_close_index = self.candles.first_pdi_above("close", latest_choch_value, search_start_pdi, search_end_pdi)
 
         # The return dicts for each case
         pbos_shadow_output = {
@@ -313,14 +304,14 @@ class Algo:
 
         return sorted_outputs[0] if len(sorted_outputs) > 0 else none_output
 
-    def __calc_region_start_pdi(self, broken_lpl: pd.Series) -> int:
+    def __calc_region_start_pdi(self, broken_lpl: Pivot) -> int:
         """
         Initializes the starting point of the region after the broken LPL
 
         The region starting point is the first pivot right after the broken LPL
 
         Args:
-            broken_lpl (pd.Series): The broken LPL
+            broken_lpl (Pivot): The broken LPL
         """
 
         # The pivots located between the starting point and the first pivot after the broken LPL. The starting point is either
@@ -330,7 +321,7 @@ class Algo:
 
         return region_start_pdi
 
-    def calc_h_o_zigzag(self, starting_point_pdi) -> None:
+    def calc_h_o_zigzag(self, starting_point_pdi, h_o_state: HOZigzagState = None) -> None:
         """
         Calculates the higher order zigzag for the given starting point.
 
@@ -349,31 +340,42 @@ class Algo:
 
         The loop continues until no more candles are found that break the PBOS or CHOCH even with a shadow.
 
+        If a HOZigzagState is given, the loop resumes from its checkpoint (if it is still valid for the candles), and the checkpoint is moved to the
+        last settled iteration of the loop. See HOZigzagState for when an iteration is settled.
+
         Args:
             starting_point_pdi (int): The starting point of the higher order zigzag.
+            h_o_state (HOZigzagState): The persistent higher order zigzag state of the pair, if any.
 
         Returns:
             None
         """
 
-        # Set the starting point of the HO zigzag and add it
-        self.starting_pdi = starting_point_pdi
-        self.h_o_indices.append(self.starting_pdi)
+        if h_o_state is not None and h_o_state.can_resume(starting_point_pdi, self.candles):
+            pattern_start_pdi, latest_pbos_pdi, latest_pbos_threshold, latest_choch_threshold = h_o_state.restore(self)
+
+        else:
+            # Set the starting point of the HO zigzag and add it
+            self.starting_pdi = starting_point_pdi
+            self.h_o_indices.append(self.starting_pdi)
+
+            # The first CHOCH is always the starting point, until it is updated when a BOS or a CHOCH is broken.
+            latest_choch_threshold: float = self.zigzag_index.get_value(self.starting_pdi)
 
-        # The first CHOCH is always the starting point, until it is updated when a BOS or a CHOCH is broken.
-        latest_choch_threshold: float = self.zigzag_df[self.zigzag_df.pdi == self.starting_pdi].iloc[0].pivot_value
+            # The starting point of each pattern. This resets and changes whenever the pattern needs to be restarted. Unlike self.starting_pdi this
+            # DOES change.
+            pattern_start_pdi = self.starting_pdi
 
-        # The starting point of each pattern. This resets and changes whenever the pattern needs to be restarted. Unlike self.starting_pdi this DOES
-        # change.
-        pattern_start_pdi = self.starting_pdi
+            latest_pbos_pdi = None
+            latest_pbos_threshold = None
 
-        latest_pbos_pdi = None
-        latest_pbos_threshold = None
+        # Checkpoints can only be made while all the iterations so far have been settled, and only if it is known which pivots are final.
+        is_settled: bool = h_o_state is not None and self.stable_pivot_end_pdi is not None
 
         # The loop which continues until the end of the pattern is reached.
         while True:
             # Find the first broken LPL after the starting point and the region starting point
-            broken_lpl_output_set = self.detect_first_broken_lpl(pattern_start_pdi)
+            broken_lpl_output_set = self.__find_first_broken_lpl(pattern_start_pdi)
 
             # If no broken LPL can be found, just quit
             if broken_lpl_output_set is None:
@@ -382,6 +384,7 @@ class Algo:
             else:
                 broken_lpl = broken_lpl_output_set[0]
                 lpl_breaking_pdi: int = broken_lpl_output_set[1]
+                lpl_breaking_pivot_pdi: int = broken_lpl_output_set[2]
 
             # If the LPL type is valley, it means the trend type is ascending
             trend_type = "ascending" if broken_lpl.pivot_type == "valley" else "descending"
@@ -393,7 +396,7 @@ class Algo:
             # iteration, latest_pbos_pdi is set to None.
             if latest_pbos_pdi is None:
                 latest_pbos_pdi = bos_pdi
-                latest_pbos_threshold = self.zigzag_df[self.zigzag_df.pdi == bos_pdi].iloc[0].pivot_value
+                latest_pbos_threshold = self.zigzag_index.get_value(bos_pdi)
 
                 # Add the BOS to the HO indices
                 self.h_o_indices.append(bos_pdi)
@@ -419,13 +422,11 @@ class Algo:
             if breaking_sentiment == "PBOS_SHADOW":
 
                 latest_pbos_pdi = breaking_pdi
-                latest_pbos_threshold = self.pair_df.iloc[breaking_pdi].high if trend_type == "ascending" else \
-                    self.pair_df.iloc[breaking_pdi].low
+                latest_pbos_threshold = self.candles.high[breaking_pdi] if trend_type == "ascending" else self.candles.low[breaking_pdi]
 
             # If a candle breaks the CHOCH with its shadow (And ONLY its shadow, not its close value), update the latest CHOCH pdi and threshold
             elif breaking_sentiment == "CHOCH_SHADOW":
-                latest_choch_threshold = self.pair_df.iloc[breaking_pdi].low if trend_type == "ascending" else \
-                    self.pair_df.iloc[breaking_pdi].high
+                latest_choch_threshold = self.candles.low[breaking_pdi] if trend_type == "ascending" else self.candles.high[breaking_pdi]
 
             # If a candle CLOSES above the latest PBOS value, it means we have found an extremum, which would be the lowest low zigzag pivot between
             # the latest HO zigzag point (The initial BOS before being updated with shadows) and the candle which closed above it. After detecting
@@ -435,30 +436,17 @@ class Algo:
                 # the closing candle
                 extremum_point_pivot_type = "valley" if trend_type == "ascending" else "peak"
 
-                # extremum_point_pivots_of_type is a list of all the pivots of the right type for the extremum
-                extremum_point_pivots_of_type = self.zigzag_df[
-                    (self.zigzag_df.pdi >= self.h_o_indices[-1])
-                    & (self.zigzag_df.pdi <= breaking_pdi)
-                    & (self.zigzag_df.pivot_type == extremum_point_pivot_type)]
-
-                # The extremum pivot is the lowest low / the highest high in the region between the first PBOS and the closing candle
-                if extremum_point_pivot_type == "peak":
-                    extremum_pivot = extremum_point_pivots_of_type.loc[
-                        extremum_point_pivots_of_type['pivot_value'].idxmax()]
-                else:
-                    extremum_pivot = extremum_point_pivots_of_type.loc[
-                        extremum_point_pivots_of_type['pivot_value'].idxmin()]
+                # The extremum pivot is the lowest low / the highest high of the pivots of the right type in the region between the first PBOS and
+                # the closing candle
+                extremum_pivot_pdi = self.zigzag_index.get_extremum_pivot_pdi(extremum_point_pivot_type, self.h_o_indices[-1], breaking_pdi)
 
                 # Add the extremum point to the HO indices
-                self.h_o_indices.append(int(extremum_pivot.pdi))
+                self.h_o_indices.append(extremum_pivot_pdi)
 
                 # Now, we can restart finding HO pivots. Starting point is set to the last LPL of the same type BEFORE the BOS breaking candle.
                 # Trend stays the same since no CHOCH has occurred.
                 pivot_type = "valley" if trend_type == "ascending" else "peak"
-                pivots_of_type_before_closing_candle = self.zigzag_df[(self.zigzag_df.pivot_type == pivot_type)
-                                                                      & (self.zigzag_df.pdi <= breaking_pdi)]
-
-                pattern_start_pdi = pivots_of_type_before_closing_candle.iloc[-1].pdi
+                pattern_start_pdi = self.zigzag_index.get_last_pivot_pdi_of_type(pivot_type, breaking_pdi)
 
                 # Essentially reset the algorithm
                 latest_pbos_pdi = None
@@ -480,7 +468,7 @@ class Algo:
 
                 # New lowest low is our CHOCH.
                 latest_choch_pdi = self.h_o_indices[-1]
-                latest_choch_threshold = self.zigzag_df[self.zigzag_df.pdi == latest_choch_pdi].iloc[0].pivot_value
+                latest_choch_threshold = self.zigzag_index.get_value(latest_choch_pdi)
 
             # If a CHOCH has happened, this means the pattern has inverted and should be restarted with the last LPL before the candle which closed
             # below the CHOCH.
@@ -490,10 +478,7 @@ class Algo:
 
                 # Set the pattern start to the last inverse pivot BEFORE the closing candle
                 pivot_type = "valley" if trend_type == "ascending" else "peak"
-                pivots_of_type_before_closing_candle = self.zigzag_df[(self.zigzag_df.pivot_type == pivot_type)
-                                                                      & (self.zigzag_df.pdi <= breaking_pdi)]
-
-                pattern_start_pdi = pivots_of_type_before_closing_candle.iloc[-1].pdi
+                pattern_start_pdi = self.zigzag_index.get_last_pivot_pdi_of_type(pivot_type, breaking_pdi)
 
                 # A segment is added to the list of segments here. Each segment starts at the pivot before the low that was just broken by a candle
                 # closing below it. The segment ends at the CHOCH_CLOSE event, at the candle that closed above the high.
@@ -512,7 +497,7 @@ class Algo:
 
                 # Essentially reset the algorithm
                 latest_choch_pdi = self.h_o_indices[-1]
-                latest_choch_threshold = self.zigzag_df[self.zigzag_df.pdi == latest_choch_pdi].iloc[0].pivot_value
+                latest_choch_threshold = self.zigzag_index.get_value(latest_choch_pdi)
 
                 latest_pbos_pdi = None
 
@@ -520,11 +505,20 @@ class Algo:
             else:
                 break
 
+            # The iteration depended on the pivots up to the one after the LPL-breaking pivot, and on the candles up to the breaking candle. If
+            # these are all final, the state after the iteration is saved as the checkpoint.
+            if is_settled:
+                iteration_horizon_pdi = max(self.find_relative_pivot(lpl_breaking_pivot_pdi, 1), breaking_pdi)
+                is_settled = iteration_horizon_pdi < self.stable_pivot_end_pdi
+
+                if is_settled:
+                    h_o_state.save(self, pattern_start_pdi, latest_pbos_pdi, latest_pbos_threshold, latest_choch_threshold, iteration_horizon_pdi)
+
         # return self.h_o_indices
 
     def convert_pdis_to_times(self, pdis: Union[int, list[int]]) -> Union[pd.Timestamp, list[pd.Timestamp], None]:
         """
-        Convert a list (or a single) of PDIs to their corresponding times using algo_code.pair_df.
+        Convert a list (or a single) of PDIs to their corresponding times using the candles of the pair.
 
         Args:
             pdis (list[int]): List of PDIs to convert.
@@ -542,8 +536,8 @@ class Algo:
         if len(pdis) == 0:
             return []
 
-        # Map PDIs to their corresponding times
-        times = [self.pair_df.iloc[pdi].time for pdi in pdis]
+        # Map PDIs to their corresponding times, all at once
+        times = self.candles.get_times(pdis)
 
         # If it's a singular entry, return it as a single timestamp
         if len(times) == 1:
@@ -596,12 +590,11 @@ class Algo:
             # The pivot types we need are linked to the trend direction, which in the case of a BOS formation type, would be in the same as the latest
             # segment. We need the correct pivot type to use the detect_first_broken_lpl method correctly.
             pivot_type = "valley" if latest_segment.type == "ascending" else "peak"
-            pivots_of_type_before_closing_candle = self.zigzag_df[(self.zigzag_df.pivot_type == pivot_type)
-                                                                  & (self.zigzag_df.pdi <= latest_segment.end_pdi)]
+            last_pivot_of_type_before_closing_candle = self.zigzag_index.get_last_pivot_pdi_of_type(pivot_type, latest_segment.end_pdi)
 
             # The detect_first_broken_lpl method returns two things as a tuple: 1) The LPL that was broken 2) The PDI of the candle that broke the
             # LPL.
-            broken_lpl_data = self.detect_first_broken_lpl(pivots_of_type_before_closing_candle.iloc[-1].pdi)
+            broken_lpl_data = self.detect_first_broken_lpl(last_pivot_of_type_before_closing_candle)
 
             # The end of the search window is set as the first broken LPL AFTER the LAST LOW before the end of the last segment.
             # If the detect_first_broken_lpl method returns a value, that means a broken LPL has been found. If not, the method returns None,
@@ -628,9 +621,8 @@ class Algo:
             position_search_start_pdi: int = self.h_o_indices[-1]
 
             pivot_type = "peak" if latest_segment.type == "ascending" else "valley"
-            pivots_of_type_before_closing_candle = self.zigzag_df[(self.zigzag_df.pivot_type == pivot_type)
-                                                                  & (self.zigzag_df.pdi <= latest_segment.end_pdi)]
-            broken_lpl_data = self.detect_first_broken_lpl(pivots_of_type_before_closing_candle.iloc[-1].pdi)
+            last_pivot_of_type_before_closing_candle = self.zigzag_index.get_last_pivot_pdi_of_type(pivot_type, latest_segment.end_pdi)
+            broken_lpl_data = self.detect_first_broken_lpl(last_pivot_of_type_before_closing_candle)
 
             if broken_lpl_data:
                 position_search_end_pdi: int = broken_lpl_data[0].pdi
@@ -647,6 +639,13 @@ class Algo:
             else:
                 return None
 
+    @staticmethod
+    def __log_cancel_result(pair_name: str, ob_id: str, channel_id: str, cancel_future: Future) -> None:
+        if cancel_future.exception() is None:
+            logger.warning(f"\t{make_set_width(pair_name)}\tCanceled position {ob_id} in channel {channel_id}...")
+        else:
+            logger.error(f"\t{make_set_width(pair_name)}\tFailed to cancel position {ob_id} in channel {channel_id}: {cancel_future.exception()}")
+
     def determine_main_loop_start_type(self, pair_name: str, positions_info_dict) -> Literal["NO_NEW_SEGMENT", "RESET_POSITIONS"]:
         """
         Resets the algorithm from the beginning in two cases: 1) If the segment that the most recent positions are in ends 2) If no latest segment has
@@ -661,8 +660,10 @@ class Algo:
         # starting fresh with no latest_segment registered), that means the old segment has been invalidated by a new segment forming.
         # In this case, the existing positions (if any) should be canceled and new ones should be posted or awaited.
         is_starting_fresh: bool = positions_info_dict[pair_name]["latest_segment_start_time"] is None
-        is_new_segment_found: bool = is_starting_fresh or self.convert_pdis_to_times(self.segments[-1].start_pdi) > positions_info_dict[pair_name][
-            "latest_segment_start_time"]
+        # The latest segment is new if it starts after the candle of the registered start time. This is checked in PDIs, by mapping the registered
+        # time to the first candle after it.
+        is_new_segment_found: bool = is_starting_fresh or self.segments[-1].start_pdi >= self.candles.find_pdi(
+            positions_info_dict[pair_name]["latest_segment_start_time"], side="right")
 
         # If we are not in a new segment, and we aren't starting with no positions, we can skip the rest of the code for this pair.
         if not is_new_segment_found and not is_starting_fresh:
@@ -676,25 +677,19 @@ class Algo:
             elif is_new_segment_found:
                 logger.info(f"\t{make_set_width(pair_name)}\tNew segment found, canceling prior positions...")
 
+                # The cancel messages are only queued, the outbox posts them (and retries them) in the background and the results are logged once
+                # they're posted.
                 for position in positions_info_dict[pair_name]["positions"]:
-                    attempts = 0
-                    while attempts < 3:
-                        try:
-                            position.cancel_position()
-
-                            logger.warning(f"\t{make_set_width(pair_name)}\tCanceled position {position.parent_ob.id}...")
-                            break
+                    try:
+                        cancel_futures = position.cancel_position()
 
-                        except RuntimeError:
-                            logger.warning(
-                                f"\t{make_set_width(pair_name)}\tPosition {position.parent_ob.id} wasn't canceled as it had been entered before.")
-                            break
+                    except RuntimeError:
+                        logger.warning(
+                            f"\t{make_set_width(pair_name)}\tPosition {position.parent_ob.id} wasn't canceled as it had been entered before.")
+                        continue
 
-                        except Exception as e:
-                            attempts += 1
-                            if attempts == 3:
-                                logger.error(
-                                    f"\t{make_set_width(pair_name)}\tFailed to cancel position {position.parent_ob.id} after 3 attempts: {e}")
+                    for channel_id, cancel_future in cancel_futures.items():
+                        cancel_future.add_done_callback(partial(self.__log_cancel_result, pair_name, position.parent_ob.id, channel_id))
 
             # Empty the list of positions, so we can wait for a new one.
             positions_info_dict[pair_name]["positions"] = []
@@ -710,14 +705,14 @@ class Algo:
 
             return "RESET_POSITIONS"
 
-    def define_replacement_ob_threshold(self, pivot: pd.Series) -> int:
+    def define_replacement_ob_threshold(self, pivot: Union[pd.Series, Pivot]) -> int:
         """
         Form a window of candles to check for replacement order blocks. This window is bound by the current pivot and the next pivot of
         opposite type, hence the pivot and the pivot found by shifting it by 1. This is a naive implementation, and under normal
         circumstances we don't need to check that far.
 
         Args:
-            pivot (pd.Series): A lower order zigzag pivot, located at the start (Or the "tip") of a lower order leg.
+            pivot (pd.Series | Pivot): A lower order zigzag pivot, located at the start (Or the "tip") of a lower order leg.
 
         Returns:
             int: The PDI of the last candle that should be checked for a replacement OB base candle.
@@ -727,12 +722,12 @@ class Algo:
             replacement_ob_threshold_pdi = self.find_relative_pivot(pivot.pdi, 1)
         except IndexError:
             # If no next pivot exists for whatever reason, just set the threshold to the last valid index of the dataframe.
-            replacement_ob_threshold_pdi = self.pair_df.last_valid_index()
+            replacement_ob_threshold_pdi = self.candles.last_pdi
 
         return replacement_ob_threshold_pdi
 
     def form_potential_ob(self,
-                          base_candle: pd.Series,
+                          base_candle: Union[pd.Series, Candle],
                           base_pivot_type: str,
                           initial_pivot_candle_liquidity: float,
                           position_activation_threshold: int) -> OrderBlock | None:
@@ -740,7 +735,7 @@ class Algo:
             Forms a potential order block (OB) based on the given base candle and conditions.
 
             Args:
-                base_candle (pd.Series): The base candle to form the order block.
+                base_candle (pd.Series | Candle): The base candle to form the order block.
                 base_pivot_type (str): The type of the base pivot, either "valley" or "peak".
                 initial_pivot_candle_liquidity (float): The liquidity of the pivot candle, used to determine the stoploss level.
                 position_activation_threshold (int): The PDI of the candle after which the positions are activated.
@@ -749,48 +744,122 @@ class Algo:
                 OrderBlock | None: The formed order block after checking the conditions, otherwise None if no exit candle is found.
             """
 
+        # In validation mode, the algorithm won't avoid posting positions that have been entered by price movements after the activation threshold,
+        # therefore the positions can be more thoroughly examined.
+        checks_end_pdi = position_activation_threshold if constants.validation_mode else None
+
+        return self.__form_ob(base_candle, base_pivot_type, initial_pivot_candle_liquidity, position_activation_threshold, checks_end_pdi)
+
+    def __form_ob(self,
+                  base_candle: Union[pd.Series, Candle],
+                  base_pivot_type: str,
+                  initial_pivot_candle_liquidity: float,
+                  upper_search_bound_pdi: int,
+                  checks_end_pdi: int | None) -> OrderBlock | None:
+        # Form an order block and run its checks, with the exit candle searched up to upper_search_bound_pdi and the reentry and condition check
+        # windows ending before checks_end_pdi (or at the end of the candles if it is None).
         ob = OrderBlock(base_candle=base_candle,
                         icl=initial_pivot_candle_liquidity,
                         ob_type="long" if base_pivot_type == "valley" else "short")
 
         # Try to find a valid exit candle for the order block.
-        ob.register_exit_candle(self.pair_df, position_activation_threshold)
-
-        # If a valid exit candle is found, form the reentry check window.
-        if ob.price_exit_index is not None:
-            # In validation mode, the algorithm won't avoid posting positions that have been entered by price movements after the
-            # activation threshold, therefore the positions can be more thoroughly examined.
-            if constants.validation_mode:
-                reentry_check_window: pd.DataFrame = self.pair_df.iloc[ob.price_exit_index + 1:position_activation_threshold]
-            else:
-                reentry_check_window: pd.DataFrame = self.pair_df.iloc[ob.price_exit_index + 1:]
+        ob.register_exit_candle(self.candles, upper_search_bound_pdi)
 
         # If no exit candle is found, that means that order block isn't valid. None is returned.
-        else:
+        if ob.price_exit_index is None:
             return None
 
         # Order block condition checks
+        reentry_check_window: CandleFrame = self.candles.window(ob.price_exit_index + 1, checks_end_pdi)
         ob.check_reentry_condition(reentry_check_window)
 
-        if constants.validation_mode:
-            conditions_check_window: pd.DataFrame = self.pair_df[ob.start_index:position_activation_threshold]
-        else:
-            conditions_check_window: pd.DataFrame = self.pair_df[ob.start_index:]
-
+        conditions_check_window: CandleFrame = self.candles.window(ob.start_index, checks_end_pdi)
         ob.set_condition_check_window(conditions_check_window)
         ob.check_fvg_condition()
         ob.check_stop_break_condition()
 
         return ob
 
+    def find_first_valid_ob(self,
+                            pivot: Pivot,
+                            base_pivot_type: str,
+                            upper_search_bound_pdi: int,
+                            checks_end_pdi: int | None) -> tuple[OrderBlock, int] | None:
+        """
+        Find the first base candle of a lower order leg which forms a valid order block, moving the base candle from the pivot at the tip of the leg
+        up to the replacement OB threshold. All the candidates of the leg are checked at once with OrderBlockCandidates, and an OrderBlock is only
+        formed for the first one which passes all the checks, from the results of its checks.
+
+        Args:
+            pivot (Pivot): The lower order pivot at the tip of the leg, whose value is the initial candle liquidity of the order block.
+            base_pivot_type (str): The type of the base pivot, either "valley" or "peak".
+            upper_search_bound_pdi (int): The PDI of the last candle to search for exit candles in.
+            checks_end_pdi (int | None): The PDI after the last candle of the reentry and condition check windows, None for the end of the candles.
+
+        Returns:
+            tuple[OrderBlock, int]: The order block, and the times the base candle was moved to find it.
+            None: If no candidate forms a valid order block.
+        """
+
+        replacement_ob_threshold_pdi = self.define_replacement_ob_threshold(pivot)
+
+        candidates = OrderBlockCandidates(self.candles,
+                                          start_pdi=pivot.pdi,
+                                          end_pdi=replacement_ob_threshold_pdi,
+                                          ob_type="long" if base_pivot_type == "valley" else "short",
+                                          upper_search_bound_pdi=upper_search_bound_pdi,
+                                          checks_end_pdi=checks_end_pdi)
+
+        candidate_index = candidates.first_valid_index()
+        if candidate_index is None:
+            return None
+
+        ob = candidates.form_order_block(candidate_index, icl=pivot.pivot_value)
+
+        return ob, candidates.count_replacements(candidate_index)
+
+    @staticmethod
+    def register_entries_since(positions: list[Position], candles: CandleFrame, since_time: pd.Timestamp | None) -> list[Position]:
+        """
+        Register the entries of positions by all the candles from the one which opened at since_time up to the latest candle. The latest candle of
+        the last check was still forming, so its full range is only known once it has closed, and it is checked again along with the candles
+        after it.
+
+        Args:
+            positions (list[Position]): The positions to check.
+            candles (CandleFrame): The candles of the pair.
+            since_time (pd.Timestamp | None): The open time of the latest candle at the last check, or None to only check the latest candle.
+
+        Returns:
+            list[Position]: The positions which have been newly entered by the candles.
+        """
+
+        start_pdi = candles.last_pdi if since_time is None else min(candles.find_pdi(since_time), candles.last_pdi)
+
+        # The candles enter the same positions as a single candle with their lowest low and highest high.
+        aggregated_candle = Candle(start_pdi, candles.get_time(start_pdi), candles.open[start_pdi - candles.first_pdi],
+                                   candles.range_max_high(start_pdi, None), candles.range_min_low(start_pdi, None),
+                                   candles.close[candles.last_pdi - candles.first_pdi])
+
+        newly_entered_positions = []
+        for position in positions:
+            if position.has_been_entered:
+                continue
+
+            Algo.register_possible_position_entries(position, aggregated_candle)
+            if position.has_been_entered:
+                newly_entered_positions.append(position)
+
+        return newly_entered_positions
+
     @staticmethod
-    def register_possible_position_entries(position: Position, latest_candle):
+    def register_possible_position_entries(position: Position, latest_candle: Union[pd.Series, Candle]):
         """
         Sets the .has_been_entered property of all positions which have been entered by the latest candle.
 
         Args:
             position (Position): The position to check.
-            latest_candle (pd.Series): The latest candle.
+            latest_candle (pd.Series | Candle): The latest candle, either as a pair_df row or as a Candle from a CandleFrame.
         """
 
         if position.type == 'long':
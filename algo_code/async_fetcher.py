@@ -0,0 +1,131 @@
+import asyncio
+import time
+import aiohttp
+import numpy as np
+import pandas as pd
+
+from algo_code.general_utils import get_cached_candles, update_cached_candles, compute_backfill_windows, count_expected_candles
+from algo_code.kline_parsing import parse_klines_page
+from algo_code.request_scheduler import klines_weight_scheduler, max_rate_limited_retries
+from utils import constants
+
+
+class AsyncKlineFetcher:
+    """
+    Fetches the klines of many pairs concurrently on a single asyncio event loop, sharing one aiohttp connection pool.
+
+    The event loop and the session are kept alive between calls, so the connections to the klines endpoint are reused across main loop iterations
+    instead of being opened (with a new TLS handshake) for every page. The number of concurrent connections to the endpoint is capped by
+    max_connections_per_host.
+    """
+
+    def __init__(self, max_connections_per_host: int):
+        self.max_connections_per_host: int = max_connections_per_host
+        self.event_loop = asyncio.new_event_loop()
+        self.session: aiohttp.ClientSession | None = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections_per_host, limit_per_host=self.max_connections_per_host)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+
+        return self.session
+
+    async def fetch_klines_range(self, symbol: str, start_time_ms: int, end_time_ms: int) -> tuple[list[np.ndarray], list[np.ndarray]] | None:
+        # The asyncio counterpart of general_utils.fetch_klines_range, paginating sequentially through the range.
+        session = await self.get_session()
+        url = f"{constants.binance_rest_url}/klines"
+
+        all_open_times_ms: list[np.ndarray] = []
+        all_prices: list[np.ndarray] = []
+        current_start_time_ms = start_time_ms
+        rate_limited_retries = 0
+
+        while (expected_candles := count_expected_candles(current_start_time_ms, end_time_ms)) > 0:
+            # Only as many candles as expected in the remaining time range are requested, since smaller limits have a lower request weight.
+            limit = klines_weight_scheduler.choose_limit(expected_candles)
+            params = {
+                "symbol": symbol,
+                "interval": constants.timeframe,
+                "startTime": current_start_time_ms,
+                "endTime": end_time_ms,
+                "limit": limit
+            }
+
+            try:
+                await klines_weight_scheduler.acquire_async(limit)
+                async with session.get(url, params=params) as response:
+                    klines_weight_scheduler.register_response(response.status, response.headers)
+
+                    # Rate limited requests are retried after the pause set by the scheduler
+                    if response.status in [418, 429] and rate_limited_retries < max_rate_limited_retries:
+                        rate_limited_retries += 1
+                        continue
+
+                    response.raise_for_status()
+                    open_times_ms, prices = parse_klines_page(await response.read())
+                if len(open_times_ms) == 0:
+                    break
+                all_open_times_ms.append(open_times_ms)
+                all_prices.append(prices)
+                current_start_time_ms = int(open_times_ms[-1]) + 1  # Move to the next timestamp after the last one fetched
+
+                # A page with fewer candles than the limit is the last one, so no extra request is spent on an empty page.
+                if len(open_times_ms) < limit:
+                    break
+            except Exception as e:
+                return None
+
+        return all_open_times_ms, all_prices
+
+    async def fetch_klines(self, symbol: str, start_time_ms: int, end_time_ms: int) -> tuple[list[np.ndarray], list[np.ndarray]] | None:
+        # The asyncio counterpart of general_utils.fetch_klines. The backfill windows are fetched concurrently on the shared connection pool.
+        backfill_windows = compute_backfill_windows(start_time_ms, end_time_ms) if constants.parallel_backfill else [(start_time_ms, end_time_ms)]
+
+        if len(backfill_windows) <= 1:
+            return await self.fetch_klines_range(symbol, start_time_ms, end_time_ms)
+
+        windows_klines = await asyncio.gather(*[self.fetch_klines_range(symbol, *window) for window in backfill_windows])
+
+        if any(window_klines is None for window_klines in windows_klines):
+            return None
+
+        return ([page for window_klines in windows_klines for page in window_klines[0]],
+                [page for window_klines in windows_klines for page in window_klines[1]])
+
+    async def fetch_data_for_symbol(self, symbol: str, start_time: pd.Timestamp) -> tuple[str, pd.DataFrame | None]:
+        cached_df, start_time_ms = get_cached_candles(symbol, start_time)
+        end_time_ms = int(time.time() * 1000)  # Current time in milliseconds
+
+        fetched_klines = await self.fetch_klines(symbol, start_time_ms, end_time_ms)
+        if fetched_klines is None:
+            return symbol, None
+
+        return symbol, update_cached_candles(symbol, cached_df, *fetched_klines)
+
+    async def fetch_all(self, symbols: list, start_times: dict) -> dict:
+        results = await asyncio.gather(*[self.fetch_data_for_symbol(symbol, start_times[symbol]) for symbol in symbols])
+
+        return {symbol: pair_df for symbol, pair_df in results}
+
+    def get_pairs_data(self, symbols: list, start_times: dict) -> dict:
+        return self.event_loop.run_until_complete(self.fetch_all(symbols, start_times))
+
+
+async_kline_fetcher = AsyncKlineFetcher(max_connections_per_host=constants.fetch_concurrency)
+
+
+def get_pairs_data_async(symbols: list, start_times: dict) -> dict:
+    """
+    Fetch the historical kline data for the given symbols with the shared asyncio fetcher. This is a drop-in replacement for
+    get_pairs_data_parallel.
+
+    Args:
+        symbols (list): List of trading pair symbols.
+        start_times (dict): Dictionary containing start_time of the candles for each symbol.
+
+    Returns:
+        dict: Dictionary containing the historical kline data for each symbol, or None for the pairs whose fetching failed.
+    """
+
+    return async_kline_fetcher.get_pairs_data(symbols, start_times)
@@ -0,0 +1,292 @@
+import numpy as np
+import pandas as pd
+
+from algo_code.datatypes import Candle
+from algo_code.extrema_table import ExtremaTable
+from algo_code.time_index import PdiTimeIndex
+
+
+class CandleFrame:
+    """
+    A compact, column-oriented container for the candles of a pair, used by the hot paths of the algorithm instead of pair_df.
+
+    The open times are stored as int64 UNIX timestamps in milliseconds, the prices as float64 (or float32 to halve their memory) arrays and the candle
+    color as a boolean is_green array, instead of the datetime, float64 and 'green'/'red' string columns of pair_df. The candles are addressed by
+    their PDI, the same as the index of pair_df. A CandleFrame can also be a window of a bigger frame, sharing its arrays, in which case first_pdi is
+    the PDI of its first candle.
+    """
+
+    def __init__(self, times_ms: np.ndarray,
+                 open: np.ndarray,
+                 high: np.ndarray,
+                 low: np.ndarray,
+                 close: np.ndarray,
+                 is_green: np.ndarray,
+                 first_pdi: int = 0,
+                 timezone=None):
+
+        self.times_ms: np.ndarray = times_ms
+        self.open: np.ndarray = open
+        self.high: np.ndarray = high
+        self.low: np.ndarray = low
+        self.close: np.ndarray = close
+        self.is_green: np.ndarray = is_green
+
+        self.first_pdi: int = first_pdi
+        # The timezone of the time column of the pair_df the frame was built from, if any, so the times are converted back the same way.
+        self.timezone = timezone
+
+        # The extrema tables of the price columns, built on their first query. A window uses the tables of the frame it was cut from (its root), so
+        # the tables are built once for all the windows of the candles and the range queries on a window are O(1) or O(log n).
+        self.__extrema_tables: dict[str, ExtremaTable] = {}
+        self.__root: CandleFrame = self
+
+        # The PDI <-> time index of the frame, built on its first use.
+        self.__time_index: PdiTimeIndex | None = None
+
+    @staticmethod
+    def create(candles: "pd.DataFrame | CandleFrame") -> "CandleFrame":
+        # Accept both representations of the candles. DataFrames are converted, CandleFrames are returned as they are.
+        if isinstance(candles, CandleFrame):
+            return candles
+
+        return CandleFrame.from_pair_df(candles)
+
+    @staticmethod
+    def from_columns(open_times_ms: np.ndarray, prices: np.ndarray, price_dtype=np.float64) -> "CandleFrame":
+        """
+        Build a CandleFrame from typed kline columns, as returned by kline_parsing.parse_klines_page.
+
+        Args:
+            open_times_ms (np.ndarray): The open times of the candles, as UNIX timestamps in milliseconds.
+            prices (np.ndarray): The open, high, low and close prices of the candles, as an (N, 4) array.
+            price_dtype: The dtype to store the prices with, float64 or float32.
+
+        Returns:
+            CandleFrame: The candles.
+        """
+
+        prices = np.asarray(prices, dtype=price_dtype)
+
+        return CandleFrame(times_ms=np.asarray(open_times_ms, dtype=np.int64),
+                           open=np.ascontiguousarray(prices[:, 0]),
+                           high=np.ascontiguousarray(prices[:, 1]),
+                           low=np.ascontiguousarray(prices[:, 2]),
+                           close=np.ascontiguousarray(prices[:, 3]),
+                           is_green=prices[:, 3] > prices[:, 0])
+
+    @staticmethod
+    def from_pair_df(pair_df: pd.DataFrame, price_dtype=np.float64) -> "CandleFrame":
+        """
+        Build a CandleFrame from a pair_df. The candle colors are taken from the candle_color column as they are, so the algorithm behaves the same on
+        both representations.
+
+        Args:
+            pair_df (pd.DataFrame): The candles, with the time, open, high, low, close and candle_color columns.
+            price_dtype: The dtype to store the prices with, float64 or float32.
+
+        Returns:
+            CandleFrame: The candles.
+        """
+
+        time_column: pd.Series = pair_df["time"]
+        timezone = time_column.dt.tz
+        if timezone is not None:
+            time_column = time_column.dt.tz_convert(None)
+
+        return CandleFrame(times_ms=time_column.to_numpy(dtype="datetime64[ms]").view(np.int64),
+                           open=pair_df["open"].to_numpy(dtype=price_dtype),
+                           high=pair_df["high"].to_numpy(dtype=price_dtype),
+                           low=pair_df["low"].to_numpy(dtype=price_dtype),
+                           close=pair_df["close"].to_numpy(dtype=price_dtype),
+                           is_green=pair_df["candle_color"].to_numpy() == "green",
+                           first_pdi=int(pair_df.index[0]) if len(pair_df) > 0 else 0,
+                           timezone=timezone)
+
+    def to_pair_df(self) -> pd.DataFrame:
+        # Materialize the frame as a pair_df, e.g. for logging or the parts of the code which still work on DataFrames.
+        pair_df = pd.DataFrame({
+            "time": self.to_datetimes(self.times_ms),
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close
+        }, index=pd.RangeIndex(self.first_pdi, self.first_pdi + len(self)))
+
+        pair_df["candle_color"] = np.where(self.is_green, "green", "red")
+
+        return pair_df
+
+    def __len__(self) -> int:
+        return len(self.times_ms)
+
+    def __repr__(self):
+        return f"CandleFrame of {len(self)} candles starting at PDI {self.first_pdi}"
+
+    @property
+    def last_pdi(self) -> int:
+        return self.first_pdi + len(self) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in [self.times_ms, self.open, self.high, self.low, self.close, self.is_green])
+
+    def window(self, start_pdi: int = None, end_pdi: int = None) -> "CandleFrame":
+        """
+        Get the candles from start_pdi up to (and NOT including) end_pdi as a CandleFrame sharing the arrays of this one. Like iloc slicing, the
+        bounds are clipped to the frame.
+
+        Args:
+            start_pdi (int): The PDI of the first candle of the window, defaults to the first candle.
+            end_pdi (int): The PDI of the candle after the last candle of the window, defaults to the end of the frame.
+
+        Returns:
+            CandleFrame: The window.
+        """
+
+        start, end = self.__to_positions(start_pdi, end_pdi)
+
+        window = CandleFrame(times_ms=self.times_ms[start:end],
+                           open=self.open[start:end],
+                           high=self.high[start:end],
+                           low=self.low[start:end],
+                           close=self.close[start:end],
+                           is_green=self.is_green[start:end],
+                           first_pdi=self.first_pdi + start,
+                           timezone=self.timezone)
+        window.__root = self.__root
+
+        return window
+
+    def first_pdi_where(self, mask: np.ndarray) -> int | None:
+        # The counterpart of DataFrame.first_valid_index() on a filtered window: the PDI of the first True element of a mask over this frame.
+        true_indices = np.flatnonzero(mask)
+
+        return self.first_pdi + int(true_indices[0]) if len(true_indices) > 0 else None
+
+    def extrema_table(self, column: str) -> ExtremaTable:
+        # The ExtremaTable of a price column ("open", "high", "low" or "close") of the root frame, indexed by PDI - root first_pdi.
+        root = self.__root
+        if column not in root.__extrema_tables:
+            root.__extrema_tables[column] = ExtremaTable(getattr(root, column))
+
+        return root.__extrema_tables[column]
+
+    def first_pdi_above(self, column: str, threshold: float, start_pdi: int = None, end_pdi: int = None) -> int | None:
+        """
+        Find the first candle from start_pdi up to (and NOT including) end_pdi with a price column strictly above a threshold, using the extrema table
+        of the column. This is the same as first_pdi_where(column > threshold) on the window, in O(log n) once the table is built.
+
+        Args:
+            column (str): The price column, "open", "high", "low" or "close".
+            threshold (float): The value to cross.
+            start_pdi (int): The PDI to start the search from, defaults to the first candle.
+            end_pdi (int): The PDI to end the search at, defaults to the end of the frame.
+
+        Returns:
+            int: The PDI of the first candle above the threshold, None if there is none.
+        """
+
+        start, end = self.__to_root_positions(start_pdi, end_pdi)
+        position = self.extrema_table(column).first_above(threshold, start, end)
+
+        return self.__root.first_pdi + position if position is not None else None
+
+    def first_pdi_below(self, column: str, threshold: float, start_pdi: int = None, end_pdi: int = None) -> int | None:
+        # The counterpart of first_pdi_above, for the first candle strictly below the threshold.
+        start, end = self.__to_root_positions(start_pdi, end_pdi)
+        position = self.extrema_table(column).first_below(threshold, start, end)
+
+        return self.__root.first_pdi + position if position is not None else None
+
+    def __to_positions(self, start_pdi: int | None, end_pdi: int | None) -> tuple[int, int]:
+        # Convert a PDI range to a range of positions in the frame, clipped like window.
+        length = len(self.times_ms)
+        start = 0 if start_pdi is None else min(max(start_pdi - self.first_pdi, 0), length)
+        end = length if end_pdi is None else min(max(end_pdi - self.first_pdi, start), length)
+
+        return start, end
+
+    def __to_root_positions(self, start_pdi: int | None, end_pdi: int | None) -> tuple[int, int]:
+        # Convert a PDI range to a range of positions in the root frame, clipped to this frame.
+        start, end = self.__to_positions(start_pdi, end_pdi)
+        root_offset = self.first_pdi - self.__root.first_pdi
+
+        return start + root_offset, end + root_offset
+
+    def range_min_low(self, start_pdi: int = None, end_pdi: int = None) -> float:
+        # The lowest low from start_pdi up to (and NOT including) end_pdi, like window(start_pdi, end_pdi).min_low() without creating the window.
+        return self.extrema_table("low").range_min(*self.__to_root_positions(start_pdi, end_pdi))
+
+    def range_max_high(self, start_pdi: int = None, end_pdi: int = None) -> float:
+        # The highest high from start_pdi up to (and NOT including) end_pdi, like window(start_pdi, end_pdi).max_high() without creating the window.
+        return self.extrema_table("high").range_max(*self.__to_root_positions(start_pdi, end_pdi))
+
+    def min_low(self) -> float:
+        # Like pair_df.low.min(), NaN if the frame is empty. Answered from the extrema table of the root frame.
+        return self.range_min_low()
+
+    def max_high(self) -> float:
+        # Like pair_df.high.max(), NaN if the frame is empty. Answered from the extrema table of the root frame.
+        return self.range_max_high()
+
+    @property
+    def time_index(self) -> PdiTimeIndex:
+        if self.__time_index is None:
+            self.__time_index = PdiTimeIndex(self.times_ms, self.first_pdi)
+
+        return self.__time_index
+
+    def to_datetimes(self, times_ms: np.ndarray) -> pd.DatetimeIndex:
+        # Convert UNIX timestamps in milliseconds to the same datetimes as the time column of pair_df.
+        datetimes = pd.to_datetime(times_ms, unit="ms", utc=self.timezone is not None)
+
+        return datetimes.tz_convert(self.timezone) if self.timezone is not None else datetimes
+
+    @staticmethod
+    def to_times_ms(times) -> np.ndarray:
+        # The inverse of to_datetimes: convert datetimes (naive ones being in UTC, like the time column of pair_df) to UNIX timestamps in
+        # milliseconds.
+        return np.asarray(pd.DatetimeIndex(np.atleast_1d(times)).as_unit("ms").asi8).reshape(np.shape(times))
+
+    def get_time(self, pdi: int) -> pd.Timestamp:
+        return pd.Timestamp(self.times_ms[pdi - self.first_pdi], unit="ms", tz=self.timezone)
+
+    def get_times(self, pdis) -> pd.DatetimeIndex:
+        # The vectorized get_time.
+        return self.to_datetimes(self.time_index.get_times_ms(np.atleast_1d(pdis)))
+
+    def find_pdi(self, time, side: str = "left") -> int:
+        """
+        Find the PDI of the first candle which opens at or after (side="left") or strictly after (side="right") a time, or the PDI after the last
+        candle if there is none. Uses the arithmetic mapping of the time index when the candles are evenly spaced.
+
+        Args:
+            time (pd.Timestamp): The time.
+            side (str): "left" or "right", like np.searchsorted.
+
+        Returns:
+            int: The PDI.
+        """
+
+        return int(self.time_index.find_pdis(self.to_times_ms(time), side=side))
+
+    def candle(self, pdi: int) -> Candle:
+        """
+        Get a single candle of the frame.
+
+        Args:
+            pdi (int): The PDI of the candle.
+
+        Returns:
+            Candle: The candle.
+
+        Raises:
+            KeyError: If the PDI isn't in the frame, like pair_df.loc.
+        """
+
+        i = pdi - self.first_pdi
+        if not 0 <= i < len(self):
+            raise KeyError(pdi)
+
+        return Candle(pdi, self.get_time(pdi), self.open[i], self.high[i], self.low[i], self.close[i])
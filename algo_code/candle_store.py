@@ -0,0 +1,117 @@
+import os
+import numpy as np
+import pandas as pd
+
+from algo_code.kline_parsing import pair_df_from_columns
+from utils import constants
+
+# The record layout of the candle files. Times are the candle open times as UNIX timestamps in milliseconds.
+candle_dtype = np.dtype([("time", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8")])
+
+
+class CandleStore:
+    """
+    A persistent, append-only store of the closed candles of each pair, so restarting the bot doesn't require backfilling the whole history again.
+
+    Each series (market type, timeframe and symbol) is kept in its own binary file of candle_dtype records, which is read through a memory map. Only
+    closed candles are ever written, so the stored records never change once they are appended.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir: str = root_dir
+
+    def series_path(self, symbol: str) -> str:
+        return os.path.join(self.root_dir, constants.market_type, constants.timeframe, f"{symbol}.bin")
+
+    def read_records(self, symbol: str) -> np.ndarray:
+        path = self.series_path(symbol)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=candle_dtype)
+
+        # A record which was only partially written (e.g. the process was killed mid-write) is ignored.
+        num_records = os.path.getsize(path) // candle_dtype.itemsize
+        if num_records == 0:
+            return np.empty(0, dtype=candle_dtype)
+
+        return np.memmap(path, dtype=candle_dtype, mode="r", shape=(num_records,))
+
+    def load(self, symbol: str, start_time: pd.Timestamp) -> pd.DataFrame | None:
+        """
+        Load the stored candles of a pair, starting from start_time.
+
+        Args:
+            symbol (str): Trading pair symbol.
+            start_time (pd.Timestamp): The time of the first candle the pair_df should start from.
+
+        Returns:
+            pd.DataFrame | None: The stored candles in the pair_df format, or None if the store doesn't cover start_time, in which case the history
+                                 has to be fetched from the start.
+        """
+
+        records = self.read_records(symbol)
+        start_time_ms = int(start_time.timestamp() * 1000)
+
+        if len(records) == 0 or records[0]["time"] > start_time_ms:
+            return None
+
+        records = records[records["time"] >= start_time_ms]
+        if len(records) == 0:
+            return None
+
+        prices = np.column_stack([records["open"], records["high"], records["low"], records["close"]])
+
+        return pair_df_from_columns(records["time"], prices)
+
+    def append_closed_candles(self, symbol: str, pair_df: pd.DataFrame) -> None:
+        """
+        Append the closed candles of pair_df which are newer than the last stored candle. The last candle of pair_df is the still-forming candle, so
+        it is never stored. If the stored series doesn't connect to pair_df (e.g. the start time was moved earlier), it is rewritten.
+
+        Args:
+            symbol (str): Trading pair symbol.
+            pair_df (pd.DataFrame): The candles of the pair.
+        """
+
+        closed_candles_df = pair_df.iloc[:-1]
+        if len(closed_candles_df) == 0:
+            return
+
+        times_ms = closed_candles_df.time.values.astype("datetime64[ms]").astype(np.int64)
+
+        # Only the bounds of the stored series are needed. The memory map is released before writing, as the file gets truncated and appended to.
+        stored_records = self.read_records(symbol)
+        num_stored_records = len(stored_records)
+        if num_stored_records > 0:
+            stored_first_time_ms, stored_last_time_ms = int(stored_records[0]["time"]), int(stored_records[-1]["time"])
+        del stored_records
+
+        timeframe_ms = int(pd.Timedelta(constants.timeframe).total_seconds() * 1000)
+
+        if num_stored_records > 0 and stored_first_time_ms <= times_ms[0] <= stored_last_time_ms + timeframe_ms:
+            new_candles_mask = times_ms > stored_last_time_ms
+            file_mode = "ab"
+        else:
+            new_candles_mask = np.ones(len(times_ms), dtype=bool)
+            file_mode = "wb"
+
+        if not new_candles_mask.any():
+            return
+
+        records = np.empty(int(new_candles_mask.sum()), dtype=candle_dtype)
+        records["time"] = times_ms[new_candles_mask]
+        for column in ["open", "high", "low", "close"]:
+            records[column] = closed_candles_df[column].values[new_candles_mask]
+
+        path = self.series_path(symbol)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Drop any partially written record before appending, so the records stay aligned.
+        if file_mode == "ab":
+            with open(path, "r+b") as candle_file:
+                candle_file.truncate(num_stored_records * candle_dtype.itemsize)
+
+        with open(path, file_mode) as candle_file:
+            candle_file.write(records.tobytes())
+
+
+candle_store = CandleStore(constants.candle_store_dir)
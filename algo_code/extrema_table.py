@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class ExtremaTable:
+    """
+    A sparse table of the running maxima and minima of an array, for range extremum and first crossing queries in O(log n) instead of scanning or
+    masking the whole range on every query.
+
+    Level k of the table holds the extremum of each block of 2^k elements starting at every index. A range extremum is the extremum of the two
+    (overlapping) blocks covering the range. The first element after an index which crosses a value is found by jumping over the biggest blocks which
+    don't cross it, from the biggest level down to the single elements. The max and min levels are only built when they are first used.
+
+    The queries take ranges of indices within the array, 0 <= start <= end <= len(values), and don't clip them, since they are called in tight loops
+    by callers which have already done so (e.g. CandleFrame).
+    """
+
+    def __init__(self, values: np.ndarray):
+        self.values: np.ndarray = values
+
+        self.__max_levels: list[np.ndarray] | None = None
+        self.__min_levels: list[np.ndarray] | None = None
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __build_levels(self, reduce) -> list[np.ndarray]:
+        levels = [self.values]
+        block_size = 1
+        while block_size * 2 <= len(self.values):
+            previous_level = levels[-1]
+            levels.append(reduce(previous_level[:-block_size], previous_level[block_size:]))
+            block_size *= 2
+
+        return levels
+
+    @property
+    def max_levels(self) -> list[np.ndarray]:
+        if self.__max_levels is None:
+            self.__max_levels = self.__build_levels(np.maximum)
+
+        return self.__max_levels
+
+    @property
+    def min_levels(self) -> list[np.ndarray]:
+        if self.__min_levels is None:
+            self.__min_levels = self.__build_levels(np.minimum)
+
+        return self.__min_levels
+
+    def range_max(self, start: int, end: int) -> float:
+        """
+        Get the maximum of the values from start up to (and NOT including) end.
+
+        Args:
+            start (int): The index of the first value of the range.
+            end (int): The index after the last value of the range.
+
+        Returns:
+            float: The maximum, NaN if the range is empty.
+        """
+
+        if start >= end:
+            return np.nan
+
+        level = (end - start).bit_length() - 1
+        level_values = self.max_levels[level]
+
+        return max(level_values[start], level_values[end - (1 << level)])
+
+    def range_min(self, start: int, end: int) -> float:
+        # The counterpart of range_max.
+        if start >= end:
+            return np.nan
+
+        level = (end - start).bit_length() - 1
+        level_values = self.min_levels[level]
+
+        return min(level_values[start], level_values[end - (1 << level)])
+
+    def __first_crossing(self, levels: list[np.ndarray], is_crossing, start: int, end: int) -> int | None:
+        # Every value before position is known to not cross. The blocks are jumped over from the biggest to the smallest, so after the last level
+        # position is either the first crossing or the first index after the range.
+        position = start
+        for level in range(len(levels) - 1, -1, -1):
+            block_end = position + (1 << level)
+            if block_end <= end and not is_crossing(levels[level][position]):
+                position = block_end
+
+        return position if position < end and is_crossing(self.values[position]) else None
+
+    def first_above(self, threshold: float, start: int, end: int) -> int | None:
+        """
+        Find the first index from start up to (and NOT including) end whose value is strictly above the threshold.
+
+        Args:
+            threshold (float): The value to cross.
+            start (int): The index to start the search from.
+            end (int): The index to end the search at.
+
+        Returns:
+            int: The index of the first value above the threshold, None if there is none.
+        """
+
+        return self.__first_crossing(self.max_levels, lambda value: value > threshold, start, end)
+
+    def first_below(self, threshold: float, start: int, end: int) -> int | None:
+        # The counterpart of first_above, for the first value strictly below the threshold.
+        return self.__first_crossing(self.min_levels, lambda value: value < threshold, start, end)
@@ -1,13 +1,259 @@
-import datetime
+import threading
 import time
 import requests
+import numpy as np
 import pandas as pd
 import json
 
 from utils import constants
+from algo_code.candle_store import candle_store
+from algo_code.kline_parsing import parse_klines_page, pair_df_from_columns
+from algo_code.request_scheduler import klines_weight_scheduler, max_rate_limited_retries
 
 import concurrent.futures
 
+# A shared HTTP session, so the connections to the klines endpoint are kept alive and reused between requests instead of going through a new TCP
+# and TLS handshake for every page.
+http_session = requests.Session()
+http_adapter = requests.adapters.HTTPAdapter(pool_maxsize=constants.fetch_concurrency)
+http_session.mount("https://", http_adapter)
+http_session.mount("http://", http_adapter)
+
+# Caps the klines requests in flight at fetch_concurrency across all the threads which fetch, i.e. the pairs fetched concurrently and the backfill
+# windows of each pair, so they never need more connections than the pool of the session keeps.
+http_request_slots = threading.BoundedSemaphore(constants.fetch_concurrency)
+
+# Per-symbol cache of the candles fetched in the previous main loop iterations. Each main loop iteration only requests the candles newer than the
+# last cached candle, instead of downloading the whole history from the start time again. The last cached candle is the still-forming one, so it is
+# always fetched again and replaced with its updated version.
+pairs_candle_cache: dict[str, pd.DataFrame] = {}
+
+
+def merge_new_candles(cached_df: pd.DataFrame | None, new_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merge newly fetched candles into the cached candles of a pair. Any cached candle with an open time at or after the first new candle (Which would
+    be the still-forming candle of the previous fetch) is replaced by the new data.
+
+    Args:
+        cached_df (pd.DataFrame | None): The cached candles of the pair, or None if nothing is cached yet.
+        new_df (pd.DataFrame): The newly fetched candles.
+
+    Returns:
+        pd.DataFrame: The merged candles, with a fresh RangeIndex so the PDI's stay consistent with a full fetch.
+    """
+
+    if cached_df is None or len(cached_df) == 0:
+        return new_df.reset_index(drop=True)
+
+    if len(new_df) == 0:
+        return cached_df
+
+    closed_cached_df = cached_df[cached_df.time < new_df.iloc[0].time]
+
+    return pd.concat([closed_cached_df, new_df], ignore_index=True)
+
+
+def get_cached_candles(symbol: str, start_time: pd.Timestamp) -> tuple[pd.DataFrame | None, int]:
+    """
+    Get the cached candles of a pair and the time from which its new candles should be fetched. On the first fetch of a pair, the closed candles
+    kept in the candle store by previous runs are used as its cache.
+
+    Args:
+        symbol (str): Trading pair symbol.
+        start_time (pd.Timestamp): start_time of the candles
+
+    Returns:
+        tuple[pd.DataFrame | None, int]: The cached candles (or None), and the fetch start time as a UNIX timestamp in milliseconds. If candles are
+                                         cached, the fetch starts at the open time of the last cached candle, otherwise at start_time.
+    """
+
+    cached_df = pairs_candle_cache.get(symbol)
+
+    if cached_df is None:
+        cached_df = candle_store.load(symbol, start_time)
+
+    if cached_df is not None and len(cached_df) > 0:
+        return cached_df, int(cached_df.iloc[-1].time.timestamp() * 1000)
+
+    return cached_df, int(start_time.timestamp() * 1000)
+
+
+def stitch_klines_pages(open_times_pages: list[np.ndarray], prices_pages: list[np.ndarray]) -> pd.DataFrame:
+    """
+    Create a DataFrame from the typed columns of fetched klines pages. The pages are sorted by open time and deduplicated, so pages fetched
+    concurrently and out of order (e.g. overlapping backfill windows) stitch into one continuous series.
+
+    Args:
+        open_times_pages (list[np.ndarray]): The open times of each fetched page, as returned by parse_klines_page.
+        prices_pages (list[np.ndarray]): The prices of each fetched page, as returned by parse_klines_page.
+
+    Returns:
+        pd.DataFrame: The candles of all the pages.
+    """
+
+    if len(open_times_pages) == 0:
+        return pair_df_from_columns(np.empty(0, dtype=np.int64), np.empty((0, 4), dtype=np.float64))
+
+    # np.unique returns the sorted open times and the index of the first occurrence of each one
+    open_times_ms, unique_indices = np.unique(np.concatenate(open_times_pages), return_index=True)
+
+    return pair_df_from_columns(open_times_ms, np.concatenate(prices_pages)[unique_indices])
+
+
+def update_cached_candles(symbol: str, cached_df: pd.DataFrame | None, open_times_pages: list[np.ndarray], prices_pages: list[np.ndarray]) \
+        -> pd.DataFrame:
+    """
+    Merge the fetched pages of klines into the cached candles of a pair, and append the newly closed candles to the candle store.
+
+    Args:
+        symbol (str): Trading pair symbol.
+        cached_df (pd.DataFrame | None): The cached candles returned by get_cached_candles.
+        open_times_pages (list[np.ndarray]): The open times of each fetched page, as returned by parse_klines_page.
+        prices_pages (list[np.ndarray]): The prices of each fetched page, as returned by parse_klines_page.
+
+    Returns:
+        pd.DataFrame: The up-to-date candles of the pair.
+    """
+
+    if len(open_times_pages) == 0 and cached_df is not None:
+        return cached_df
+
+    pair_df = merge_new_candles(cached_df, stitch_klines_pages(open_times_pages, prices_pages))
+    pairs_candle_cache[symbol] = pair_df
+    candle_store.append_closed_candles(symbol, pair_df)
+
+    return pair_df
+
+
+def count_expected_candles(start_time_ms: int, end_time_ms: int) -> int:
+    """
+    Count the candles whose open time falls within a time range. Candle open times are aligned to multiples of the timeframe.
+
+    Args:
+        start_time_ms (int): The start of the range, as a UNIX timestamp in milliseconds.
+        end_time_ms (int): The end of the range (inclusive), as a UNIX timestamp in milliseconds.
+
+    Returns:
+        int: The number of candles expected in the range.
+    """
+
+    timeframe_ms = int(pd.Timedelta(constants.timeframe).total_seconds() * 1000)
+    first_open_time_ms = -(-start_time_ms // timeframe_ms) * timeframe_ms
+
+    return max(0, (end_time_ms - first_open_time_ms) // timeframe_ms + 1)
+
+
+def compute_backfill_windows(start_time_ms: int, end_time_ms: int, window_candles: int = 1000) -> list[tuple[int, int]]:
+    """
+    Split a time range into windows of window_candles candles each. Since the timeframe is fixed, the windows can be computed up front and fetched
+    concurrently, instead of each request's startTime depending on the last candle of the previous response.
+
+    Args:
+        start_time_ms (int): The start of the range, as a UNIX timestamp in milliseconds.
+        end_time_ms (int): The end of the range, as a UNIX timestamp in milliseconds.
+        window_candles (int): The number of candles in each window, at most the maximum limit of a klines request.
+
+    Returns:
+        list[tuple[int, int]]: The start and end times of each window, both inclusive.
+    """
+
+    timeframe_ms = int(pd.Timedelta(constants.timeframe).total_seconds() * 1000)
+    window_ms = window_candles * timeframe_ms
+
+    return [(window_start_ms, min(window_start_ms + window_ms - 1, end_time_ms)) for window_start_ms in range(start_time_ms, end_time_ms, window_ms)]
+
+
+def fetch_klines_range(symbol: str, start_time_ms: int, end_time_ms: int) -> tuple[list[np.ndarray], list[np.ndarray]] | None:
+    """
+    Fetch the klines of a symbol in a time range, paginating sequentially through the range.
+
+    Args:
+        symbol (str): Trading pair symbol.
+        start_time_ms (int): The start of the range, as a UNIX timestamp in milliseconds.
+        end_time_ms (int): The end of the range, as a UNIX timestamp in milliseconds.
+
+    Returns:
+        tuple[list[np.ndarray], list[np.ndarray]] | None: The open times and the prices of each fetched page, or None if the fetching failed.
+    """
+
+    url = f"{constants.binance_rest_url}/klines"
+
+    all_open_times_ms: list[np.ndarray] = []
+    all_prices: list[np.ndarray] = []
+    current_start_time_ms = start_time_ms
+    rate_limited_retries = 0
+
+    while (expected_candles := count_expected_candles(current_start_time_ms, end_time_ms)) > 0:
+        # Only as many candles as expected in the remaining time range are requested, since smaller limits have a lower request weight.
+        limit = klines_weight_scheduler.choose_limit(expected_candles)
+        params = {
+            "symbol": symbol,
+            "interval": constants.timeframe,
+            "startTime": current_start_time_ms,
+            "endTime": end_time_ms,
+            "limit": limit
+        }
+
+        try:
+            # Fetch historical kline data, once the weight scheduler allows it
+            klines_weight_scheduler.acquire(limit)
+            with http_request_slots:
+                response = http_session.get(url, params=params)
+            klines_weight_scheduler.register_response(response.status_code, response.headers)
+
+            # Rate limited requests are retried after the pause set by the scheduler
+            if response.status_code in [418, 429] and rate_limited_retries < max_rate_limited_retries:
+                rate_limited_retries += 1
+                continue
+
+            response.raise_for_status()
+            open_times_ms, prices = parse_klines_page(response.content)
+            if len(open_times_ms) == 0:
+                break
+            all_open_times_ms.append(open_times_ms)
+            all_prices.append(prices)
+            current_start_time_ms = int(open_times_ms[-1]) + 1  # Move to the next timestamp after the last one fetched
+
+            # A page with fewer candles than the limit is the last one, so no extra request is spent on an empty page.
+            if len(open_times_ms) < limit:
+                break
+        except Exception as e:
+            return None
+
+    return all_open_times_ms, all_prices
+
+
+def fetch_klines(symbol: str, start_time_ms: int, end_time_ms: int) -> tuple[list[np.ndarray], list[np.ndarray]] | None:
+    """
+    Fetch the klines of a symbol in a time range. If parallel backfill is enabled and the range spans more than one request, the range is split
+    into backfill windows which are fetched concurrently.
+
+    Args:
+        symbol (str): Trading pair symbol.
+        start_time_ms (int): The start of the range, as a UNIX timestamp in milliseconds.
+        end_time_ms (int): The end of the range, as a UNIX timestamp in milliseconds.
+
+    Returns:
+        tuple[list[np.ndarray], list[np.ndarray]] | None: The open times and the prices of each fetched page, or None if the fetching failed.
+    """
+
+    backfill_windows = compute_backfill_windows(start_time_ms, end_time_ms) if constants.parallel_backfill else [(start_time_ms, end_time_ms)]
+
+    if len(backfill_windows) <= 1:
+        return fetch_klines_range(symbol, start_time_ms, end_time_ms)
+
+    # The windows run inside the thread of the pair, which is itself one of the fetch_concurrency pairs fetched concurrently. The requests of all the
+    # windows share the http_request_slots, so the total concurrency stays at fetch_concurrency.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(constants.fetch_concurrency, len(backfill_windows))) as executor:
+        windows_klines = list(executor.map(lambda window: fetch_klines_range(symbol, *window), backfill_windows))
+
+    # If any of the windows fails, the whole range is considered failed, as a gap in the candles would corrupt the zigzag.
+    if any(window_klines is None for window_klines in windows_klines):
+        return None
+
+    return ([page for window_klines in windows_klines for page in window_klines[0]],
+            [page for window_klines in windows_klines for page in window_klines[1]])
+
 
 def get_pairs_data_parallel(symbols: list, start_times: dict) -> dict:
     """
@@ -22,55 +268,18 @@ def get_pairs_data_parallel(symbols: list, start_times: dict) -> dict:
     """
 
     def fetch_data_for_symbol(symbol) -> pd.DataFrame | None:
-        # Convert start_time to milliseconds
-        start_time = start_times[symbol]
-        start_time_ms = int(start_time.timestamp() * 1000)
+        cached_df, start_time_ms = get_cached_candles(symbol, start_times[symbol])
         end_time_ms = int(time.time() * 1000)  # Current time in milliseconds
-        timeframe_seconds = pd.Timedelta(constants.timeframe).total_seconds()
-        max_candles = 1000
-
-        if constants.market_type == "futures":
-            url = f"https://fapi.binance.com/fapi/v1/klines"
-        elif constants.market_type == "spot":
-            url = f"https://api.binance.com/api/v3/klines"
-
-        all_data = []
-        current_start_time_ms = start_time_ms
-
-        while current_start_time_ms < end_time_ms:
-            params = {
-                "symbol": symbol,
-                "interval": constants.timeframe,
-                "startTime": current_start_time_ms,
-                "endTime": end_time_ms,
-                "limit": max_candles
-            }
-
-            try:
-                # Fetch historical kline data
-                response = requests.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-                if not data:
-                    break
-                all_data.extend(data)
-                current_start_time_ms = data[-1][0] + 1  # Move to the next timestamp after the last one fetched
-            except Exception as e:
-                return symbol, None
-
-        # Convert UNIX timestamp to UTC time format and create DataFrame
-        data = [[datetime.datetime.utcfromtimestamp(row[0] / 1000)] + row[1:5] for row in all_data]
-        pair_df = pd.DataFrame(data, columns=["time", "open", "high", "low", "close"])
-        pair_df['candle_color'] = pair_df.apply(lambda row: 'green' if row.close > row.open else 'red', axis=1)
-
-        # Convert columns to numeric types
-        pair_df[["open", "high", "low", "close"]] = pair_df[["open", "high", "low", "close"]].apply(pd.to_numeric)
-
-        return symbol, pair_df
+
+        fetched_klines = fetch_klines(symbol, start_time_ms, end_time_ms)
+        if fetched_klines is None:
+            return symbol, None
+
+        return symbol, update_cached_candles(symbol, cached_df, *fetched_klines)
 
     all_pairs_data = {}
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=constants.fetch_concurrency) as executor:
         futures = {executor.submit(fetch_data_for_symbol, symbol): symbol for symbol in symbols}
         for future in concurrent.futures.as_completed(futures):
             symbol, pair_df = future.result()
@@ -91,47 +300,26 @@ def get_pair_data(symbol: str, start_time: pd.Timestamp) -> pd.DataFrame | None:
         pd.DataFrame: DataFrame containing the historical kline data.
     """
 
+    # Only the candles after the ones kept in the candle store need to be fetched. The fetch starts at the open time of the last stored candle.
+    stored_df = candle_store.load(symbol, start_time)
+
     # Convert start_time to milliseconds
-    start_time_ms = int(start_time.timestamp() * 1000)
+    if stored_df is not None:
+        start_time_ms = int(stored_df.iloc[-1].time.timestamp() * 1000)
+    else:
+        start_time_ms = int(start_time.timestamp() * 1000)
     end_time_ms = int(time.time() * 1000)  # Current time in milliseconds
-    timeframe_seconds = pd.Timedelta(constants.timeframe).total_seconds()
-    max_candles = 1000
 
-    if constants.market_type == "futures":
-        url = f"https://fapi.binance.com/fapi/v1/klines"
-    elif constants.market_type == "spot":
-        url = f"https://api.binance.com/api/v3/klines"
+    fetched_klines = fetch_klines(symbol, start_time_ms, end_time_ms)
+    if fetched_klines is None:
+        return None
 
-    all_data = []
+    all_open_times_ms, all_prices = fetched_klines
+    if len(all_open_times_ms) == 0 and stored_df is not None:
+        return stored_df
 
-    while start_time_ms < end_time_ms:
-        params = {
-            "symbol": symbol,
-            "interval": constants.timeframe,
-            "startTime": start_time_ms,
-            "endTime": end_time_ms,
-            "limit": max_candles
-        }
-
-        try:
-            # Fetch historical kline data
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            if not data:
-                break
-            all_data.extend(data)
-            start_time_ms = data[-1][0] + 1  # Move to the next timestamp after the last one fetched
-        except Exception as e:
-            return None
-
-    # Convert UNIX timestamp to UTC time format and create DataFrame
-    data = [[datetime.datetime.utcfromtimestamp(row[0] / 1000)] + row[1:5] for row in all_data]
-    pair_df = pd.DataFrame(data, columns=["time", "open", "high", "low", "close"])
-    pair_df['candle_color'] = pair_df.apply(lambda row: 'green' if row.close > row.open else 'red', axis=1)
-
-    # Convert columns to numeric types
-    pair_df[["open", "high", "low", "close"]] = pair_df[["open", "high", "low", "close"]].apply(pd.to_numeric)
+    pair_df = merge_new_candles(stored_df, stitch_klines_pages(all_open_times_ms, all_prices))
+    candle_store.append_closed_candles(symbol, pair_df)
 
     return pair_df
 
@@ -171,7 +359,7 @@ def get_mock_pair_data(symbol: str,
 
     # Convert columns to numeric types
     pair_df[["open", "high", "low", "close"]] = pair_df[["open", "high", "low", "close"]].apply(pd.to_numeric)
-    pair_df['candle_color'] = pair_df.apply(lambda row: 'green' if row.close > row.open else 'red', axis=1)
+    pair_df['candle_color'] = np.where(pair_df.close > pair_df.open, 'green', 'red')
 
     return pair_df
 
@@ -0,0 +1,94 @@
+import copy
+from typing import Optional
+
+from algo_code.segment import Segment
+
+
+class HOZigzagState:
+    """
+    A checkpoint of the loop in Algo.calc_h_o_zigzag, kept between the main loop iterations of a pair so the higher order zigzag can resume from the
+    last settled point instead of replaying every LPL break, PBOS/CHOCH update and segment since the starting point.
+
+    An iteration of the loop is settled once every pivot and candle it depended on can no longer change: it found a breaking sentiment, and both
+    the candle which caused it and the pivot after the LPL-breaking pivot come before the tentative pivot of the lower order zigzag. Pivots before
+    the tentative pivot are final and new pivots can only be confirmed at or after it, so replaying a settled iteration on newer data would give the
+    same result. The checkpoint is taken after the last iteration of the settled prefix of the loop.
+    """
+
+    def __init__(self):
+        self.starting_pdi: Optional[int] = None
+
+        # The loop variables of calc_h_o_zigzag
+        self.pattern_start_pdi: Optional[int] = None
+        self.latest_pbos_pdi: Optional[int] = None
+        self.latest_pbos_threshold: Optional[float] = None
+        self.latest_choch_threshold: Optional[float] = None
+
+        # The outputs of the loop up to the checkpoint
+        self.h_o_indices: list[int] = []
+        self.segments: list[Segment] = []
+        self.pbos_indices: list[int] = []
+        self.lpl_indices: dict[str, list] = {
+            "peak": [],
+            "valley": []
+        }
+
+        # The PDI and the open time of the last candle the settled iterations depended on, used to detect if the candles have been replaced since.
+        self.horizon_pdi: Optional[int] = None
+        self.horizon_time_ms: Optional[int] = None
+
+    @property
+    def has_checkpoint(self) -> bool:
+        return self.horizon_pdi is not None
+
+    def can_resume(self, starting_pdi: int, candles) -> bool:
+        """
+        Check whether the checkpoint can be resumed from for the given starting point and candles.
+
+        Args:
+            starting_pdi (int): The starting point of the higher order zigzag.
+            candles (CandleFrame): The candles of the pair.
+
+        Returns:
+            bool: True if the checkpoint was made from the same starting point and the same candles.
+        """
+
+        return (self.has_checkpoint and self.starting_pdi == starting_pdi and self.horizon_pdi < len(candles) and
+                candles.times_ms[self.horizon_pdi] == self.horizon_time_ms)
+
+    def save(self, algo, pattern_start_pdi: int, latest_pbos_pdi: Optional[int], latest_pbos_threshold: Optional[float],
+             latest_choch_threshold: float, horizon_pdi: int) -> None:
+        # Save the loop variables, and copies of the outputs of the algo, after a settled iteration.
+        self.starting_pdi = algo.starting_pdi
+        self.pattern_start_pdi = pattern_start_pdi
+        self.latest_pbos_pdi = latest_pbos_pdi
+        self.latest_pbos_threshold = latest_pbos_threshold
+        self.latest_choch_threshold = latest_choch_threshold
+
+        self.h_o_indices = list(algo.h_o_indices)
+        self.segments = list(algo.segments)
+        self.pbos_indices = list(algo.pbos_indices)
+        self.lpl_indices = {pivot_type: list(indices) for pivot_type, indices in algo.lpl_indices.items()}
+
+        self.horizon_pdi = horizon_pdi
+        self.horizon_time_ms = int(algo.candles.times_ms[horizon_pdi])
+
+    def restore(self, algo) -> tuple[int, Optional[int], Optional[float], float]:
+        """
+        Restore the outputs of the checkpoint into the algo.
+
+        Args:
+            algo (Algo): The Algo object to restore the outputs into.
+
+        Returns:
+            tuple: The pattern_start_pdi, latest_pbos_pdi, latest_pbos_threshold and latest_choch_threshold loop variables.
+        """
+
+        algo.starting_pdi = self.starting_pdi
+        algo.h_o_indices = list(self.h_o_indices)
+        # The segments are copied so the ones of the checkpoint aren't changed by the algo, e.g. when their order blocks are found.
+        algo.segments = [copy.copy(segment) for segment in self.segments]
+        algo.pbos_indices = list(self.pbos_indices)
+        algo.lpl_indices = {pivot_type: list(indices) for pivot_type, indices in self.lpl_indices.items()}
+
+        return self.pattern_start_pdi, self.latest_pbos_pdi, self.latest_pbos_threshold, self.latest_choch_threshold
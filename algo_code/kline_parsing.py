@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import ujson
+
+
+def parse_klines_page(response_content: bytes) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decode a page of klines returned by the Binance klines endpoint straight into typed NumPy columns, without any per-row Python work.
+
+    Args:
+        response_content (bytes): The raw body of the klines response.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The open times as UNIX timestamps in milliseconds (int64), and the open, high, low and close prices as an
+                                       (N, 4) float64 array.
+    """
+
+    klines = ujson.loads(response_content)
+
+    if len(klines) == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, 4), dtype=np.float64)
+
+    # Each kline is a list of 12 mixed-type fields, the prices being strings. Converting the object array column-wise lets NumPy parse the prices
+    # in one call.
+    kline_array = np.array(klines, dtype=object)
+
+    return kline_array[:, 0].astype(np.int64), kline_array[:, 1:5].astype(np.float64)
+
+
+def pair_df_from_columns(open_times_ms: np.ndarray, prices: np.ndarray) -> pd.DataFrame:
+    """
+    Build a pair_df from typed kline columns. The timestamps are converted in one vectorized call and the candle color is derived from a boolean
+    array.
+
+    Args:
+        open_times_ms (np.ndarray): The open times of the candles, as UNIX timestamps in milliseconds.
+        prices (np.ndarray): The open, high, low and close prices of the candles, as an (N, 4) array.
+
+    Returns:
+        pd.DataFrame: The candles, with the time, open, high, low, close and candle_color columns.
+    """
+
+    pair_df = pd.DataFrame({
+        "time": pd.to_datetime(open_times_ms, unit="ms"),
+        "open": prices[:, 0],
+        "high": prices[:, 1],
+        "low": prices[:, 2],
+        "close": prices[:, 3]
+    })
+
+    is_green: np.ndarray = prices[:, 3] > prices[:, 0]
+    pair_df["candle_color"] = np.where(is_green, "green", "red")
+
+    return pair_df
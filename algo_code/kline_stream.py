@@ -0,0 +1,198 @@
+import concurrent.futures
+import threading
+import time
+import ujson
+import pandas as pd
+import websocket
+
+from algo_code.candle_store import candle_store
+from algo_code.general_utils import (get_pairs_data_parallel, get_cached_candles, fetch_klines, update_cached_candles, merge_new_candles,
+                                     pairs_candle_cache, make_set_width)
+from utils import constants
+from utils.logger import logger
+
+# The maximum number of streams Binance allows to be combined on a single websocket connection.
+max_streams_per_connection = 200
+
+# All the pairs close their candles at the same time, so after the first close event the stream waits this many seconds to collect the rest.
+close_collection_delay = 0.5
+
+
+class KlineStream:
+    """
+    Keeps the candles of a list of pairs updated from the Binance kline websocket streams, instead of polling the REST API.
+
+    The history of each pair is backfilled once through get_pairs_data_parallel, which also fills the shared candle cache. After that, every kline
+    event updates the still-forming candle of its pair, and each event with a closed candle wakes up the main loop through wait_for_candle_close, so
+    the algorithm runs as soon as the candle closes.
+    """
+
+    def __init__(self, symbols: list[str], start_times: dict, ws_url: str = None):
+        self.symbols: list[str] = symbols
+        self.start_times: dict = start_times
+        self.ws_url: str = ws_url if ws_url else constants.binance_ws_url
+
+        # The latest kline row received for each pair, which hasn't been merged into the candle cache yet. Merging happens lazily when the data
+        # is requested, so the dozens of intra-candle updates per pair don't each cause a DataFrame concatenation.
+        self.pending_klines: dict[str, list] = {}
+
+        # The pairs which have had a candle close since the last call to wait_for_candle_close.
+        self.closed_symbols: set[str] = set()
+
+        self.lock = threading.Lock()
+        self.candle_closed_event = threading.Event()
+        self.web_socket_apps: list[websocket.WebSocketApp] = []
+
+        # The symbols streamed on each connection, and the connections which have been opened at least once. The first open of a connection
+        # follows the backfill in start, so only the later ones (i.e. reconnections) need to sync the candles missed while disconnected.
+        self.connection_symbols: dict[websocket.WebSocketApp, list[str]] = {}
+        self.opened_connections: set[websocket.WebSocketApp] = set()
+
+    def start(self) -> None:
+        """
+        Backfill the history of all the pairs and open the websocket connections, each one in its own daemon thread.
+        """
+
+        get_pairs_data_parallel(self.symbols, self.start_times)
+
+        for chunk_start in range(0, len(self.symbols), max_streams_per_connection):
+            chunk = self.symbols[chunk_start:chunk_start + max_streams_per_connection]
+            streams = "/".join(f"{symbol.lower()}@kline_{constants.timeframe}" for symbol in chunk)
+
+            web_socket_app = websocket.WebSocketApp(f"{self.ws_url}/stream?streams={streams}",
+                                                    on_open=self.on_open,
+                                                    on_message=self.on_message,
+                                                    on_error=self.on_error)
+            self.web_socket_apps.append(web_socket_app)
+            self.connection_symbols[web_socket_app] = chunk
+
+            threading.Thread(target=web_socket_app.run_forever, kwargs={"reconnect": 5}, daemon=True).start()
+
+    def stop(self) -> None:
+        for web_socket_app in self.web_socket_apps:
+            web_socket_app.close()
+
+    def on_open(self, web_socket_app) -> None:
+        # On the first connection, the candles are already up to date from the backfill in start.
+        if web_socket_app not in self.opened_connections:
+            self.opened_connections.add(web_socket_app)
+            logger.info("Kline stream connected")
+            return
+
+        # On reconnection, candles might have been missed while disconnected, so the cache of the pairs of this connection is brought up to date
+        # through the REST API.
+        symbols = self.connection_symbols[web_socket_app]
+        logger.info(f"Kline stream reconnected, syncing the candles of {len(symbols)} pairs missed while disconnected...")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=constants.fetch_concurrency) as executor:
+            list(executor.map(self.__sync_symbol, symbols))
+
+    def __sync_symbol(self, symbol: str) -> None:
+        # Fetch the candles of a pair since its last cached candle and merge them into the cache. The lock is only held to read and to merge the
+        # cache, not during the fetch, so the streams and the main loop aren't blocked by the REST requests.
+        with self.lock:
+            cached_df, start_time_ms = get_cached_candles(symbol, self.start_times[symbol])
+
+        fetched_klines = fetch_klines(symbol, start_time_ms, int(time.time() * 1000))
+        if fetched_klines is None:
+            logger.warning(f"\t{make_set_width(symbol)}\tFailed to sync the candles missed while disconnected")
+            return
+
+        with self.lock:
+            # The stream might have merged newer candles into the cache during the fetch, they're replaced by the fetched ones where they overlap.
+            update_cached_candles(symbol, pairs_candle_cache.get(symbol, cached_df), *fetched_klines)
+
+    def on_error(self, web_socket_app, error) -> None:
+        logger.warning(f"Kline stream error: {error}")
+
+    def on_message(self, web_socket_app, message: str) -> None:
+        event = ujson.loads(message)
+
+        # Messages from combined streams are wrapped in a dict with the stream name and the actual event data.
+        event_data = event.get("data", event)
+        if event_data.get("e") != "kline":
+            return
+
+        symbol = event_data["s"]
+        kline = event_data["k"]
+        kline_row = [kline["t"], float(kline["o"]), float(kline["h"]), float(kline["l"]), float(kline["c"])]
+
+        with self.lock:
+            self.pending_klines[symbol] = kline_row
+            if not kline["x"]:
+                return
+
+            # The algorithm treats the last candle of pair_df as the still-forming one, so once a candle closes, a placeholder for the next candle
+            # is added right away, opening at the close price of the closed candle. It is replaced by the first event of the new candle.
+            self.__merge_pending_kline(symbol)
+
+            timeframe_ms = int(pd.Timedelta(constants.timeframe).total_seconds() * 1000)
+            close_price = kline_row[4]
+            self.pending_klines[symbol] = [kline_row[0] + timeframe_ms, close_price, close_price, close_price, close_price]
+            self.__merge_pending_kline(symbol)
+
+            pair_df = pairs_candle_cache.get(symbol)
+
+            self.closed_symbols.add(symbol)
+            self.candle_closed_event.set()
+
+        # The closed candle is stored like the ones fetched through the REST API, so a restart doesn't backfill the candles received by the stream.
+        # The cached DataFrames are replaced rather than modified, so the file is written outside the lock.
+        if pair_df is not None:
+            candle_store.append_closed_candles(symbol, pair_df)
+
+    def __merge_pending_kline(self, symbol: str) -> None:
+        # Merge the latest received kline of the pair into the candle cache. Must be called with the lock held.
+        kline_row = self.pending_klines.pop(symbol, None)
+        if kline_row is None or symbol not in pairs_candle_cache:
+            return
+
+        kline_time = pd.to_datetime(kline_row[0], unit="ms")
+
+        # Klines older than the last cached candle (e.g. received right before a REST resync) are already included in the cache.
+        if kline_time < pairs_candle_cache[symbol].iloc[-1].time:
+            return
+
+        kline_df = pd.DataFrame([kline_row], columns=["time", "open", "high", "low", "close"])
+        kline_df["time"] = kline_time
+        kline_df["candle_color"] = "green" if kline_row[4] > kline_row[1] else "red"
+
+        pairs_candle_cache[symbol] = merge_new_candles(pairs_candle_cache[symbol], kline_df)
+
+    def get_pairs_data(self) -> dict:
+        """
+        Get the up-to-date candles of all the pairs, in the same format as get_pairs_data_parallel.
+
+        Returns:
+            dict: Dictionary containing the candles for each symbol, or None for pairs which haven't been backfilled successfully.
+        """
+
+        with self.lock:
+            for symbol in list(self.pending_klines.keys()):
+                self.__merge_pending_kline(symbol)
+
+            return {symbol: pairs_candle_cache.get(symbol) for symbol in self.symbols}
+
+    def wait_for_candle_close(self, timeout: float = None) -> set[str]:
+        """
+        Block until at least one of the pairs has a candle closed, then wait briefly so the close events of the other pairs (Which all close at the
+        same time) are collected too.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait, or None to wait indefinitely.
+
+        Returns:
+            set[str]: The pairs which have had a candle close since the last call.
+        """
+
+        if self.candle_closed_event.wait(timeout):
+            time.sleep(close_collection_delay)
+
+        with self.lock:
+            closed_symbols = self.closed_symbols
+            self.closed_symbols = set()
+            self.candle_closed_event.clear()
+
+        if len(closed_symbols) > 0:
+            logger.debug(f"\t{make_set_width('STREAM')}\tCandle closed for {len(closed_symbols)} pairs")
+
+        return closed_symbols
@@ -0,0 +1,158 @@
+import numpy as np
+
+from algo_code.candle_frame import CandleFrame
+from algo_code.order_block import OrderBlock
+
+
+class OrderBlockCandidates:
+    """
+    The order block checks of all the candidate base candles of a lower order leg, evaluated together.
+
+    For each candidate, this finds the exit candle and the results of the reentry, FVG and stop break conditions, exactly as OrderBlock's
+    register_exit_candle, check_reentry_condition, check_fvg_condition and check_stop_break_condition would, without creating an OrderBlock (and its
+    Position and id string) and windows of candles for every candidate.
+
+    Every check is answered by the range queries of the CandleFrame, which use the extrema tables shared by all the windows of the candles: the exit
+    candles with first crossing queries, and the aggregated candles before and after them and the condition check windows with range minima/maxima.
+    Each candidate takes a few O(log n) queries, independent of the length of the leg and of the check windows.
+    """
+
+    def __init__(self, candles: CandleFrame, start_pdi: int, end_pdi: int, ob_type: str, upper_search_bound_pdi: int, checks_end_pdi: int | None):
+        """
+        Args:
+            candles (CandleFrame): The candles of the pair.
+            start_pdi (int): The PDI of the first candidate base candle.
+            end_pdi (int): The PDI after the last candidate base candle.
+            ob_type (str): The type of the order blocks, "long" or "short".
+            upper_search_bound_pdi (int): The PDI of the last candle to search for exit candles in, like in OrderBlock.register_exit_candle.
+            checks_end_pdi (int | None): The PDI after the last candle of the reentry and condition check windows, None for the end of the candles.
+        """
+
+        self.candles: CandleFrame = candles
+        self.ob_type: str = ob_type
+        self.base_pdis: np.ndarray = np.arange(start_pdi, max(end_pdi, start_pdi))
+
+        self.has_exit: np.ndarray = np.zeros(len(self.base_pdis), dtype=bool)
+        # The candidates without an exit candle keep their own PDI as their exit PDI.
+        self.exit_pdis: np.ndarray = self.base_pdis.copy()
+        self.has_reentry_condition: np.ndarray = np.zeros(len(self.base_pdis), dtype=bool)
+        self.has_fvg_condition: np.ndarray = np.zeros(len(self.base_pdis), dtype=bool)
+        self.has_stop_break_condition: np.ndarray = np.zeros(len(self.base_pdis), dtype=bool)
+
+        checks_end_pdi = candles.last_pdi + 1 if checks_end_pdi is None else checks_end_pdi
+        self.checks_end_pdi: int = checks_end_pdi
+
+        for candidate_index, base_pdi in enumerate(self.base_pdis.tolist()):
+            i = base_pdi - candles.first_pdi
+            top, bottom = candles.high[i], candles.low[i]
+
+            exit_pdi = self.__find_exit_pdi(candles, top, bottom, base_pdi + 1, upper_search_bound_pdi + 1)
+            if exit_pdi is None:
+                continue
+
+            self.has_exit[candidate_index] = True
+            self.exit_pdis[candidate_index] = exit_pdi
+
+            # The candles after the exit candle are both the reentry check window and the candles after the exit in the FVG check. Empty ranges give
+            # NaN, which fails all the comparisons, the same as the min()/max() of an empty window.
+            after_exit_low = candles.range_min_low(exit_pdi + 1, checks_end_pdi)
+            after_exit_high = candles.range_max_high(exit_pdi + 1, checks_end_pdi)
+
+            # The reentry condition fails if the price returns to the box after the exit candle, and the stop break condition fails if the price
+            # breaks the stop level of the box within the condition check window.
+            if ob_type == "long":
+                self.has_reentry_condition[candidate_index] = not after_exit_low <= top
+                self.has_stop_break_condition[candidate_index] = not candles.range_min_low(base_pdi, checks_end_pdi) < bottom
+            else:
+                self.has_reentry_condition[candidate_index] = not after_exit_high >= bottom
+                self.has_stop_break_condition[candidate_index] = not candles.range_max_high(base_pdi, checks_end_pdi) > top
+
+            # The candles before the exit candle, from the base candle, within the condition check window.
+            before_exit_low = candles.range_min_low(base_pdi, min(exit_pdi, checks_end_pdi))
+            before_exit_high = candles.range_max_high(base_pdi, min(exit_pdi, checks_end_pdi))
+
+            # The FVG is the overlap of the body of the exit candle and the gap between the aggregated candles before and after it, if they don't
+            # overlap.
+            if not (before_exit_high < after_exit_low or after_exit_high < before_exit_low):
+                continue
+
+            gap_bottom, gap_top = min(before_exit_high, after_exit_high), max(before_exit_low, after_exit_low)
+            exit_open, exit_close = candles.open[exit_pdi - candles.first_pdi], candles.close[exit_pdi - candles.first_pdi]
+            body_bottom, body_top = min(exit_open, exit_close), max(exit_open, exit_close)
+            if body_top < gap_bottom or gap_top < body_bottom:
+                continue
+
+            # The FVG has to align with the box exactly
+            fvg = (max(body_bottom, gap_bottom), min(body_top, gap_top))
+            self.has_fvg_condition[candidate_index] = min(fvg) == top if ob_type == "long" else max(fvg) == bottom
+
+        self.is_valid: np.ndarray = self.has_exit & self.has_reentry_condition & self.has_fvg_condition & self.has_stop_break_condition
+
+    def __find_exit_pdi(self, candles: CandleFrame, top: float, bottom: float, start_pdi: int, end_pdi: int) -> int | None:
+        # The exit candle is the first candle from start_pdi up to (and NOT including) end_pdi which opens inside the box and closes outside of it.
+        # The first candle closing outside the box is found, and if it also opened outside of it, the search continues from the first candle after
+        # it which opens inside the box again.
+        search_start_pdi = start_pdi
+        while search_start_pdi is not None:
+            if self.ob_type == "long":
+                exit_pdi = candles.first_pdi_above("close", top, search_start_pdi, end_pdi)
+                if exit_pdi is None or candles.open[exit_pdi - candles.first_pdi] <= top:
+                    return exit_pdi
+
+                # The first candle opening at or below the top, i.e. strictly below the next float above it.
+                search_start_pdi = candles.first_pdi_below("open", np.nextafter(top, np.inf), exit_pdi + 1, end_pdi)
+            else:
+                exit_pdi = candles.first_pdi_below("close", bottom, search_start_pdi, end_pdi)
+                if exit_pdi is None or candles.open[exit_pdi - candles.first_pdi] >= bottom:
+                    return exit_pdi
+
+                search_start_pdi = candles.first_pdi_above("open", np.nextafter(bottom, -np.inf), exit_pdi + 1, end_pdi)
+
+        return None
+
+    def __len__(self) -> int:
+        return len(self.base_pdis)
+
+    def first_valid_index(self) -> int | None:
+        # The index of the first candidate which passes all the checks, None if there is none.
+        valid_indices = np.flatnonzero(self.is_valid)
+
+        return int(valid_indices[0]) if len(valid_indices) > 0 else None
+
+    def form_order_block(self, candidate_index: int, icl: float) -> OrderBlock:
+        """
+        Form the OrderBlock of a candidate from the results of its checks, in the same state as if it had been checked by OrderBlock's methods.
+
+        Args:
+            candidate_index (int): The index of the candidate.
+            icl (float): The initial candle liquidity of the order block.
+
+        Returns:
+            OrderBlock: The order block.
+        """
+
+        base_pdi = int(self.base_pdis[candidate_index])
+        ob = OrderBlock(self.candles.candle(base_pdi), icl, self.ob_type)
+
+        if self.has_exit[candidate_index]:
+            ob.price_exit_index = int(self.exit_pdis[candidate_index])
+        ob.set_condition_check_window(self.candles.window(base_pdi, self.checks_end_pdi))
+        ob.has_reentry_condition = bool(self.has_reentry_condition[candidate_index])
+        ob.has_fvg_condition = bool(self.has_fvg_condition[candidate_index])
+        ob.has_stop_break_condition = bool(self.has_stop_break_condition[candidate_index])
+
+        return ob
+
+    def count_replacements(self, candidate_index: int) -> int:
+        """
+        Count the times the base candle was moved before reaching a candidate. Only the candidates with an exit candle count as replaced, the others
+        are skipped without being considered as an order block.
+
+        Args:
+            candidate_index (int): The index of the candidate.
+
+        Returns:
+            int: The number of replaced candidates before it.
+        """
+
+        return int(np.count_nonzero(self.has_exit[:candidate_index]))
@@ -1,12 +1,19 @@
-from typing import Union
+from typing import Optional, Union
 import pandas as pd
 
 import algo_code.general_utils as gen_utils
+from algo_code.candle_frame import CandleFrame
 from algo_code.datatypes import Candle
 from algo_code.position import Position
 
 
 class OrderBlock:
+    # The attributes are declared as slots, since many order blocks are created while searching for valid ones. The id and the position are only
+    # formed when they are first accessed, which is usually only done for the order blocks that pass all the checks.
+    __slots__ = ("start_index", "base_candle", "type", "top", "bottom", "height", "icl", "price_exit_index", "condition_check_window",
+                 "has_reentry_condition", "has_fvg_condition", "has_stop_break_condition", "has_been_replaced", "fvg_fail_message",
+                 "ranking_within_segment", "times_moved", "__id", "__position")
+
     def __init__(self, base_candle: Union[pd.Series, Candle], icl: float, ob_type: str):
 
         if isinstance(base_candle, Candle):
@@ -19,8 +26,7 @@ class OrderBlock:
         # Identification
         self.base_candle = base_candle
         self.type = ob_type
-        self.id = f"OB{self.start_index}/" + gen_utils.convert_timestamp_to_readable(base_candle.time)
-        self.id += "L" if ob_type == "long" else "S"
+        self.__id: Optional[str] = None
 
         # Geometry
         self.top = base_candle.high
@@ -31,8 +37,8 @@ class OrderBlock:
         # stoploss and targets.
         self.icl = icl
 
-        # The position formed by the OrderBLock
-        self.position = Position(self)
+        # The position formed by the OrderBLock, formed on first access
+        self.__position: Optional[Position] = None
 
         # Checks and flags
         self.price_exit_index = None
@@ -41,11 +47,31 @@ class OrderBlock:
         self.has_fvg_condition = None
         self.has_stop_break_condition = None
         self.has_been_replaced = False
+        self.fvg_fail_message: Optional[str] = None
+
+        # Set by the segment which the order block is found in
+        self.ranking_within_segment: Optional[int] = None
+        self.times_moved: Optional[int] = None
+
+    @property
+    def id(self) -> str:
+        if self.__id is None:
+            self.__id = f"OB{self.start_index}/" + gen_utils.convert_timestamp_to_readable(self.base_candle.time)
+            self.__id += "L" if self.type == "long" else "S"
+
+        return self.__id
+
+    @property
+    def position(self) -> Position:
+        if self.__position is None:
+            self.__position = Position(self)
+
+        return self.__position
 
     def __repr__(self):
         return f"OB {self.id} ({self.type})"
 
-    def register_exit_candle(self, pair_df: pd.DataFrame, upper_search_bound_pdi: int) -> None:
+    def register_exit_candle(self, candles: Union[pd.DataFrame, CandleFrame], upper_search_bound_pdi: int) -> None:
         """
         Method to check the entries of the box and determine its validity.
 
@@ -53,29 +79,32 @@ class OrderBlock:
         If there is a re-entry, the box is marked as invalid. All the indices are also registered.
 
         Args:
-            pair_df (pd.DataFrame): The DataFrame containing the price data.
+            candles (pd.DataFrame | CandleFrame): The price data, either as pair_df or as a CandleFrame.
             upper_search_bound_pdi (int): The PDI of the candle to stop the search at.
         """
 
-        # Get the subset of pair_df that we need to check
-        check_window = pair_df.iloc[self.start_index + 1:upper_search_bound_pdi + 1]
+        # Get the subset of the candles that we need to check
+        if isinstance(candles, CandleFrame):
+            check_window = candles.window(self.start_index + 1, upper_search_bound_pdi + 1)
+        else:
+            check_window = CandleFrame.from_pair_df(candles.iloc[self.start_index + 1:upper_search_bound_pdi + 1])
 
         # If the box is of type "long"
         if self.type == "long":
             # Find the first candle where a candle opens inside the OB and closes above it
-            exit_index = check_window[(check_window['close'] > self.top) & (check_window['open'] <= self.top)].first_valid_index()
+            exit_index = check_window.first_pdi_where((check_window.close > self.top) & (check_window.open <= self.top))
 
         else:  # If the box is of type "short"
             # Find the first candle where a candle opens inside the OB and closes below it
-            exit_index = check_window[(check_window['close'] < self.bottom) & (check_window['open'] >= self.bottom)].first_valid_index()
+            exit_index = check_window.first_pdi_where((check_window.close < self.bottom) & (check_window.open >= self.bottom))
 
         if exit_index is not None:
             self.price_exit_index = exit_index
 
-    def set_condition_check_window(self, condition_check_window: pd.DataFrame) -> None:
-        self.condition_check_window = condition_check_window
+    def set_condition_check_window(self, condition_check_window: Union[pd.DataFrame, CandleFrame]) -> None:
+        self.condition_check_window = CandleFrame.create(condition_check_window)
 
-    def check_reentry_condition(self, reentry_check_window: pd.DataFrame):
+    def check_reentry_condition(self, reentry_check_window: Union[pd.DataFrame, CandleFrame]):
         """
         Method to check if the price returns to the  box pre-emptively, before it is fully formed from the LPL breaking it. This check is performed
         by checking all the candles from right after the base_candle to the candle that breaks the LPL (Which is passed to this function through
@@ -84,19 +113,21 @@ class OrderBlock:
         object is the flag property that keeps track of the passing of this condition.
 
         Args:
-            reentry_check_window (pd.DataFrame): A dataframe containing the candles of the window formed starting after the base_candle and before
-            the breaking of the LPL. This window will be checked for reentry in this function.
+            reentry_check_window (pd.DataFrame | CandleFrame): The candles of the window formed starting after the base_candle and before the
+            breaking of the LPL. This window will be checked for reentry in this function.
 
         """
 
+        reentry_check_window = CandleFrame.create(reentry_check_window)
+
         if self.type == "long":
             # Check if the lowest low in the reentry check window pierces the top of the box
-            lowest_low = reentry_check_window.low.min()
+            lowest_low = reentry_check_window.min_low()
             if lowest_low <= self.top:
                 self.has_reentry_condition = False
         else:
             # Check if the highest high in the reentry check window pierces the bottom of the box
-            highest_high = reentry_check_window.high.max()
+            highest_high = reentry_check_window.max_high()
             if highest_high >= self.bottom:
                 self.has_reentry_condition = False
 
@@ -117,10 +148,12 @@ class OrderBlock:
             self.fvg_fail_message = "No exit candle.."
             self.has_fvg_condition = False
 
-        aggregated_candle_after_exit: list = [self.condition_check_window.loc[self.price_exit_index + 1:].low.min(),
-                                              self.condition_check_window.loc[self.price_exit_index + 1:].high.max()]
-        aggregated_candle_before_exit: list = [self.condition_check_window.loc[:self.price_exit_index - 1].low.min(),
-                                               self.condition_check_window.loc[:self.price_exit_index - 1].high.max()]
+        # The aggregated candles are found with range queries on the condition check window, which are O(1) on the extrema tables of the candles.
+        window = self.condition_check_window
+        aggregated_candle_after_exit: list = [window.range_min_low(self.price_exit_index + 1, None),
+                                              window.range_max_high(self.price_exit_index + 1, None)]
+        aggregated_candle_before_exit: list = [window.range_min_low(None, self.price_exit_index),
+                                               window.range_max_high(None, self.price_exit_index)]
 
         def find_gap(interval1, interval2):
             if interval1[1] < interval2[0] or interval2[1] < interval1[0]:
@@ -144,7 +177,7 @@ class OrderBlock:
             self.has_fvg_condition = False
 
         else:
-            fvg_exit_candle: pd.Series = self.condition_check_window.loc[self.price_exit_index]
+            fvg_exit_candle: Candle = self.condition_check_window.candle(self.price_exit_index)
 
             # The overlap between the gap between the before and after candles and the exit candle's body constitutes the FVG.
             exit_candle_body_interval: list = [min(fvg_exit_candle.open, fvg_exit_candle.close),
@@ -180,15 +213,15 @@ class OrderBlock:
         the object accordingly.
         """
 
-        # Find candles which break the stop level, if any.
-        stop_breaking_candles: pd.DataFrame
+        # Find candles which break the stop level, if any, by comparing the lowest low/highest high of the window with the stop level. An empty window
+        # has no breaking candles, since comparisons with NaN are False.
         if self.type == "long":
-            stop_breaking_candles = self.condition_check_window[self.condition_check_window['low'] < self.bottom]
+            has_stop_breaking_candles = self.condition_check_window.min_low() < self.bottom
         else:
-            stop_breaking_candles = self.condition_check_window[self.condition_check_window['high'] > self.top]
+            has_stop_breaking_candles = self.condition_check_window.max_high() > self.top
 
         # If there are any candles in the condition check window which break the order block's stop level, the check fails.
-        if len(stop_breaking_candles) > 0:
+        if has_stop_breaking_candles:
             self.has_stop_break_condition = False
         else:
             self.has_stop_break_condition = True
@@ -1,10 +1,21 @@
+from concurrent.futures import Future
+from functools import partial
+
+import pandas as pd
+
+from algo_code.datatypes import Candle
 from algo_code.general_utils import make_set_width
-from utils.channel_utils import post_message
+from utils.channel_config import ChannelConfig, channel_configs
+from utils.channel_outbox import channel_outbox
 import algo_code.position_prices_setup as setup
 import utils.constants as constants
 from utils.logger import logger
 
+
 class Position:
+    __slots__ = ("parent_ob", "entry_price", "edicl", "type", "status", "target_list", "stoploss", "has_been_entered", "message_ids",
+                 "message_futures")
+
     def __init__(self, parent_ob):
         self.parent_ob = parent_ob
         self.entry_price = parent_ob.top if parent_ob.type == "long" else parent_ob.bottom
@@ -15,6 +26,7 @@ class Position:
 
         self.type = parent_ob.type
 
+        # "PENDING" for a position restored from the state journal which hasn't been confirmed as posted in all of its channels.
         self.status: str = "ACTIVE"
 
         self.target_list = []
@@ -25,16 +37,20 @@ class Position:
 
         self.has_been_entered = False
 
-        # This variable will be assigned a value once the position is posted to the channel. The value will be used to cancel it once the segment
-        # containing the position expires.
-        self.message_id = None
+        # The message ID of the signal in each channel, assigned once the position is posted to the channel. The IDs will be used to cancel it once
+        # the segment containing the position expires. The futures are assigned when the position is queued to be posted, before the IDs are known.
+        self.message_ids: dict[str, int] = {}
+        self.message_futures: dict[str, Future] = {}
+
+    def compose_signal_message(self, symbol, validation_data: dict, channel_config: ChannelConfig = None):
+        # The message is rendered with the template settings of the channel, by default those of the main channel.
+        channel_config = channel_configs[0] if channel_config is None else channel_config
 
-    def compose_signal_message(self, symbol, validation_data: dict):
         symbol_for_signal = symbol.replace("US", "/US")
         message = f"""⚡️⚡️ #{symbol_for_signal} ⚡️⚡️
 Exchanges: Binance Futures
 Signal Type: Regular ({self.type})
-Leverage: {constants.leverage_type} ({constants.leverage}.0X)
+Leverage: {channel_config.leverage_type} ({channel_config.leverage}.0X)
 
 Entry Targets:
 """
@@ -49,8 +65,14 @@ Entry Targets:
         message += "\nStop Targets: \n"
         message += f"1) {round(self.stoploss, constants.price_rounding_precision)}\n"
 
-        if constants.validation_mode:
-            message += f"\nBase candle:\n{self.parent_ob.base_candle}\n"
+        if channel_config.validation_mode:
+            # Base candles taken from a CandleFrame are Candle tuples, which are shown the same way as a pair_df row.
+            base_candle = self.parent_ob.base_candle
+            if isinstance(base_candle, Candle):
+                base_candle = pd.Series({**base_candle._asdict(), "candle_color": "green" if base_candle.close > base_candle.open else "red"},
+                                        name=base_candle.pdi).drop("pdi")
+
+            message += f"\nBase candle:\n{base_candle}\n"
             message += f"\nSignal activation time: \n{validation_data['activation_time']}\n"
             message += f"\nBroken LPL time: \n{validation_data['broken_lpl']}\n"
             message += f"\nSearch window: \n{validation_data['position_search_window'][0]} to {validation_data['position_search_window'][1]}\n"
@@ -63,33 +85,64 @@ Entry Targets:
         # Registers the position as "entered" so it won't get canceled.
         self.has_been_entered = True
 
-    def post_to_channel(self, symbol, validation_data: dict) -> int:
+    def post_to_channels(self, symbol, validation_data: dict, channel_ids: list[str] = None) -> dict[str, Future]:
         """
-        Post the position to the channel and return the message ID.
+        Queue the position to be posted to the channels, without waiting for it to be posted. The signal message is rendered once per channel
+        template, and each channel's message ID is registered on the position once the message is posted there.
         Args:
             symbol: The symbol of the signal
             validation_data: The validation data to be posted alongside the signal, for debugging
+            channel_ids: The IDs of the channels to post to, all the channels by default
 
         Returns:
-            int: The message ID of the posted message.
+            dict[str, Future]: The future of the message ID of the posted message, for each channel it's posted to.
         """
-        message = self.compose_signal_message(symbol, validation_data)
-        return post_message(message)
 
-    def cancel_position(self) -> None:
-        # Cancel the position if it has not been entered.
+        message_futures: dict[str, Future] = {}
+        messages_by_template: dict[tuple, str] = {}
+        for channel_config in channel_configs:
+            if channel_ids is not None and channel_config.channel_id not in channel_ids:
+                continue
+
+            if channel_config.template_key not in messages_by_template:
+                messages_by_template[channel_config.template_key] = self.compose_signal_message(symbol, validation_data, channel_config)
 
-        if not self.has_been_entered:
-            if constants.mode.lower() == 'dev':
-                # If running in dev mode, don't increase the message_id by 1
-                post_message("Cancel", self.message_id)
+            message_future = channel_outbox.submit(messages_by_template[channel_config.template_key], chat_id=channel_config.channel_id)
+            message_future.add_done_callback(partial(self.__register_message_id, channel_config.channel_id))
+            self.message_futures[channel_config.channel_id] = message_future
+            message_futures[channel_config.channel_id] = message_future
 
-                return
+        return message_futures
 
-            # The +1 is because Cornix reposts the signal after it's posted by the bot, increasing the ID by 1.
-            else:
-                post_message("Cancel", self.message_id + 1)
-                return
+    def __register_message_id(self, channel_id: str, message_future: Future) -> None:
+        if message_future.exception() is None:
+            self.message_ids[channel_id] = message_future.result()
 
-        else:
+            if all(posted_channel_id in self.message_ids for posted_channel_id in self.message_futures):
+                self.status = "ACTIVE"
+
+    def cancel_position(self) -> dict[str, Future]:
+        """
+        Queue the cancel messages of the position in all the channels it was posted to, if it has not been entered. Each message replies to the
+        signal in its channel, which may still be waiting to be posted, in which case the reply ID is resolved once the signal is posted.
+
+        Returns:
+            dict[str, Future]: The future of the message ID of the cancel message, for each channel.
+
+        Raises:
+            RuntimeError: If the position has been entered.
+        """
+
+        if self.has_been_entered:
             raise RuntimeError("Position has been entered, cannot cancel it.")
+
+        # If running in dev mode, don't increase the message_id by 1. Otherwise, the +1 is because Cornix reposts the signal after it's posted by the
+        # bot, increasing the ID by 1.
+        reply_offset = 0 if constants.mode.lower() == 'dev' else 1
+
+        cancel_futures: dict[str, Future] = {}
+        for channel_id in {**self.message_ids, **self.message_futures}:
+            signal_message_id = self.message_futures.get(channel_id, self.message_ids.get(channel_id))
+            cancel_futures[channel_id] = channel_outbox.submit("Cancel", signal_message_id, reply_offset, chat_id=channel_id)
+
+        return cancel_futures
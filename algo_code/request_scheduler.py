@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+from utils import constants
+from utils.logger import logger
+from utils.rate_limit import TokenBucket
+
+# The limit values at which the request weight of the klines endpoint steps up, and the weight of each step. On the futures API the weight depends
+# on the limit parameter, on the spot API every klines request weighs the same.
+futures_klines_weight_steps: list[tuple[int, int]] = [(99, 1), (499, 2), (1000, 5)]
+spot_klines_weight_steps: list[tuple[int, int]] = [(1000, 2)]
+
+# How many times a single page is retried after being rate limited before the fetch of the pair is given up for this loop.
+max_rate_limited_retries = 3
+
+
+class KlinesWeightScheduler:
+    """
+    Paces the klines requests of all the pairs so the request weight used per minute stays under the exchange's budget.
+
+    The budget is tracked with a token bucket which refills the whole budget every minute. Every request takes its weight out of the bucket before
+    being sent, and the bucket is synced down with the X-MBX-USED-WEIGHT-1M header of each response, which also accounts for the weight used by other
+    processes on the same IP. If the exchange still answers with a 429 (rate limit) or 418 (IP ban), all requests are paused for the Retry-After
+    period instead of being retried right away, which would only extend the ban.
+    """
+
+    def __init__(self, weight_budget_per_minute: int, market_type: str):
+        self.weight_budget_per_minute: int = weight_budget_per_minute
+        self.weight_steps: list[tuple[int, int]] = futures_klines_weight_steps if market_type == "futures" else spot_klines_weight_steps
+
+        self.token_bucket = TokenBucket(capacity=weight_budget_per_minute, refill_rate=weight_budget_per_minute / 60)
+
+        # The monotonic time until which all requests are paused after a 429/418 response.
+        self.paused_until: float = 0
+        self.lock = threading.Lock()
+
+    def choose_limit(self, expected_candles: int) -> int:
+        """
+        Choose the cheapest limit value which still covers the expected number of candles in one request. For example, fetching the few newest
+        candles of a pair only needs a limit below 100, which weighs a fifth of a 1000-candle request on the futures API.
+
+        Args:
+            expected_candles (int): The number of candles expected in the requested time range.
+
+        Returns:
+            int: The limit parameter to use.
+        """
+
+        for limit, weight in self.weight_steps:
+            if expected_candles <= limit:
+                return limit
+
+        return self.weight_steps[-1][0]
+
+    def request_weight(self, limit: int) -> int:
+        for max_limit, weight in self.weight_steps:
+            if limit <= max_limit:
+                return weight
+
+        return self.weight_steps[-1][1]
+
+    def reserve(self, weight: int) -> float:
+        # Returns 0 if the request can be sent right away, otherwise the number of seconds to wait before trying again.
+        with self.lock:
+            pause_seconds = self.paused_until - time.monotonic()
+
+        if pause_seconds > 0:
+            return pause_seconds
+
+        return self.token_bucket.reserve(weight)
+
+    def acquire(self, limit: int) -> None:
+        # Block until a request with the given limit can be sent.
+        while (wait_seconds := self.reserve(self.request_weight(limit))) > 0:
+            time.sleep(wait_seconds)
+
+    async def acquire_async(self, limit: int) -> None:
+        while (wait_seconds := self.reserve(self.request_weight(limit))) > 0:
+            await asyncio.sleep(wait_seconds)
+
+    def register_response(self, status: int, headers) -> None:
+        """
+        Sync the scheduler with the rate limit information of a klines response.
+
+        Args:
+            status (int): The HTTP status of the response.
+            headers: The response headers (Any case-insensitive mapping, as returned by requests and aiohttp).
+        """
+
+        used_weight = headers.get("X-MBX-USED-WEIGHT-1M")
+        if used_weight is not None:
+            self.token_bucket.limit_tokens(self.weight_budget_per_minute - int(used_weight))
+
+        if status in [418, 429]:
+            retry_after_seconds = int(headers.get("Retry-After", 60))
+
+            with self.lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after_seconds)
+
+            self.token_bucket.limit_tokens(0)
+            logger.warning(f"Klines requests rate limited (HTTP {status}), pausing all requests for {retry_after_seconds} seconds...")
+
+
+klines_weight_scheduler = KlinesWeightScheduler(weight_budget_per_minute=constants.request_weight_budget, market_type=constants.market_type)
@@ -1,5 +1,7 @@
+from typing import Union
 import pandas as pd
 
+from algo_code.candle_frame import CandleFrame
 from algo_code.order_block import OrderBlock
 
 
@@ -10,6 +12,9 @@ class Segment:
     blocks isn't permitted, and we move on to the next segment.
     """
 
+    __slots__ = ("end_pdi", "start_pdi", "ob_leg_start_pdi", "ob_leg_end_pdi", "top_price", "bottom_price", "ob_formation_start_pdi",
+                 "broken_lpl_pdi", "type", "formation_method", "ob_list", "pair_df")
+
     def __init__(self, start_pdi: int,
                  end_pdi: int,
                  ob_leg_start_pdi: int,
@@ -33,7 +38,8 @@ class Segment:
         self.formation_method = formation_method
 
         self.ob_list: list[OrderBlock] = []
-        self.pair_df: pd.DataFrame = pd.DataFrame()
+        # The candles of the segment, set by filter_candlestick_range
+        self.pair_df: Union[pd.DataFrame, CandleFrame, None] = None
 
     def __repr__(self):
         return f"{self.type.capitalize()} segment starting at {self.start_pdi} ending at {self.end_pdi} OB formation at {self.ob_formation_start_pdi}"
@@ -44,7 +50,7 @@ class Segment:
         defined as the candles between the OB formation start and the end of the segment, inclusive. The inclusivity is important because in the code
         a segment's bounds are defined as such.
         """
-        self.pair_df = algo.pair_df.iloc[self.ob_formation_start_pdi:self.end_pdi + 1]
+        self.pair_df = algo.candles.window(self.ob_formation_start_pdi, self.end_pdi + 1)
 
     # noinspection LongLine
     def find_order_blocks(self, algo):
@@ -59,7 +65,7 @@ class Segment:
         # For testing and safety purposes, the ob_list property is reset.
         self.ob_list = []
 
-        # base_candle_type is the type of the pivot that is used to filter the zigzag_df dataframe for the correct pivot type. In ascending segments
+        # base_candle_type is the type of the pivot that is used to filter the zigzag pivots for the correct pivot type. In ascending segments
         # (patterns) the type is valley, and in descending segments it's peak.
         base_pivot_type = "valley" if self.type == "ascending" else "peak"
 
@@ -71,67 +77,25 @@ class Segment:
         # that have a higher PDI than the broken LPL PDI, meaning the boxes that form above the broken LPL in ascending and below the LPL in
         # descending
 
-        for pivot in algo.zigzag_df[(algo.zigzag_df.pivot_type == base_pivot_type) &
-                                    (self.ob_leg_start_pdi <= algo.zigzag_df.pdi) &
-                                    (algo.zigzag_df.pdi < self.broken_lpl_pdi)].itertuples():
+        for pivot in algo.zigzag_index.get_type_range_pivots(base_pivot_type, self.ob_leg_start_pdi, self.broken_lpl_pdi):
 
-            # This try-except block is used to determine the window that is used for finding replacement order blocks in the chart. Currently, the
-            # window spans from the very first base candle (the pivot found using the outer loop) to the lower-order pivot immediately after it.
-            # The except clause catches the error in case we reach the end of the chart and no more next pivots exist, in which case the end of the
-            # search window is set to the last candle of the whole dataset.
-            try:
-                next_pivot_pdi = algo.find_relative_pivot(pivot.pdi, 1)
-                replacement_ob_threshold_pdi = next_pivot_pdi
-            except IndexError:
-                replacement_ob_threshold_pdi = algo.pair_df.last_valid_index()
+            # The base candle is moved from the pivot towards the lower-order pivot immediately after it (or the end of the chart if there is none),
+            # until a candle which forms a valid order block is found. All the candidates of the leg are checked at once; see
+            # Algo.find_first_valid_ob. The exit candle is searched up to the OB formation start, and the price returning to the box or breaking its
+            # stop between the exit candle and the LPL breaking candle invalidates it. The stoploss is set at the pivot value of the INITIAL box that
+            # was found, since that's the box which has the liquidity.
+            first_valid_ob = algo.find_first_valid_ob(pivot, base_pivot_type,
+                                                      upper_search_bound_pdi=self.ob_formation_start_pdi,
+                                                      checks_end_pdi=self.ob_formation_start_pdi)
+            if first_valid_ob is None:
+                continue
 
             # times_moved indicates the times the algorithm had to move the base candle to find a replacement order block.
-            times_moved = 0
-
-            # The stoploss is set at the pivot value of the INITIAL box that was found, since that's the box which has the liquidity. This value is
-            # passed to the OB instantiation line as the stoploss value, which in turn goes to the Position attribute within it.
-            initial_pivot_candle_liquidity = pivot.pivot_value
-
-            for base_candle_pdi in range(pivot.pdi, replacement_ob_threshold_pdi):
-                base_candle = algo.pair_df.iloc[base_candle_pdi]
-                ob = OrderBlock(base_candle=base_candle,
-                                icl=initial_pivot_candle_liquidity,
-                                ob_type="long" if base_pivot_type == "valley" else "short")
-
-                ob.register_exit_candle(algo.pair_df, self.ob_formation_start_pdi)
-
-                # The reentry window dataframe is used to check whether the price returned to the box in the span between the exit candle and the LPL
-                # breaking candle. This is checked using the check_reentry_condition() method of the OrderBlock object. The reentry dataframe is
-                # passed as an argument to the method.
-                if ob.price_exit_index is not None:
-                    reentry_check_window: pd.DataFrame = algo.pair_df.iloc[ob.price_exit_index + 1:self.ob_formation_start_pdi]
-
-                # This else statement is implemented to account for boxes which don't have an exit candle which opens inside and closes outside of
-                # them, automatically making them invalid and prompting considering another replacement.
-                else:
-                    continue
-
-                # This check ensures that the order block being processed is totally valid to be used AFTER the formation of the pattern, that means
-                # that the order block has either A: had no reentry at all or B: has had its reentry after the formation of the pattern.
-                ob.check_reentry_condition(reentry_check_window)
-
-                conditions_check_window: pd.DataFrame = algo.pair_df[ob.start_index:self.ob_formation_start_pdi]
-                ob.set_condition_check_window(conditions_check_window)
-
-                ob.check_fvg_condition()
-                ob.check_stop_break_condition()
-
-                if ob.has_reentry_condition and ob.has_fvg_condition and ob.has_stop_break_condition:
-                    valid_ob_counter += 1
-
-                    ob.ranking_within_segment = valid_ob_counter
-
-                    ob.times_moved = times_moved
-                    ob.has_been_replaced = False
-                    self.ob_list.append(ob)
-                    break
+            ob, times_moved = first_valid_ob
 
-                else:
-                    ob.has_been_replaced = True
+            valid_ob_counter += 1
+            ob.ranking_within_segment = valid_ob_counter
 
-                times_moved += 1
+            ob.times_moved = times_moved
+            ob.has_been_replaced = False
+            self.ob_list.append(ob)
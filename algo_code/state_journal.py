@@ -0,0 +1,275 @@
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+import pandas as pd
+
+from algo_code.datatypes import Candle
+from algo_code.order_block import OrderBlock
+from algo_code.position import Position
+from utils import constants
+from utils.logger import logger
+
+# The keys of the positions_info_dict entry of a pair which are journaled as columns of the pairs table. The positions are kept in their own table.
+pair_state_keys: list[str] = ["latest_segment_start_time", "has_been_searched", "last_log_message"]
+
+schema = """
+CREATE TABLE IF NOT EXISTS pairs (
+    pair_name TEXT PRIMARY KEY,
+    latest_segment_start_time TEXT,
+    has_been_searched INTEGER,
+    last_log_message TEXT NOT NULL DEFAULT ''
+);
+
+CREATE TABLE IF NOT EXISTS positions (
+    pair_name TEXT NOT NULL,
+    ob_id TEXT NOT NULL,
+    ob_type TEXT NOT NULL,
+    base_pdi INTEGER NOT NULL,
+    base_time TEXT NOT NULL,
+    base_open REAL NOT NULL,
+    base_high REAL NOT NULL,
+    base_low REAL NOT NULL,
+    base_close REAL NOT NULL,
+    icl REAL NOT NULL,
+    has_been_entered INTEGER NOT NULL DEFAULT 0,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    validation_data TEXT,
+    channel_ids TEXT,
+    PRIMARY KEY (pair_name, ob_id)
+);
+
+CREATE TABLE IF NOT EXISTS position_messages (
+    pair_name TEXT NOT NULL,
+    ob_id TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (pair_name, ob_id, channel_id)
+);
+"""
+
+
+class PairState(dict):
+    """
+    The positions_info_dict entry of a pair, which records every change of its values in the state journal as it's made. Replacing the positions
+    list (e.g. with an empty list when the positions of a segment are canceled) releases the positions which aren't in the new list. Positions which
+    are added to the list are recorded by StateJournal.record_position.
+    """
+
+    def __init__(self, journal: "StateJournal", pair_name: str, state: dict):
+        super().__init__(state)
+        self.journal: StateJournal = journal
+        self.pair_name: str = pair_name
+
+    def __setitem__(self, key, value):
+        if key == "positions":
+            self.journal.release_positions(self.pair_name, kept_positions=value)
+        elif key in pair_state_keys and (key not in self or self[key] != value):
+            self.journal.record_pair_state(self.pair_name, key, value)
+
+        super().__setitem__(key, value)
+
+
+class StateJournal:
+    """
+    A persistent journal of the state of the main loop (positions_info_dict), kept in an SQLite database in WAL mode, so the bot can be restarted
+    without reposting its signals or losing the ability to cancel the ones which are live.
+
+    Every state transition is written as it happens, in its own transaction: the pair values through PairState, and the positions when they are
+    posted, when their message ID in each channel is known, when they are entered and when they are released. The positions are journaled with
+    their base candle, so their order block and prices are rebuilt exactly on startup. The IDs of all the order blocks ever posted for each pair
+    are kept in memory, so an order block is never posted twice, even across restarts.
+
+    A position is journaled before it's posted, along with the channels it's posted to and its validation data. If the bot stops before its
+    message ID in some of the channels is known, it is restored as pending, and can be posted to those channels again with load_pending_post.
+    """
+
+    def __init__(self, filename: str):
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+
+        # The connection is shared with the channel outbox thread, which records the message IDs, so it's guarded by the lock.
+        self.connection = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, NORMAL only syncs the database at checkpoints, which can't corrupt it but may lose the last transactions on a power loss.
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(schema)
+        self.lock = threading.Lock()
+
+        # The journals created before the columns of the pending posts were added are migrated in place.
+        position_columns = {row[1] for row in self.connection.execute("PRAGMA table_info(positions)")}
+        for column in ["validation_data", "channel_ids"]:
+            if column not in position_columns:
+                self.connection.execute(f"ALTER TABLE positions ADD COLUMN {column} TEXT")
+
+        self.posted_ob_ids: set[tuple[str, str]] = set(self.connection.execute("SELECT pair_name, ob_id FROM positions").fetchall())
+
+    def __write(self, sql: str, parameters: tuple) -> None:
+        with self.lock:
+            with self.connection:
+                self.connection.execute(sql, parameters)
+
+    @staticmethod
+    def __to_column_value(key: str, value):
+        if key == "latest_segment_start_time":
+            return value.isoformat() if value is not None else None
+        elif key == "has_been_searched":
+            return int(value) if value is not None else None
+
+        return value
+
+    @staticmethod
+    def __from_column_value(key: str, value):
+        if key == "latest_segment_start_time":
+            return pd.Timestamp(value) if value is not None else None
+        elif key == "has_been_searched":
+            return bool(value) if value is not None else None
+
+        return value
+
+    def load_positions_info(self, pair_list: list[str]) -> dict[str, PairState]:
+        """
+        Rebuild positions_info_dict from the journal. The pairs which aren't in the journal start fresh.
+
+        Args:
+            pair_list (list[str]): The pairs of the main loop.
+
+        Returns:
+            dict[str, PairState]: The state of each pair, with the active positions.
+        """
+
+        with self.lock:
+            pair_rows = {row[0]: row[1:] for row in self.connection.execute(f"SELECT pair_name, {', '.join(pair_state_keys)} FROM pairs")}
+            position_rows = self.connection.execute(
+                "SELECT pair_name, ob_id, ob_type, base_pdi, base_time, base_open, base_high, base_low, base_close, icl, has_been_entered, "
+                "channel_ids FROM positions WHERE is_active = 1 ORDER BY rowid").fetchall()
+            message_rows = self.connection.execute(
+                "SELECT position_messages.pair_name, position_messages.ob_id, channel_id, message_id FROM position_messages JOIN positions "
+                "ON positions.pair_name = position_messages.pair_name AND positions.ob_id = position_messages.ob_id "
+                "WHERE is_active = 1").fetchall()
+
+        message_ids: dict[tuple[str, str], dict[str, int]] = {}
+        for pair_name, ob_id, channel_id, message_id in message_rows:
+            message_ids.setdefault((pair_name, ob_id), {})[channel_id] = message_id
+
+        positions_info: dict[str, PairState] = {}
+        for pair_name in pair_list:
+            state = {"positions": [], "latest_segment_start_time": None, "has_been_searched": None, "last_log_message": ""}
+            if pair_name in pair_rows:
+                state.update({key: self.__from_column_value(key, value) for key, value in zip(pair_state_keys, pair_rows[pair_name])})
+
+            positions_info[pair_name] = PairState(self, pair_name, state)
+
+        for (pair_name, ob_id, ob_type, base_pdi, base_time, base_open, base_high, base_low, base_close, icl, has_been_entered,
+             channel_ids) in position_rows:
+            if pair_name not in positions_info:
+                continue
+
+            if channel_ids is None and (pair_name, ob_id) not in message_ids:
+                # Journaled by a version which didn't record the channels of the positions, so it can't be posted again.
+                logger.warning(f"\t{pair_name}\tPosition {ob_id} was never confirmed as posted and has no journaled channels, it won't be restored.")
+                continue
+
+            base_candle = Candle(base_pdi, pd.Timestamp(base_time), base_open, base_high, base_low, base_close)
+            position = OrderBlock(base_candle, icl, ob_type).position
+            position.message_ids = message_ids.get((pair_name, ob_id), {})
+            position.has_been_entered = bool(has_been_entered)
+
+            # The signal was queued, but not confirmed as posted in all of its channels before the bot stopped. Unless it has been entered since,
+            # it's restored as pending, to be posted again to those channels.
+            if not position.has_been_entered and channel_ids is not None and \
+                    any(channel_id not in position.message_ids for channel_id in json.loads(channel_ids)):
+                position.status = "PENDING"
+
+            # The list is extended in place, as the positions are already journaled.
+            positions_info[pair_name]["positions"].append(position)
+
+        return positions_info
+
+    def get_live_pairs(self) -> set[str]:
+        # The pairs which have an active position which has been posted and not entered, i.e. a pending signal in the channel.
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT DISTINCT positions.pair_name FROM positions JOIN position_messages "
+                "ON positions.pair_name = position_messages.pair_name AND positions.ob_id = position_messages.ob_id "
+                "WHERE is_active = 1 AND has_been_entered = 0").fetchall()
+
+        return {row[0] for row in rows}
+
+    def has_posted(self, pair_name: str, ob_id: str) -> bool:
+        # Whether the order block has ever been posted for the pair.
+        return (pair_name, ob_id) in self.posted_ob_ids
+
+    def record_pair_state(self, pair_name: str, key: str, value) -> None:
+        self.__write(f"INSERT INTO pairs (pair_name, {key}) VALUES (?, ?) ON CONFLICT (pair_name) DO UPDATE SET {key} = excluded.{key}",
+                     (pair_name, self.__to_column_value(key, value)))
+
+    def record_position(self, pair_name: str, position: Position, validation_data: dict, channel_ids: list[str]) -> None:
+        """
+        Record a position which is about to be posted. Its message IDs are recorded once it's posted to each channel, through record_message_id.
+
+        Args:
+            pair_name (str): The pair of the position.
+            position (Position): The position.
+            validation_data (dict): The validation data the position is posted with, so it can be posted again if the bot stops before it's posted.
+            channel_ids (list[str]): The channels the position is posted to.
+        """
+
+        ob = position.parent_ob
+        base_candle = ob.base_candle
+        self.__write("INSERT OR REPLACE INTO positions (pair_name, ob_id, ob_type, base_pdi, base_time, base_open, base_high, base_low, base_close, "
+                     "icl, has_been_entered, validation_data, channel_ids) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (pair_name, ob.id, ob.type, int(ob.start_index), pd.Timestamp(base_candle.time).isoformat(), float(base_candle.open),
+                      float(base_candle.high), float(base_candle.low), float(base_candle.close), float(ob.icl), int(position.has_been_entered),
+                      json.dumps(validation_data, default=str), json.dumps(channel_ids)))
+
+        self.posted_ob_ids.add((pair_name, ob.id))
+
+    def load_pending_post(self, pair_name: str, position: Position) -> tuple[dict, list[str]]:
+        """
+        Load what's needed to post a pending position again: the validation data it was posted with, and the channels it was posted to which
+        haven't confirmed its message ID.
+
+        Args:
+            pair_name (str): The pair of the position.
+            position (Position): The pending position, as restored by load_positions_info.
+
+        Returns:
+            tuple[dict, list[str]]: The validation data, and the IDs of the channels to post the position to.
+        """
+
+        with self.lock:
+            validation_data_json, channel_ids_json = self.connection.execute(
+                "SELECT validation_data, channel_ids FROM positions WHERE pair_name = ? AND ob_id = ?", (pair_name, position.parent_ob.id)).fetchone()
+
+        # All the values of the validation data are times (or lists of them), which were journaled as strings.
+        def to_times(value):
+            if isinstance(value, list):
+                return [to_times(element) for element in value]
+
+            return pd.Timestamp(value) if value is not None else None
+
+        validation_data = {key: to_times(value) for key, value in json.loads(validation_data_json).items()}
+        channel_ids = [channel_id for channel_id in json.loads(channel_ids_json) if channel_id not in position.message_ids]
+
+        return validation_data, channel_ids
+
+    def record_message_id(self, pair_name: str, ob_id: str, channel_id: str, message_future: Future) -> None:
+        # Done callback of the message future of a position posted to a channel.
+        if message_future.exception() is None:
+            self.__write("INSERT OR REPLACE INTO position_messages (pair_name, ob_id, channel_id, message_id) VALUES (?, ?, ?, ?)",
+                         (pair_name, ob_id, channel_id, message_future.result()))
+
+    def record_entered(self, pair_name: str, position: Position) -> None:
+        self.__write("UPDATE positions SET has_been_entered = 1 WHERE pair_name = ? AND ob_id = ?", (pair_name, position.parent_ob.id))
+
+    def release_positions(self, pair_name: str, kept_positions: list[Position]) -> None:
+        # Mark the active positions of the pair which aren't kept as inactive. They stay in the journal, so their order blocks aren't posted again.
+        kept_ob_ids = [position.parent_ob.id for position in kept_positions]
+        kept_ob_id_placeholders = ", ".join("?" * len(kept_ob_ids))
+        self.__write(f"UPDATE positions SET is_active = 0 WHERE pair_name = ? AND is_active = 1 AND ob_id NOT IN ({kept_ob_id_placeholders})",
+                     (pair_name, *kept_ob_ids))
+
+
+state_journal = StateJournal(os.path.join(constants.state_journal_dir, f"{constants.timeframe}_{constants.channel_id}.sqlite3"))
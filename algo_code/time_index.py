@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class PdiTimeIndex:
+    """
+    A two-way mapping between the PDIs of a series of candles and their open times, as UNIX timestamps in milliseconds.
+
+    The candles of a pair are spaced by the timeframe, so when the open times are evenly spaced (which they are unless the exchange skipped candles)
+    a time is mapped to its PDI with arithmetic. Otherwise, the mapping falls back to a binary search over the open times. PDI to time is always a
+    direct lookup. All the conversions are vectorized.
+    """
+
+    def __init__(self, times_ms: np.ndarray, first_pdi: int = 0):
+        self.times_ms: np.ndarray = times_ms
+        self.first_pdi: int = first_pdi
+
+        time_steps = np.diff(times_ms)
+        self.step_ms: int | None = int(time_steps[0]) if len(time_steps) > 0 else None
+        self.is_evenly_spaced: bool = len(time_steps) == 0 or (self.step_ms > 0 and bool((time_steps == self.step_ms).all()))
+
+    def get_times_ms(self, pdis) -> np.ndarray:
+        # The open times of the candles at the PDIs.
+        return self.times_ms[np.asarray(pdis) - self.first_pdi]
+
+    def find_positions(self, times_ms, side: str = "left") -> np.ndarray:
+        """
+        Find where the times would be inserted in the open times to keep them sorted, like np.searchsorted, as positions from the first candle.
+
+        Args:
+            times_ms: The times, as UNIX timestamps in milliseconds, either a scalar or an array.
+            side (str): "left" to get the position of the first candle at or after each time, "right" for the first candle after it.
+
+        Returns:
+            np.ndarray: The positions, between 0 and the number of candles.
+        """
+
+        times_ms = np.asarray(times_ms, dtype=np.int64)
+        if not self.is_evenly_spaced or self.step_ms is None:
+            return np.searchsorted(self.times_ms, times_ms, side=side)
+
+        offsets = times_ms - self.times_ms[0]
+        # For the left side, a time between two candles maps to the next one, hence the ceiling division; a time equal to an open time maps to its
+        # candle. For the right side, it maps to the candle after the last candle at or before the time.
+        if side == "left":
+            positions = -(-offsets // self.step_ms)
+        else:
+            positions = offsets // self.step_ms + 1
+
+        return np.clip(positions, 0, len(self.times_ms))
+
+    def find_pdis(self, times_ms, side: str = "left") -> np.ndarray:
+        # find_positions, as PDIs.
+        return self.find_positions(times_ms, side) + self.first_pdi
+
+    def get_pdis(self, times_ms) -> np.ndarray:
+        """
+        Get the PDIs of the candles with exactly the given open times.
+
+        Args:
+            times_ms: The open times, as UNIX timestamps in milliseconds, either a scalar or an array.
+
+        Returns:
+            np.ndarray: The PDIs of the candles.
+
+        Raises:
+            KeyError: If any of the times isn't the open time of a candle.
+        """
+
+        times_ms = np.asarray(times_ms, dtype=np.int64)
+        flat_times_ms = np.atleast_1d(times_ms)
+        positions = self.find_positions(flat_times_ms, side="left")
+
+        is_found = positions < len(self.times_ms)
+        is_found[is_found] = self.times_ms[positions[is_found]] == flat_times_ms[is_found]
+        if not is_found.all():
+            raise KeyError(f"No candles with the open times {flat_times_ms[~is_found].tolist()}")
+
+        return (positions + self.first_pdi).reshape(times_ms.shape)
@@ -0,0 +1,221 @@
+import numpy as np
+
+# The pivot types are stored as int8 codes in the pivot arrays.
+PEAK: int = 1
+VALLEY: int = -1
+
+pivot_type_codes: dict[str, int] = {
+    "peak": PEAK,
+    "valley": VALLEY
+}
+pivot_type_names: dict[int, str] = {code: name for name, code in pivot_type_codes.items()}
+
+# A zigzag pivot, with the open time of its candle as a UNIX timestamp in milliseconds.
+pivot_dtype = np.dtype([
+    ("pdi", np.int64),
+    ("time", np.int64),
+    ("pivot_value", np.float64),
+    ("pivot_type", np.int8)
+])
+
+
+def find_first_pivot(high: np.ndarray, low: np.ndarray) -> tuple[int, int]:
+    """
+    Find the first candle that has a higher high or a lower low than its previous candle, which is used as the first pivot if no starting pivot is
+    given.
+
+    Args:
+        high (np.ndarray): The high prices of the candles.
+        low (np.ndarray): The low prices of the candles.
+
+    Returns:
+        tuple[int, int]: The PDI and the type code of the first pivot.
+    """
+
+    first_pivot_pdi = int(np.flatnonzero((high[1:] > high[:-1]) | (low[1:] < low[:-1]))[0]) + 1
+    first_pivot_type = PEAK if high[first_pivot_pdi] > high[first_pivot_pdi - 1] else VALLEY
+
+    return first_pivot_pdi, first_pivot_type
+
+
+def run_zigzag(high: np.ndarray,
+               low: np.ndarray,
+               is_green: np.ndarray,
+               last_pivot_pdi: int,
+               last_pivot_type: int,
+               start_pdi: int = None,
+               end_pdi: int = None) -> tuple[list[int], list[int], int, int]:
+    """
+    Walk the candles from start_pdi up to (and NOT including) end_pdi, starting from the given tentative pivot, and find the pivots which are
+    confirmed along the way.
+
+    A candle which goes beyond the tentative pivot in its direction extends it, and a candle which goes beyond it in the opposite direction confirms
+    it and becomes the new tentative pivot of the other type. If a candle does both (an outside bar), its color decides which of its high and low was
+    probably hit first: a green candle reverses a valley, a red candle reverses a peak, otherwise the candle only extends the pivot. Each candle
+    confirms at most one pivot.
+
+    The loop runs over plain Python lists with the state in local variables, since the pivots depend on each other sequentially and can't be found
+    with array operations.
+
+    Args:
+        high (np.ndarray): The high prices of the candles.
+        low (np.ndarray): The low prices of the candles.
+        is_green (np.ndarray): The candle colors.
+        last_pivot_pdi (int): The PDI of the tentative pivot to start from.
+        last_pivot_type (int): The type code of the tentative pivot.
+        start_pdi (int): The PDI of the first candle to process, defaults to the candle after the tentative pivot.
+        end_pdi (int): The PDI after the last candle to process, defaults to the end of the candles.
+
+    Returns:
+        tuple[list[int], list[int], int, int]: The PDIs and the type codes of the confirmed pivots, and the PDI and the type code of the tentative
+                                               pivot after the last candle.
+    """
+
+    start_pdi = last_pivot_pdi + 1 if start_pdi is None else start_pdi
+    end_pdi = len(high) if end_pdi is None else end_pdi
+
+    highs: list[float] = high[start_pdi:end_pdi].tolist()
+    lows: list[float] = low[start_pdi:end_pdi].tolist()
+    greens: list[bool] = is_green[start_pdi:end_pdi].tolist()
+
+    last_high: float = float(high[last_pivot_pdi])
+    last_low: float = float(low[last_pivot_pdi])
+    is_peak: bool = last_pivot_type == PEAK
+
+    pivot_pdis: list[int] = []
+    pivot_types: list[int] = []
+
+    for i in range(len(highs)):
+        candle_high = highs[i]
+        candle_low = lows[i]
+
+        # For a peak, a higher high is an extension and a lower low is a reversal; the other way around for a valley.
+        if is_peak:
+            is_extension = candle_high > last_high
+            is_reversal = candle_low < last_low
+        else:
+            is_extension = candle_low < last_low
+            is_reversal = candle_high > last_high
+
+        if is_reversal and (not is_extension or greens[i] != is_peak):
+            pivot_pdis.append(last_pivot_pdi)
+            pivot_types.append(PEAK if is_peak else VALLEY)
+            is_peak = not is_peak
+
+        elif not is_extension:
+            continue
+
+        last_pivot_pdi = start_pdi + i
+        last_high = candle_high
+        last_low = candle_low
+
+    return pivot_pdis, pivot_types, last_pivot_pdi, PEAK if is_peak else VALLEY
+
+
+def make_pivot_array(pivot_pdis: list[int], pivot_types: list[int], times_ms: np.ndarray, high: np.ndarray, low: np.ndarray) -> np.ndarray:
+    """
+    Build the structured pivot array from the PDIs and type codes of the pivots. The value of a peak is the high of its candle and the value of a
+    valley is its low.
+
+    Args:
+        pivot_pdis (list[int]): The PDIs of the pivots.
+        pivot_types (list[int]): The type codes of the pivots.
+        times_ms (np.ndarray): The open times of the candles, as UNIX timestamps in milliseconds.
+        high (np.ndarray): The high prices of the candles.
+        low (np.ndarray): The low prices of the candles.
+
+    Returns:
+        np.ndarray: The pivots, with the pivot_dtype dtype.
+    """
+
+    pdis = np.asarray(pivot_pdis, dtype=np.int64)
+    types = np.asarray(pivot_types, dtype=np.int8)
+
+    pivots = np.empty(len(pdis), dtype=pivot_dtype)
+    pivots["pdi"] = pdis
+    pivots["time"] = times_ms[pdis]
+    pivots["pivot_value"] = np.where(types == PEAK, high[pdis], low[pdis])
+    pivots["pivot_type"] = types
+
+    return pivots
+
+
+class ZigzagState:
+    """
+    The persistent zigzag of a pair, which is updated with the newly closed candles on each loop instead of being recomputed from the starting pivot.
+
+    Only closed candles are fed to the state, since the pivots they confirm can never change. The forming candle is simulated on top of the state
+    each time the pivots are requested, so the result is the same as running the zigzag over all the candles. The state holds the confirmed pivots,
+    the tentative pivot and the PDI after the last processed candle. If the candles it was built from are replaced (e.g. the history was fetched
+    again from a different start), the state resets itself and starts over from the starting pivot.
+    """
+
+    def __init__(self, last_pivot_type: str, last_pivot_pdi: int = 0):
+        self.starting_pivot_type: int = pivot_type_codes[last_pivot_type]
+        self.starting_pivot_pdi: int = last_pivot_pdi
+
+        self.pivots: np.ndarray = np.empty(0, dtype=pivot_dtype)
+        self.last_pivot_pdi: int = last_pivot_pdi
+        self.last_pivot_type: int = self.starting_pivot_type
+        self.processed_end_pdi: int = last_pivot_pdi + 1
+        self.last_processed_time_ms: int | None = None
+
+    def reset(self) -> None:
+        self.__init__(pivot_type_names[self.starting_pivot_type], self.starting_pivot_pdi)
+
+    def is_consistent_with(self, candles) -> bool:
+        # The candles are consistent with the state if the last processed candle is still a closed candle with the same open time.
+        if self.last_processed_time_ms is None:
+            return True
+
+        return self.processed_end_pdi < len(candles) and candles.times_ms[self.processed_end_pdi - 1] == self.last_processed_time_ms
+
+    def update(self, candles) -> None:
+        """
+        Feed the closed candles which haven't been processed yet to the state. The last candle is the forming one, so it isn't processed.
+
+        Args:
+            candles (CandleFrame): All the candles of the pair, starting from PDI 0.
+        """
+
+        if not self.is_consistent_with(candles):
+            self.reset()
+
+        closed_end_pdi = len(candles) - 1
+        if closed_end_pdi <= self.processed_end_pdi:
+            return
+
+        pivot_pdis, pivot_types, self.last_pivot_pdi, self.last_pivot_type = run_zigzag(candles.high, candles.low, candles.is_green,
+                                                                                        last_pivot_pdi=self.last_pivot_pdi,
+                                                                                        last_pivot_type=self.last_pivot_type,
+                                                                                        start_pdi=self.processed_end_pdi,
+                                                                                        end_pdi=closed_end_pdi)
+        if len(pivot_pdis) > 0:
+            new_pivots = make_pivot_array(pivot_pdis, pivot_types, candles.times_ms, candles.high, candles.low)
+            self.pivots = np.concatenate([self.pivots, new_pivots])
+
+        self.processed_end_pdi = closed_end_pdi
+        self.last_processed_time_ms = int(candles.times_ms[closed_end_pdi - 1])
+
+    def get_pivots(self, candles) -> np.ndarray:
+        """
+        Update the state with the new closed candles and get the pivots of all the candles, including the pivot the forming candle might confirm.
+
+        Args:
+            candles (CandleFrame): All the candles of the pair, starting from PDI 0.
+
+        Returns:
+            np.ndarray: The pivots, with the pivot_dtype dtype.
+        """
+
+        self.update(candles)
+
+        # The forming candle is run on a copy of the tentative pivot, so the state isn't changed by it.
+        pivot_pdis, pivot_types, _, _ = run_zigzag(candles.high, candles.low, candles.is_green,
+                                                   last_pivot_pdi=self.last_pivot_pdi,
+                                                   last_pivot_type=self.last_pivot_type,
+                                                   start_pdi=self.processed_end_pdi)
+        if len(pivot_pdis) == 0:
+            return self.pivots
+
+        return np.concatenate([self.pivots, make_pivot_array(pivot_pdis, pivot_types, candles.times_ms, candles.high, candles.low)])
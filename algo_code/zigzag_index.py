@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+from algo_code.datatypes import Pivot
+from algo_code.zigzag_engine import pivot_type_codes, pivot_type_names
+
+
+class ZigzagIndex:
+    """
+    An index over the pivots of a zigzag, for the lookups the algorithm does over and over: the row of a pivot by its PDI, the pivots relative to a
+    pivot, and the pivots of a type within a PDI range. The rows are found with a PDI->row dict and with binary searches over the sorted PDIs of each
+    pivot type, instead of filtering a DataFrame of the pivots with a full boolean mask on every lookup.
+    """
+
+    def __init__(self, pivots: np.ndarray, timezone=None):
+        """
+        Args:
+            pivots (np.ndarray): The pivots, with the zigzag_engine.pivot_dtype dtype, in PDI order.
+            timezone: The timezone of the candle times, used for the times of the returned pivots.
+        """
+
+        self.pdis: np.ndarray = pivots["pdi"]
+        self.times_ms: np.ndarray = pivots["time"]
+        self.values: np.ndarray = pivots["pivot_value"]
+        self.types: np.ndarray = pivots["pivot_type"]
+        self.timezone = timezone
+
+        self.row_by_pdi: dict[int, int] = {pdi: row for row, pdi in enumerate(self.pdis.tolist())}
+
+        # The rows and the PDIs of the pivots of each type, both sorted by PDI.
+        self.rows_by_type: dict[int, np.ndarray] = {code: np.flatnonzero(self.types == code) for code in pivot_type_names}
+        self.pdis_by_type: dict[int, np.ndarray] = {code: self.pdis[rows] for code, rows in self.rows_by_type.items()}
+
+    def __len__(self) -> int:
+        return len(self.pdis)
+
+    def get_row(self, pdi: int) -> int:
+        """
+        Get the row of a pivot in the zigzag.
+
+        Args:
+            pdi (int): The PDI of the pivot.
+
+        Returns:
+            int: The row of the pivot.
+
+        Raises:
+            KeyError: If there is no pivot at the PDI.
+        """
+
+        return self.row_by_pdi[int(pdi)]
+
+    def get_pivot_at_row(self, row: int) -> Pivot:
+        time = pd.Timestamp(self.times_ms[row], unit="ms", tz=self.timezone)
+
+        return Pivot(int(self.pdis[row]), time, self.values[row], pivot_type_names[int(self.types[row])])
+
+    def get_pivot(self, pdi: int) -> Pivot:
+        return self.get_pivot_at_row(self.get_row(pdi))
+
+    def get_value(self, pdi: int) -> float:
+        return self.values[self.get_row(pdi)]
+
+    def get_relative_pivot_pdi(self, pdi: int, delta: int) -> int:
+        """
+        Get the PDI of the pivot delta pivots away from the given pivot. Like iloc, a negative row counts from the end of the zigzag and a row past
+        the end raises an IndexError.
+
+        Args:
+            pdi (int): The PDI of the pivot.
+            delta (int): The distance from the pivot to the relative pivot.
+
+        Returns:
+            int: The PDI of the relative pivot.
+        """
+
+        return int(self.pdis[self.get_row(pdi) + delta])
+
+    def get_type_range_rows(self, pivot_type: str, start_pdi: int = None, end_pdi: int = None, include_end: bool = False) -> np.ndarray:
+        """
+        Get the rows of the pivots of a type with start_pdi <= PDI < end_pdi (or <= end_pdi if include_end is set).
+
+        Args:
+            pivot_type (str): The type of the pivots, "peak" or "valley".
+            start_pdi (int): The lower bound of the PDIs, defaults to no bound.
+            end_pdi (int): The upper bound of the PDIs, defaults to no bound.
+            include_end (bool): Whether end_pdi itself is included in the range.
+
+        Returns:
+            np.ndarray: The rows of the pivots, in PDI order.
+        """
+
+        type_code = pivot_type_codes[pivot_type]
+        type_pdis = self.pdis_by_type[type_code]
+
+        start = 0 if start_pdi is None else np.searchsorted(type_pdis, start_pdi, side="left")
+        end = len(type_pdis) if end_pdi is None else np.searchsorted(type_pdis, end_pdi, side="right" if include_end else "left")
+
+        return self.rows_by_type[type_code][start:end]
+
+    def get_type_range_pivots(self, pivot_type: str, start_pdi: int = None, end_pdi: int = None, include_end: bool = False) -> list[Pivot]:
+        # The pivots of get_type_range_rows.
+        return [self.get_pivot_at_row(row) for row in self.get_type_range_rows(pivot_type, start_pdi, end_pdi, include_end)]
+
+    def get_last_pivot_pdi_of_type(self, pivot_type: str, max_pdi: int) -> int:
+        """
+        Get the last pivot of a type at or before a PDI.
+
+        Args:
+            pivot_type (str): The type of the pivot, "peak" or "valley".
+            max_pdi (int): The PDI to search up to, inclusive.
+
+        Returns:
+            int: The PDI of the pivot.
+
+        Raises:
+            IndexError: If there is no such pivot.
+        """
+
+        type_pdis = self.pdis_by_type[pivot_type_codes[pivot_type]]
+        position = np.searchsorted(type_pdis, max_pdi, side="right") - 1
+        if position < 0:
+            raise IndexError(f"No {pivot_type} pivot at or before PDI {max_pdi}")
+
+        return int(type_pdis[position])
+
+    def get_extremum_pivot_pdi(self, pivot_type: str, start_pdi: int, end_pdi: int) -> int:
+        """
+        Get the highest peak or the lowest valley with start_pdi <= PDI <= end_pdi. If several pivots share the extreme value, the first one is
+        returned.
+
+        Args:
+            pivot_type (str): The type of the pivot, "peak" for the highest peak or "valley" for the lowest valley.
+            start_pdi (int): The first PDI of the range.
+            end_pdi (int): The last PDI of the range.
+
+        Returns:
+            int: The PDI of the extremum pivot.
+
+        Raises:
+            ValueError: If there are no pivots of the type in the range.
+        """
+
+        rows = self.get_type_range_rows(pivot_type, start_pdi, end_pdi, include_end=True)
+        range_values = self.values[rows]
+        extremum_position = np.argmax(range_values) if pivot_type == "peak" else np.argmin(range_values)
+
+        return int(self.pdis[rows[extremum_position]])
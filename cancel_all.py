@@ -1,12 +1,84 @@
-# Cancels all the pairs in pair_list.csv
+# Cancels all the pairs in pair_list.csv, or only the pairs with a live signal according to the state journal, in every channel the signals are
+# fanned out to.
+#
+# The cancels are sent concurrently, as fast as the rate limit of each channel allows. The canceled pairs are recorded in a progress file as they're
+# canceled in each channel, so an interrupted run can be resumed without canceling the same pairs again.
 
-from utils.channel_utils import post_message
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from algo_code.general_utils import get_pair_list
+from algo_code.state_journal import state_journal
+from utils.channel_config import channel_configs
+from utils.channel_utils import send_message
 import utils.constants as constants
+from utils.logger import logger
+
+progress_filename = f"{constants.pair_list_filename}.cancel_progress"
+
+
+def cancel_pair(pair_name: str, channel_id: str) -> None:
+    send_message(f"Cancel #{pair_name.replace('US', '/US')}", chat_id=channel_id)
+
+
+pair_list = get_pair_list(constants.pair_list_filename)
+
+# The progress file has a "pair_name channel_id" line for each cancel which was sent.
+canceled_pairs: set[tuple[str, str]] = set()
+if os.path.exists(progress_filename):
+    with open(progress_filename) as progress_file:
+        previously_canceled_pairs = {tuple(line.split()) for line in progress_file if line.strip()}
+
+    resume_input = input(f"A previous run sent {len(previously_canceled_pairs)} of the cancels. Resume it (Y/N)?")
+    if resume_input.lower() == "y":
+        canceled_pairs = previously_canceled_pairs
+    else:
+        os.remove(progress_filename)
 
-confirmation_input = input("About to cancel all signals in the list above. Continue (Y/N)?")
+active_only_input = input("Only cancel the pairs with a live signal according to the state journal (Y/N)?")
+if active_only_input.lower() == "y":
+    live_pairs = state_journal.get_live_pairs()
+    pair_list = [pair_name for pair_name in pair_list if pair_name in live_pairs]
+
+pairs_to_cancel = [(pair_name, channel_config.channel_id) for pair_name in pair_list for channel_config in channel_configs
+                   if (pair_name, channel_config.channel_id) not in canceled_pairs]
+pair_names_to_cancel = list(dict.fromkeys(pair_name for pair_name, _ in pairs_to_cancel))
+logger.info(f"{len(pairs_to_cancel)} cancels to send, for {len(pair_names_to_cancel)} pairs in {len(channel_configs)} channels: "
+            f"{', '.join(pair_names_to_cancel)}")
+
+confirmation_input = input(f"About to send the {len(pairs_to_cancel)} cancels listed above. Continue (Y/N)?")
 
 if confirmation_input.lower() == "y":
-    for symbol in open(constants.pair_list_filename):
-        if "pairs" not in symbol:
-            separated_symbol = symbol.replace("US", "/US")
-            post_message(f"Cancel #{separated_symbol}")
+    failed_pairs: list[str] = []
+
+    # The rate limit of each channel is enforced by the channel transport, the threads only overlap the requests up to the burst the rate limits
+    # allow in all the channels.
+    max_workers = constants.channel_message_burst * len(channel_configs)
+    with open(progress_filename, "a") as progress_file, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        cancel_futures = {executor.submit(cancel_pair, pair_name, channel_id): (pair_name, channel_id) for pair_name, channel_id in pairs_to_cancel}
+
+        for num_done, cancel_future in enumerate(as_completed(cancel_futures), start=1):
+            pair_name, channel_id = cancel_futures[cancel_future]
+            try:
+                cancel_future.result()
+
+            except Exception as e:
+                failed_pairs.append(pair_name)
+                logger.error(f"[{num_done}/{len(pairs_to_cancel)}] Failed to cancel {pair_name} in channel {channel_id}: {e}")
+                continue
+
+            progress_file.write(f"{pair_name} {channel_id}\n")
+            progress_file.flush()
+            logger.info(f"[{num_done}/{len(pairs_to_cancel)}] Canceled {pair_name} in channel {channel_id}")
+
+    # The positions of the pairs which were canceled in every channel are released in the journal, so the main loop doesn't cancel them again after
+    # a restart.
+    for pair_name in {pair_name for pair_name, _ in pairs_to_cancel} - set(failed_pairs):
+        state_journal.release_positions(pair_name, kept_positions=[])
+
+    # The progress is only kept if some of the pairs are left to cancel, so the next run resumes from them.
+    if len(failed_pairs) == 0:
+        os.remove(progress_filename)
+        logger.info(f"Sent all {len(pairs_to_cancel)} cancels.")
+    else:
+        logger.warning(f"{len(failed_pairs)} cancels couldn't be sent, run the script again to resume: {failed_pairs}")
@@ -1,12 +1,21 @@
+from functools import partial
+
 import pandas as pd
-import time
 
 from utils.initialize import initiate_pair_list, initialize
 from algo_code.algo import Algo
+from algo_code.candle_frame import CandleFrame
+from algo_code.zigzag_engine import ZigzagState
+from algo_code.h_o_zigzag_state import HOZigzagState
 from algo_code.segment import Segment
 from algo_code.position import Position
+from algo_code.state_journal import state_journal
 from algo_code.general_utils import get_pairs_start_data, get_pairs_data_parallel, make_set_width
+from algo_code.kline_stream import KlineStream
+from algo_code.async_fetcher import get_pairs_data_async
+from utils.channel_config import channel_configs
 from utils.logger import logger
+from utils.loop_scheduler import CandleCloseScheduler
 import utils.constants as constants
 
 pair_list: list[str] = initiate_pair_list()
@@ -18,26 +27,87 @@ initialize()
 # populated with appropriate data.
 # Added is the "has_been_searched" key, which is used to determine if an appropriate HO zigzag leg has been searched for positions. If True, the
 # algorithm waits until the next segment is found before searching for positions again.
-positions_info_dict: dict[str, dict[str, list[Position] | pd.Timestamp | None | bool | str]] = {}
-
-for pair_name in pair_list:
-    positions_info_dict[pair_name] = {}
-    positions_info_dict[pair_name]["positions"]: list[Position] = []
-    positions_info_dict[pair_name]["latest_segment_start_time"] = None
-    positions_info_dict[pair_name]["has_been_searched"] = None
-    positions_info_dict[pair_name]["last_log_message"] = ""
+# The dict is rebuilt from the state journal, which records every change made to it, so a restart resumes with the positions which are still live.
+positions_info_dict: dict[str, dict[str, list[Position] | pd.Timestamp | None | bool | str]] = state_journal.load_positions_info(pair_list)
 
 #  Initializing the starting data
 pairs_start_times, pairs_starting_pivot_types = get_pairs_start_data(pair_list)
 
+# The zigzag of each pair is kept between the loops, so only the newly closed candles are processed on each loop.
+zigzag_states: dict[str, ZigzagState] = {pair_name: ZigzagState(last_pivot_type=pairs_starting_pivot_types[pair_name], last_pivot_pdi=0)
+                                         for pair_name in pair_list}
+
+# The higher order zigzag of each pair is checkpointed between the loops as well, so it resumes from its last settled point.
+h_o_zigzag_states: dict[str, HOZigzagState] = {pair_name: HOZigzagState() for pair_name in pair_list}
+
+# The REST klines fetcher, either the asyncio one with a shared connection pool or the thread pool one. Both have the same interface.
+get_pairs_data = get_pairs_data_async if constants.kline_fetcher == "async" else get_pairs_data_parallel
+
+
+def post_position(pair_name: str, position: Position, validation_data: dict, channel_ids: list[str]):
+    # Queue the position to be posted to the channels, and journal its message ID in each channel once it's posted.
+    for channel_id, message_future in position.post_to_channels(pair_name, validation_data, channel_ids).items():
+        message_future.add_done_callback(partial(state_journal.record_message_id, pair_name, position.parent_ob.id, channel_id))
+
+
+# The open time of the latest candle of each pair at the last check of the entries. That candle was still forming, so the next check starts from
+# it, and the prices it reached after the check and before it closed are checked too.
+entries_checked_times: dict[str, pd.Timestamp] = {}
+
+
+def register_entries(pair_name: str, candles: CandleFrame):
+    # Register the entries of the posted positions of a pair by the candles since the last check, and journal the newly entered ones.
+    for position in Algo.register_entries_since(positions_info_dict[pair_name]["positions"], candles, entries_checked_times.get(pair_name)):
+        state_journal.record_entered(pair_name, position)
+
+    entries_checked_times[pair_name] = candles.get_time(candles.last_pdi)
+
+
+def register_intra_candle_entries():
+    # Between candle closes, only the entries of the already posted positions are checked, against the candles of each pair since the last check.
+    # This keeps the entered positions from being canceled without running the whole algorithm.
+    pairs_with_positions = [pair_name for pair_name in pair_list if len(positions_info_dict[pair_name]["positions"]) > 0]
+    if len(pairs_with_positions) == 0:
+        return
+
+    latest_pairs_data: dict[str, pd.DataFrame] = get_pairs_data(pairs_with_positions, pairs_start_times)
+    for pair_name, pair_df in latest_pairs_data.items():
+        if pair_df is None:
+            continue
+
+        register_entries(pair_name, CandleFrame.from_pair_df(pair_df, price_dtype=constants.candle_price_dtype))
+
+
+# The positions which were journaled but not confirmed as posted in all of their channels before the bot stopped are posted again to the remaining
+# channels. The bot can't tell if a post was sent in the moment before it stopped, so in that rare case the signal is posted twice, rather than being
+# left live in a channel without the message ID to cancel it.
+for pair_name in pair_list:
+    for position in positions_info_dict[pair_name]["positions"]:
+        if position.status == "PENDING":
+            pending_validation_data, pending_channel_ids = state_journal.load_pending_post(pair_name, position)
+            logger.warning(f"\t{make_set_width(pair_name)}\tPosition {position.parent_ob.id} wasn't confirmed as posted before the restart, "
+                           f"posting it again to {len(pending_channel_ids)} channels...")
+            post_position(pair_name, position, pending_validation_data, pending_channel_ids)
+
+# In REST ingestion mode, each iteration runs right after a candle closes.
+candle_close_scheduler = CandleCloseScheduler(constants.timeframe, constants.candle_close_grace_seconds, constants.main_loop_interval)
+
+# In websocket ingestion mode, the candles are kept up to date by the kline streams instead of being polled every loop.
+kline_stream: KlineStream | None = None
+if constants.ingestion_mode == "websocket":
+    kline_stream = KlineStream(pair_list, pairs_start_times)
+    kline_stream.start()
+
 while True:
     # Get the data for all the pairs in parallel. Data for each pair is stored as the value and as a pd.DataFrame. Error handling is done per-pair
     # further down.
-    pairs_data: dict[str, pd.DataFrame] = get_pairs_data_parallel(pair_list, pairs_start_times)
+    if kline_stream is not None:
+        pairs_data: dict[str, pd.DataFrame] = kline_stream.get_pairs_data()
+    else:
+        pairs_data: dict[str, pd.DataFrame] = get_pairs_data(pair_list, pairs_start_times)
 
     for pair_name in pair_list:
         start_time: pd.Timestamp = pairs_start_times[pair_name]
-        starting_pivot_type: str = pairs_starting_pivot_types[pair_name]
 
         pair_df: pd.DataFrame = pairs_data[pair_name]
 
@@ -47,22 +117,23 @@ while True:
             logger.warning(f"\t{make_set_width(pair_name)}\tNo data for pair found. The fetching most likely failed. Skipping...")
             continue
 
-        latest_candle = pair_df.iloc[-1]
+        # The candles are converted to column arrays once, and the rest of the iteration reads single candles and times from them directly instead
+        # of building a pandas row for each access.
+        candles = CandleFrame.from_pair_df(pair_df, price_dtype=constants.candle_price_dtype)
 
-        for position in positions_info_dict[pair_name]['positions']:
-            Algo.register_possible_position_entries(position, latest_candle)
+        register_entries(pair_name, candles)
 
         # HO zigzag calculations __________________________________________________________________
-        algo = Algo(pair_df=pair_df, symbol=pair_name)
-        algo.init_zigzag(last_pivot_type=starting_pivot_type, last_pivot_candle_pdi=0)
+        algo = Algo(pair_df=candles, symbol=pair_name)
+        algo.init_zigzag(zigzag_state=zigzag_states[pair_name])
         try:
-            h_o_starting_point: int = int(algo.zigzag_df.iloc[0].pdi)
+            h_o_starting_point: int = int(algo.zigzag_index.pdis[0])
         except:
             logger.warning(
                 f"\t{make_set_width(pair_name)}\tThe starting point entered isn't a lower order zigzag pivot... Consider changing the starting point."
                 f" Skipping the pair...")
             continue
-        algo.calc_h_o_zigzag(starting_point_pdi=h_o_starting_point)
+        algo.calc_h_o_zigzag(starting_point_pdi=h_o_starting_point, h_o_state=h_o_zigzag_states[pair_name])
 
         # Determining where in the pattern we are _________________________________________________
         try:
@@ -86,7 +157,7 @@ while True:
 
             # Otherwise, if the latest segment has a BOS formation type, and after it has ended the new HO zigzag point has not yet formed, that means
             # the segment has ended by a candle closing above/below the BOS, but no appropriate HO zigzag leg exists to search for positions.
-            elif latest_segment.formation_method == "bos" and latest_candle.time >= algo.convert_pdis_to_times(latest_segment.end_pdi) and len(
+            elif latest_segment.formation_method == "bos" and candles.last_pdi >= latest_segment.end_pdi and len(
                     [h_o_pivot_pdi for h_o_pivot_pdi in algo.h_o_indices if h_o_pivot_pdi > latest_segment.end_pdi]) == 0:
                 if positions_info_dict[pair_name]["last_log_message"] != "NO_ZZ_LEG_FOUND":
                     logger.debug(f"\t{make_set_width(pair_name)}\tNo new HO zigzag leg found after the last segment, waiting...")
@@ -98,10 +169,8 @@ while True:
 
         # Position formation ______________________________________________________________________
         # If the latest segment is finished (Which it should have, since segments only register once the end condition is met), find the leg which the
-        # positions should form on.
-        latest_segment_end_time: pd.Timestamp = pair_df.iloc[latest_segment.end_pdi].time
-
-        if latest_candle.time >= latest_segment_end_time:
+        # positions should form on. Since the candles are sorted by time, comparing the times of candles is done by comparing their PDIs.
+        if candles.last_pdi >= latest_segment.end_pdi:
             position_search_window = algo.find_position_search_window(latest_segment)
 
             # If no broken LPL is found, the method returns None; So we would move on to the next pair.
@@ -129,57 +198,61 @@ while True:
             # Finding eligible pivots for position formation ______________________________________
             # Positions should only be posted once the activation threshold has passed. This condition would normally implicitly pass, but for the
             # sake of clarity, it is explicitly stated.
-            if latest_candle.time > algo.pair_df.iloc[position_activation_threshold].time:
+            if candles.last_pdi > position_activation_threshold:
                 # Iterate through pivots of the correct type, located in the correct range. Same logic as finding order blocks in segments.
-                eligible_lo_pivots = algo.zigzag_df[(algo.zigzag_df.pivot_type == base_pivot_type) &
-                                                    (position_search_start_pdi <= algo.zigzag_df.pdi) &
-                                                    (algo.zigzag_df.pdi < position_search_end_pdi)]
+                eligible_lo_pivots = algo.zigzag_index.get_type_range_pivots(base_pivot_type, position_search_start_pdi, position_search_end_pdi)
 
                 # Finding a good base candle ______________________________________________________
-                for pivot in eligible_lo_pivots.itertuples():
-                    # The PDI of the last candle that needs to be checked to find a replacement.
-                    replacement_ob_threshold_pdi = algo.define_replacement_ob_threshold(pivot)
-
-                    # This variable is used to calculate the initial liquidity of the order block. It is the liquidity of the pivot candle on the
-                    # "tip" of the LO zigzag. The value is used for setting the stoploss for the positions.
-                    initial_pivot_candle_liquidity: float = pivot.pivot_value
-
-                    # Iterate through the candle in the LO zigzag leg, trying to find the first base candle that forms a valid order block.
-                    for base_candle_pdi in range(pivot.pdi, replacement_ob_threshold_pdi):
-                        base_candle = algo.pair_df.iloc[base_candle_pdi]
-                        ob = algo.form_potential_ob(base_candle, base_pivot_type, initial_pivot_candle_liquidity, position_activation_threshold)
-
-                        # If no OB has been found (typically due to no exit candle being found), move on to the next candle in the replacement window.
-                        if ob is None:
-                            continue
-
-                        # Registering and posting a discovered OB _________________________________
-                        # If a valid order block which passes all the checks and conditions is found, post it to the channel and add it to the list of
-                        # positions found for this pair.
-                        if ob.has_reentry_condition and ob.has_fvg_condition and ob.has_stop_break_condition:
-                            # Validation data to be appended to the signal
-                            validation_data = {
-                                "activation_time": algo.pair_df.iloc[position_activation_threshold].time,
-                                "broken_lpl": algo.pair_df.iloc[position_search_end_pdi].time,
-                                "position_search_window": algo.convert_pdis_to_times([position_search_start_pdi, position_search_end_pdi]),
-                                "latest_segment_bounds": algo.convert_pdis_to_times([latest_segment.start_pdi, latest_segment.end_pdi]),
-                                "latest_segment_ho_pivots": algo.convert_pdis_to_times(
-                                    [index for index in algo.h_o_indices if latest_segment.start_pdi <= index])
-                            }
-                            ob.position.message_id = ob.position.post_to_channel(pair_name, validation_data)
-
-                            # Add the found position to the list of positions for this pair, and set the latest segment start time to the time of the
-                            # latest segment's start time at the time of finding the positions.
-                            positions_info_dict[pair_name]["positions"].append(ob.position)
-                            logger.info(f"\t{make_set_width(pair_name)}\tPosition found, OBID {ob.id}")
-
-                            # If a position is found, we don't need to keep looking for valid OB's. We can break out of the loop and move on to the
-                            # next "tip" pivot in the search window.
-                            break
+                for pivot in eligible_lo_pivots:
+                    # Find the first base candle in the LO zigzag leg, from the pivot up to the replacement OB threshold, that forms a valid order
+                    # block. The stoploss of the positions is set from the liquidity of the pivot candle on the "tip" of the LO zigzag. In validation
+                    # mode, the algorithm won't avoid posting positions that have been entered by price movements after the activation threshold,
+                    # therefore the positions can be more thoroughly examined.
+                    first_valid_ob = algo.find_first_valid_ob(pivot, base_pivot_type,
+                                                              upper_search_bound_pdi=position_activation_threshold,
+                                                              checks_end_pdi=position_activation_threshold if constants.validation_mode else None)
+
+                    # If no candle in the leg forms a valid OB, move on to the next "tip" pivot in the search window.
+                    if first_valid_ob is None:
+                        continue
+
+                    ob, _ = first_valid_ob
+
+                    # An order block which has already been posted (e.g. before a restart) is never posted again.
+                    if state_journal.has_posted(pair_name, ob.id):
+                        logger.debug(f"\t{make_set_width(pair_name)}\tPosition {ob.id} has already been posted, skipping...")
+                        continue
+
+                    # Registering and posting a discovered OB _________________________________
+                    # If a valid order block which passes all the checks and conditions is found, post it to the channel and add it to the list of
+                    # positions found for this pair.
+                    # Validation data to be appended to the signal
+                    validation_data = {
+                        "activation_time": candles.get_time(position_activation_threshold),
+                        "broken_lpl": candles.get_time(position_search_end_pdi),
+                        "position_search_window": algo.convert_pdis_to_times([position_search_start_pdi, position_search_end_pdi]),
+                        "latest_segment_bounds": algo.convert_pdis_to_times([latest_segment.start_pdi, latest_segment.end_pdi]),
+                        "latest_segment_ho_pivots": algo.convert_pdis_to_times(
+                            [index for index in algo.h_o_indices if latest_segment.start_pdi <= index])
+                    }
+                    # The position is journaled before it's posted, so it's never posted twice. The signal is only queued here, the channel outbox
+                    # posts it to every channel in the background and registers its message IDs on the position and in the journal.
+                    channel_ids = [channel_config.channel_id for channel_config in channel_configs]
+                    state_journal.record_position(pair_name, ob.position, validation_data, channel_ids)
+                    post_position(pair_name, ob.position, validation_data, channel_ids)
+
+                    # Add the found position to the list of positions for this pair, and set the latest segment start time to the time of the
+                    # latest segment's start time at the time of finding the positions.
+                    positions_info_dict[pair_name]["positions"].append(ob.position)
+                    logger.info(f"\t{make_set_width(pair_name)}\tPosition found, OBID {ob.id}")
 
         else:
             if positions_info_dict[pair_name]["last_log_message"] != "LAST_SEGMENT_NOT_ENDED":
                 logger.debug(f"\t{make_set_width(pair_name)}\tPosition searching is required...")
                 positions_info_dict[pair_name]["last_log_message"] = "LAST_SEGMENT_NOT_ENDED"
 
-    time.sleep(constants.main_loop_interval)
+    # With the kline streams, the next iteration runs as soon as a candle closes. Otherwise, the data is polled again right after the next close.
+    if kline_stream is not None:
+        kline_stream.wait_for_candle_close()
+    else:
+        candle_close_scheduler.wait_for_next_close(register_intra_candle_entries if constants.intra_candle_entry_checks else None)
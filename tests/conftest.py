@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules of the bot are imported from the root of the repo, and read their .env files from the working directory, so the tests run from there
+# like the bot does.
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+os.chdir(repo_root)
@@ -0,0 +1,48 @@
+# Checks the registration of the position entries across a candle close, as done by the main loop in the REST ingestion mode.
+
+import pandas as pd
+
+from algo_code.algo import Algo
+from algo_code.candle_frame import CandleFrame
+from algo_code.datatypes import Candle
+from algo_code.order_block import OrderBlock
+
+
+def make_pair_df(candles: list[list[float]]) -> pd.DataFrame:
+    pair_df = pd.DataFrame(candles, columns=["open", "high", "low", "close"])
+    pair_df.insert(0, "time", pd.date_range("2024-12-10 00:00:00", periods=len(candles), freq=pd.Timedelta("15min")))
+    pair_df["candle_color"] = ["green" if row.close > row.open else "red" for row in pair_df.itertuples()]
+
+    return pair_df
+
+
+def make_long_position(entry_price: float):
+    # A long position is entered at the top of its order block.
+    return OrderBlock(Candle(0, pd.Timestamp("2024-12-09 00:00:00"), entry_price - 0.5, entry_price, entry_price - 1, entry_price - 0.2),
+                      icl=entry_price - 1.5, ob_type="long").position
+
+
+def test_final_stretch_of_a_candle_is_checked_after_its_close():
+    position = make_long_position(entry_price=99.0)
+
+    # The last intra-candle check sees the forming candle before its low reaches the entry.
+    forming_candles = CandleFrame.from_pair_df(make_pair_df([[100.0, 100.5, 99.8, 100.2], [100.2, 100.4, 99.6, 99.9]]))
+    assert Algo.register_entries_since([position], forming_candles, since_time=None) == []
+    since_time = forming_candles.get_time(forming_candles.last_pdi)
+
+    # In its last minutes, the candle dips to the entry, and the next candle opens back above it.
+    closed_candles = CandleFrame.from_pair_df(make_pair_df([[100.0, 100.5, 99.8, 100.2], [100.2, 100.4, 98.7, 99.9], [99.9, 100.1, 99.7, 100.0]]))
+    assert Algo.register_entries_since([position], closed_candles, since_time=None) == []
+    assert Algo.register_entries_since([position], closed_candles, since_time=since_time) == [position]
+
+    # An entered position isn't registered again.
+    assert Algo.register_entries_since([position], closed_candles, since_time=since_time) == []
+
+
+def test_candles_between_checks_are_checked():
+    position = make_long_position(entry_price=99.0)
+    candles = CandleFrame.from_pair_df(make_pair_df([[100.0, 100.5, 99.8, 100.2], [100.2, 100.4, 98.5, 99.9], [99.9, 100.1, 99.5, 99.8],
+                                                     [99.8, 100.3, 99.6, 100.1]]))
+
+    # The fetch of the pair failed for two closes, so the candles since the last check include candles which were never the latest one.
+    assert Algo.register_entries_since([position], candles, since_time=candles.get_time(0)) == [position]
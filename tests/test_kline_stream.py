@@ -0,0 +1,110 @@
+# Runs the kline stream against the local replay server, with the candles of one pair served from a CSV file.
+
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from algo_code.algo import Algo
+from algo_code.candle_frame import CandleFrame
+from algo_code.datatypes import Candle
+from algo_code.candle_store import candle_store
+from algo_code.general_utils import pairs_candle_cache
+from algo_code.kline_stream import KlineStream
+from algo_code.order_block import OrderBlock
+from utils import constants
+from utils.kline_replay_server import serve
+
+symbol = "TESTUSDT"
+history_start_time = pd.Timestamp("2024-12-10 00:00:00", tz="UTC")
+replay_start_time = pd.Timestamp("2024-12-10 05:00:00", tz="UTC")
+
+# The replayed candles. The second one spikes up to 103 between its updates, which only its closed kline shows, since the replay server moves the
+# price linearly from the open to the close over the updates of a candle.
+replayed_candles = [[100.0, 100.3, 99.9, 100.2],
+                    [100.2, 103.0, 100.0, 100.4],
+                    [100.4, 100.6, 100.1, 100.5],
+                    [100.5, 100.7, 100.3, 100.6],
+                    [100.6, 100.8, 100.4, 100.7]]
+
+
+@pytest.fixture(scope="module")
+def kline_stream(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("replay_data")
+
+    history_times = pd.date_range(history_start_time, replay_start_time, freq=pd.Timedelta(constants.timeframe), inclusive="left")
+    history_candles = [[100.0, 100.5, 99.5, 100.0]] * len(history_times)
+    replay_times = pd.date_range(replay_start_time, periods=len(replayed_candles), freq=pd.Timedelta(constants.timeframe))
+    candle_df = pd.DataFrame(history_candles + replayed_candles, columns=["open", "high", "low", "close"])
+    candle_df.insert(0, "time", history_times.append(replay_times).strftime("%Y-%m-%d %H:%M:%S"))
+    candle_df.to_csv(data_dir / f"{symbol}.csv", index=False)
+
+    with socket.socket() as free_socket:
+        free_socket.bind(("localhost", 0))
+        port = free_socket.getsockname()[1]
+
+    server_args = argparse.Namespace(data_dir=str(data_dir), timeframe=constants.timeframe, start_time=str(replay_start_time), candle_seconds=2,
+                                     updates_per_candle=4, port=port)
+    threading.Thread(target=asyncio.run, args=(serve(server_args),), daemon=True).start()
+    time.sleep(0.5)
+
+    # The backfill goes to the replay server, and the closed candles to a temporary candle store.
+    original_rest_url, original_store_dir = constants.binance_rest_url, candle_store.root_dir
+    constants.binance_rest_url = f"http://localhost:{port}/fapi/v1"
+    candle_store.root_dir = str(tmp_path_factory.mktemp("candle_store"))
+    pairs_candle_cache.pop(symbol, None)
+
+    stream = KlineStream([symbol], {symbol: history_start_time}, ws_url=f"ws://localhost:{port}")
+    stream.start()
+
+    yield stream
+
+    stream.stop()
+    pairs_candle_cache.pop(symbol, None)
+    constants.binance_rest_url, candle_store.root_dir = original_rest_url, original_store_dir
+
+
+def test_closed_candles_are_stored(kline_stream):
+    assert symbol in kline_stream.wait_for_candle_close(timeout=10)
+
+    candles = CandleFrame.from_pair_df(kline_stream.get_pairs_data()[symbol])
+    stored_records = candle_store.read_records(symbol)
+
+    # Everything but the placeholder of the forming candle is stored, up to the candle which has just closed on the stream.
+    assert len(stored_records) == len(candles) - 1
+    assert stored_records[-1]["time"] == candles.times_ms[-2]
+    assert np.array_equal([stored_records[-1][column] for column in ["open", "high", "low", "close"]],
+                          [candles.open[-2], candles.high[-2], candles.low[-2], candles.close[-2]])
+
+
+def test_entry_inside_a_closed_candle_is_registered(kline_stream):
+    # The times of pair_df are naive, in UTC.
+    spike_candle_time = (replay_start_time + pd.Timedelta(constants.timeframe)).tz_localize(None)
+
+    # A short position entered at 102, which only the high of the spiking candle reaches.
+    position = OrderBlock(Candle(0, history_start_time, 101.0, 104.0, 102.0, 103.0), icl=104.5, ob_type="short").position
+
+    # Check the entries while the spiking candle is forming, like the main loop does right after the previous candle closes.
+    candles = CandleFrame.from_pair_df(kline_stream.get_pairs_data()[symbol])
+    while candles.get_time(candles.last_pdi) < spike_candle_time:
+        kline_stream.wait_for_candle_close(timeout=10)
+        candles = CandleFrame.from_pair_df(kline_stream.get_pairs_data()[symbol])
+
+    assert candles.get_time(candles.last_pdi) == spike_candle_time
+    assert Algo.register_entries_since([position], candles, since_time=None) == []
+    since_time = candles.get_time(candles.last_pdi)
+
+    assert symbol in kline_stream.wait_for_candle_close(timeout=10)
+    candles = CandleFrame.from_pair_df(kline_stream.get_pairs_data()[symbol])
+
+    # The latest candle is the placeholder of the next candle, which opens at the close of the spiking candle and doesn't reach the entry. The
+    # spiking candle itself does, once it's checked from the time of the last check.
+    assert candles.get_time(candles.last_pdi - 1) == spike_candle_time
+    assert Algo.register_entries_since([position], candles, since_time=None) == []
+    assert Algo.register_entries_since([position], candles, since_time=since_time) == [position]
+    assert position.has_been_entered
@@ -0,0 +1,81 @@
+# Checks the batched order block checks of OrderBlockCandidates against the per-candle checks of OrderBlock, on random walk candles.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from algo_code.algo import Algo
+from algo_code.ob_candidates import OrderBlockCandidates
+from algo_code.order_block import OrderBlock
+
+
+def make_random_walk_candles(seed: int, num_candles: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+
+    close = 100 + np.cumsum(rng.normal(0, 0.5, num_candles))
+    open_ = np.concatenate([[100.0], close[:-1]])
+    high = np.maximum(open_, close) + np.abs(rng.normal(0, 0.3, num_candles))
+    low = np.minimum(open_, close) - np.abs(rng.normal(0, 0.3, num_candles))
+
+    # The prices are rounded, so some of the candles have equal highs and lows, which the checks have to treat the same way.
+    pair_df = pd.DataFrame({"time": pd.date_range("2024-12-09 21:00:00", periods=num_candles, freq="15min"),
+                            "open": np.round(open_, 2), "high": np.round(high, 2), "low": np.round(low, 2), "close": np.round(close, 2)})
+    pair_df["candle_color"] = np.where(pair_df.close > pair_df.open, "green", "red")
+
+    return pair_df
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_candidates_match_per_candle_checks(seed: int):
+    algo = Algo(pair_df=make_random_walk_candles(seed, 4000), symbol="TESTUSDT")
+    algo.init_zigzag(last_pivot_type="valley", last_pivot_candle_pdi=0)
+    algo.calc_h_o_zigzag(starting_point_pdi=int(algo.zigzag_df.iloc[0].pdi))
+
+    num_checked_candidates = 0
+    for segment in algo.segments:
+        base_pivot_type = "valley" if segment.type == "ascending" else "peak"
+        ob_type = "long" if base_pivot_type == "valley" else "short"
+
+        for pivot in algo.zigzag_index.get_type_range_pivots(base_pivot_type, segment.ob_leg_start_pdi, segment.broken_lpl_pdi):
+            replacement_ob_threshold_pdi = algo.define_replacement_ob_threshold(pivot)
+
+            # The bounds of the exit candle search and of the check windows, as used by the segments, by the position search in and out of
+            # validation mode, and a search bounded by the candidates themselves.
+            for upper_search_bound_pdi, checks_end_pdi in [(segment.ob_formation_start_pdi, segment.ob_formation_start_pdi),
+                                                           (segment.end_pdi, None),
+                                                           (segment.end_pdi, segment.end_pdi),
+                                                           (replacement_ob_threshold_pdi - 1, None)]:
+                candidates = OrderBlockCandidates(algo.candles, pivot.pdi, replacement_ob_threshold_pdi, ob_type,
+                                                  upper_search_bound_pdi, checks_end_pdi)
+
+                for candidate_index, base_pdi in enumerate(range(pivot.pdi, replacement_ob_threshold_pdi)):
+                    num_checked_candidates += 1
+                    context = f"seed {seed}, base candle {base_pdi}, bounds ({upper_search_bound_pdi}, {checks_end_pdi})"
+
+                    ob = OrderBlock(algo.candles.candle(base_pdi), pivot.pivot_value, ob_type)
+                    ob.register_exit_candle(algo.candles, upper_search_bound_pdi)
+
+                    assert candidates.has_exit[candidate_index] == (ob.price_exit_index is not None), context
+                    if ob.price_exit_index is None:
+                        continue
+
+                    ob.check_reentry_condition(algo.candles.window(ob.price_exit_index + 1, checks_end_pdi))
+                    ob.set_condition_check_window(algo.candles.window(base_pdi, checks_end_pdi))
+                    ob.check_fvg_condition()
+                    ob.check_stop_break_condition()
+
+                    assert candidates.exit_pdis[candidate_index] == ob.price_exit_index, context
+                    assert candidates.has_reentry_condition[candidate_index] == ob.has_reentry_condition, context
+                    assert candidates.has_fvg_condition[candidate_index] == ob.has_fvg_condition, context
+                    assert candidates.has_stop_break_condition[candidate_index] == ob.has_stop_break_condition, context
+
+                    # The order block formed from the results of the checks is the same as the one checked candle by candle.
+                    formed_ob = candidates.form_order_block(candidate_index, pivot.pivot_value)
+                    assert formed_ob.id == ob.id and formed_ob.icl == ob.icl, context
+                    assert formed_ob.price_exit_index == ob.price_exit_index, context
+                    assert (formed_ob.condition_check_window.first_pdi, len(formed_ob.condition_check_window)) == \
+                           (ob.condition_check_window.first_pdi, len(ob.condition_check_window)), context
+                    assert (formed_ob.has_reentry_condition, formed_ob.has_fvg_condition, formed_ob.has_stop_break_condition) == \
+                           (ob.has_reentry_condition, ob.has_fvg_condition, ob.has_stop_break_condition), context
+
+    assert num_checked_candidates > 0
@@ -0,0 +1,76 @@
+# Checks that the positions which weren't confirmed as posted before a restart are restored as pending, with what's needed to post them again.
+
+import sqlite3
+from concurrent.futures import Future
+
+import pandas as pd
+
+from algo_code.datatypes import Candle
+from algo_code.order_block import OrderBlock
+from algo_code.state_journal import StateJournal, schema
+
+validation_data = {"activation_time": pd.Timestamp("2024-12-10 05:00:00"),
+                   "broken_lpl": pd.Timestamp("2024-12-10 04:00:00"),
+                   "position_search_window": [pd.Timestamp("2024-12-10 01:00:00"), pd.Timestamp("2024-12-10 04:00:00")],
+                   "latest_segment_bounds": [pd.Timestamp("2024-12-09 20:00:00"), pd.Timestamp("2024-12-10 04:00:00")],
+                   "latest_segment_ho_pivots": [pd.Timestamp("2024-12-09 20:00:00"), pd.Timestamp("2024-12-10 02:00:00")]}
+
+
+def make_position(base_pdi: int):
+    base_candle = Candle(base_pdi, pd.Timestamp("2024-12-10 00:00:00") + pd.Timedelta(minutes=15 * base_pdi), 100.0, 101.0, 99.0, 100.5)
+    return OrderBlock(base_candle, icl=98.5, ob_type="long").position
+
+
+def posted_future(message_id: int) -> Future:
+    future = Future()
+    future.set_result(message_id)
+
+    return future
+
+
+def test_unconfirmed_positions_are_restored_as_pending(tmp_path):
+    journal_filename = str(tmp_path / "journal.sqlite3")
+    journal = StateJournal(journal_filename)
+
+    # The first position was confirmed in both channels, the second one only in the first channel, and the third one in none before the restart.
+    positions = [make_position(base_pdi) for base_pdi in [10, 20, 30]]
+    for position in positions:
+        journal.record_position("TESTUSDT", position, validation_data, ["-100", "-200"])
+
+    journal.record_message_id("TESTUSDT", positions[0].parent_ob.id, "-100", posted_future(1))
+    journal.record_message_id("TESTUSDT", positions[0].parent_ob.id, "-200", posted_future(2))
+    journal.record_message_id("TESTUSDT", positions[1].parent_ob.id, "-100", posted_future(3))
+
+    restarted_journal = StateJournal(journal_filename)
+    restored_positions = restarted_journal.load_positions_info(["TESTUSDT"])["TESTUSDT"]["positions"]
+
+    assert [position.parent_ob.id for position in restored_positions] == [position.parent_ob.id for position in positions]
+    assert [position.status for position in restored_positions] == ["ACTIVE", "PENDING", "PENDING"]
+    assert restored_positions[1].message_ids == {"-100": 3}
+
+    assert restarted_journal.load_pending_post("TESTUSDT", restored_positions[1]) == (validation_data, ["-200"])
+    assert restarted_journal.load_pending_post("TESTUSDT", restored_positions[2]) == (validation_data, ["-100", "-200"])
+
+    # The pending positions are still never posted twice by the main loop.
+    assert restarted_journal.has_posted("TESTUSDT", positions[2].parent_ob.id)
+
+
+def test_journal_without_the_pending_post_columns_is_migrated(tmp_path):
+    journal_filename = str(tmp_path / "journal.sqlite3")
+
+    # The positions table as it was before the channels and the validation data of the positions were journaled.
+    connection = sqlite3.connect(journal_filename)
+    connection.executescript(schema.replace("    validation_data TEXT,\n    channel_ids TEXT,\n", ""))
+    connection.execute("INSERT INTO positions (pair_name, ob_id, ob_type, base_pdi, base_time, base_open, base_high, base_low, base_close, icl) "
+                       "VALUES ('TESTUSDT', 'OB1', 'long', 1, '2024-12-10T00:15:00', 100, 101, 99, 100.5, 98.5)")
+    connection.commit()
+    connection.close()
+
+    journal = StateJournal(journal_filename)
+
+    # The old position was never confirmed and has no journaled channels, so it can't be posted again.
+    assert journal.load_positions_info(["TESTUSDT"])["TESTUSDT"]["positions"] == []
+
+    position = make_position(10)
+    journal.record_position("TESTUSDT", position, validation_data, ["-100"])
+    assert journal.load_positions_info(["TESTUSDT"])["TESTUSDT"]["positions"][0].status == "PENDING"
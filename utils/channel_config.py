@@ -0,0 +1,45 @@
+import os
+from typing import NamedTuple
+
+import pandas as pd
+
+import utils.constants as constants
+
+
+class ChannelConfig(NamedTuple):
+    channel_id: str
+    leverage: int
+    leverage_type: str
+    validation_mode: bool
+
+    @property
+    def template_key(self) -> tuple:
+        # The channels with the same template key get the same rendered signal message.
+        return self.leverage, self.leverage_type, self.validation_mode
+
+
+def load_channel_configs() -> list[ChannelConfig]:
+    """
+    Load the channels the signals are fanned out to. The first channel is always the one set by the credentials (or the --cid argument), with the
+    leverage and validation settings of .env.params. In prod mode, the channels of the channel list file are added after it, each with its own
+    template settings. The file has the channel_id, leverage, leverage_type and validation_mode columns.
+
+    Returns:
+        list[ChannelConfig]: The channels to post to.
+    """
+
+    channel_configs = [ChannelConfig(str(constants.channel_id), constants.leverage, constants.leverage_type, constants.validation_mode)]
+
+    if constants.mode.lower() == "prod" and os.path.exists(constants.channel_list_filename):
+        channel_list_df = pd.read_csv(constants.channel_list_filename, dtype={"channel_id": str, "leverage_type": str, "validation_mode": str})
+        for channel_row in channel_list_df.itertuples():
+            if channel_row.channel_id in [channel_config.channel_id for channel_config in channel_configs]:
+                continue
+
+            channel_configs.append(ChannelConfig(channel_row.channel_id, int(channel_row.leverage), channel_row.leverage_type.capitalize(),
+                                                 channel_row.validation_mode.lower() == "true"))
+
+    return channel_configs
+
+
+channel_configs: list[ChannelConfig] = load_channel_configs()
@@ -0,0 +1,133 @@
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+
+import utils.channel_utils as channel_utils
+from utils.logger import logger
+
+
+class OutboxMessage:
+    __slots__ = ("chat_id", "message", "reply_id", "reply_offset", "future")
+
+    def __init__(self, chat_id: str | None, message: str, reply_id: int | Future | None, reply_offset: int, future: Future):
+        self.chat_id: str | None = chat_id
+        self.message: str = message
+        # The id of the message to reply to, or the future of a message submitted before, whose id is only known once it has been posted.
+        self.reply_id: int | Future | None = reply_id
+        self.reply_offset: int = reply_offset
+        self.future: Future = future
+
+
+class ChannelOutbox:
+    """
+    The queues of the messages to post to the channels, posted in order by a background worker thread per channel, so the main loop never waits for
+    the Telegram API or for the pacing between the posts, and the channels are posted to concurrently.
+
+    Submitting a message returns a Future of its message id. The rate limiting and the retries of the posts are done by the channel transport, in
+    the workers. Since the messages of a channel are posted in the order they are submitted, a message can reply to the future of a message
+    submitted to the same channel before it (e.g. the cancel message of a signal which is still waiting in the queue).
+    """
+
+    def __init__(self):
+        self.__queues: dict[str | None, queue.Queue[OutboxMessage | None]] = {}
+        self.__workers: dict[str | None, threading.Thread] = {}
+        self.__lock = threading.Lock()
+
+    def submit(self, message: str, reply_id: int | Future | None = None, reply_offset: int = 0, chat_id: str = None) -> Future:
+        """
+        Queue a message to be posted to a channel, without waiting for it to be posted.
+
+        Args:
+            message (str): The message to post.
+            reply_id (int | Future | None): The id of the message to reply to, or the future of an earlier submitted message to reply to.
+            reply_offset (int): An offset added to the id of the message replied to.
+            chat_id (str): The id of the channel to post to, defaults to the channel set in the constants.
+
+        Returns:
+            Future: The future of the id of the posted message. If the message couldn't be posted, the future holds the exception instead.
+        """
+
+        future = Future()
+        self.__get_queue(chat_id).put(OutboxMessage(chat_id, message, reply_id, reply_offset, future))
+
+        return future
+
+    def __get_queue(self, chat_id: str | None) -> queue.Queue:
+        # The queue and the worker of a channel are created on the first message submitted to it, so importing the outbox (e.g. in scripts which
+        # never post) doesn't start a thread.
+        with self.__lock:
+            if chat_id not in self.__workers:
+                self.__queues[chat_id] = queue.Queue()
+                self.__workers[chat_id] = threading.Thread(target=self.__run, args=(self.__queues[chat_id],), name=f"channel_outbox_{chat_id}",
+                                                           daemon=True)
+                self.__workers[chat_id].start()
+
+            return self.__queues[chat_id]
+
+    def __run(self, chat_queue: queue.Queue) -> None:
+        while (outbox_message := chat_queue.get()) is not None:
+            try:
+                self.__post(outbox_message)
+            finally:
+                chat_queue.task_done()
+
+        chat_queue.task_done()
+
+    def __post(self, outbox_message: OutboxMessage) -> None:
+        if not outbox_message.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            reply_id = outbox_message.reply_id
+            if isinstance(reply_id, Future):
+                # The message replied to was submitted before this one, so it has already been posted (or failed, which fails this message too).
+                reply_id = reply_id.result()
+            if reply_id is not None:
+                reply_id += outbox_message.reply_offset
+
+        except Exception as e:
+            logger.error(f"Failed to post message, the message it replies to wasn't posted: {e}")
+            outbox_message.future.set_exception(e)
+            return
+
+        try:
+            message_id = channel_utils.send_message(outbox_message.message, reply_id, outbox_message.chat_id)
+
+        except Exception as e:
+            logger.error(f"Failed to post message: {e}")
+            outbox_message.future.set_exception(e)
+            return
+
+        outbox_message.future.set_result(message_id)
+
+    def pending_count(self) -> int:
+        # The number of messages which are queued or being posted, in all the channels.
+        with self.__lock:
+            return sum(chat_queue.unfinished_tasks for chat_queue in self.__queues.values())
+
+    def flush(self) -> None:
+        # Block until every submitted message has been posted or has failed.
+        with self.__lock:
+            chat_queues = list(self.__queues.values())
+
+        for chat_queue in chat_queues:
+            chat_queue.join()
+
+    def close(self) -> None:
+        # Post the remaining messages and stop the workers.
+        with self.__lock:
+            workers = list(self.__workers.values())
+            for chat_queue in self.__queues.values():
+                chat_queue.put(None)
+
+            self.__queues = {}
+            self.__workers = {}
+
+        for worker in workers:
+            worker.join()
+
+
+# The outbox of the channels, shared by everything which posts to them. The remaining messages are posted before the program exits.
+channel_outbox = ChannelOutbox()
+atexit.register(channel_outbox.close)
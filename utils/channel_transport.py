@@ -0,0 +1,171 @@
+import json
+import random
+import threading
+import time
+
+import requests
+
+import utils.constants as constants
+from utils.logger import logger
+from utils.rate_limit import TokenBucket
+
+
+class ChannelPostError(Exception):
+    """
+    Raised when a message couldn't be posted to a chat, either because Telegram rejected it permanently or because the attempts budget ran out.
+    """
+
+    def __init__(self, message: str, attempts: int):
+        super().__init__(message)
+        self.attempts: int = attempts
+
+
+class ChannelTransport:
+    """
+    Sends messages to Telegram chats with a bounded retry policy and a per-chat rate limit.
+
+    Each chat has its own token bucket, so the posts use the allowed message rate of the chat fully instead of waiting a fixed time after every post.
+    Failed requests are retried with an exponential backoff, except for rate limited requests (HTTP 429), which are retried after the retry_after
+    period reported by Telegram, during which the chat is paused for every sender. Requests which Telegram rejects permanently (e.g. a bad chat ID or
+    a malformed message) are not retried. Messages which fail permanently, or which run out of attempts, are appended to a dead-letter JSONL file so
+    they can be inspected or reposted by hand.
+    """
+
+    def __init__(self, bot_token: str, messages_per_minute: float, burst: int, max_attempts: int, backoff_base_seconds: float,
+                 backoff_max_seconds: float, dead_letter_filename: str, request_timeout_seconds: float = 10):
+        self.bot_token: str = bot_token
+        self.messages_per_minute: float = messages_per_minute
+        self.burst: int = burst
+
+        self.max_attempts: int = max_attempts
+        self.backoff_base_seconds: float = backoff_base_seconds
+        self.backoff_max_seconds: float = backoff_max_seconds
+        self.request_timeout_seconds: float = request_timeout_seconds
+
+        self.dead_letter_filename: str = dead_letter_filename
+
+        # The token bucket of each chat and the monotonic time until which each chat is paused after a 429 response.
+        self.chat_buckets: dict[str | int, TokenBucket] = {}
+        self.chat_paused_until: dict[str | int, float] = {}
+        self.lock = threading.Lock()
+
+    def __get_bucket(self, chat_id: str | int) -> TokenBucket:
+        with self.lock:
+            if chat_id not in self.chat_buckets:
+                self.chat_buckets[chat_id] = TokenBucket(capacity=self.burst, refill_rate=self.messages_per_minute / 60)
+
+            return self.chat_buckets[chat_id]
+
+    def reserve(self, chat_id: str | int) -> float:
+        # Returns 0 if a message can be sent to the chat right away, otherwise the number of seconds to wait before trying again.
+        with self.lock:
+            pause_seconds = self.chat_paused_until.get(chat_id, 0) - time.monotonic()
+
+        if pause_seconds > 0:
+            return pause_seconds
+
+        return self.__get_bucket(chat_id).reserve()
+
+    def acquire(self, chat_id: str | int) -> None:
+        # Block until a message can be sent to the chat.
+        while (wait_seconds := self.reserve(chat_id)) > 0:
+            time.sleep(wait_seconds)
+
+    def pause_chat(self, chat_id: str | int, seconds: float) -> None:
+        # Pause all the posts to the chat, e.g. for the retry_after period of a 429 response.
+        with self.lock:
+            self.chat_paused_until[chat_id] = max(self.chat_paused_until.get(chat_id, 0), time.monotonic() + seconds)
+
+        self.__get_bucket(chat_id).limit_tokens(0)
+
+    def get_backoff_seconds(self, attempt: int) -> float:
+        # The exponential backoff after a failed attempt, with a random jitter so the retries of different messages don't line up.
+        backoff_seconds = min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempt - 1))
+
+        return backoff_seconds * random.uniform(0.5, 1)
+
+    def send(self, chat_id: str | int, message: str, reply_id: int = None) -> int:
+        """
+        Send a message to a chat, retrying according to the retry policy.
+
+        Args:
+            chat_id (str | int): The ID of the chat to post to.
+            message (str): The message to post.
+            reply_id (int): The id of the message to reply to, if any.
+
+        Returns:
+            int: The id of the message that was posted.
+
+        Raises:
+            ChannelPostError: If the message failed permanently or ran out of attempts. The message is recorded in the dead-letter file first.
+        """
+
+        payload = {
+            "chat_id": chat_id,
+            "text": message,
+            "reply_to_message_id": reply_id
+        }
+
+        error_description = None
+        for attempt in range(1, self.max_attempts + 1):
+            self.acquire(chat_id)
+
+            try:
+                response = requests.post(f'https://api.telegram.org/bot{self.bot_token}/sendMessage', json=payload,
+                                         timeout=self.request_timeout_seconds).json()
+
+            except Exception as e:
+                # Network errors and non-JSON responses (e.g. from a proxy) are retried.
+                error_description = f"{type(e).__name__}: {e}"
+                logger.error(f"Failed to post message (attempt {attempt}/{self.max_attempts}): {error_description}")
+                time.sleep(self.get_backoff_seconds(attempt))
+                continue
+
+            if response.get("ok"):
+                return response["result"]["message_id"]
+
+            error_code = response.get("error_code")
+            error_description = response.get("description")
+            logger.error(f"Failed to post message (attempt {attempt}/{self.max_attempts}): {error_description}")
+
+            if error_code == 429:
+                # The chat is paused for the retry_after period, which also delays the next attempt of this message.
+                retry_after_seconds = response.get("parameters", {}).get("retry_after", self.backoff_max_seconds)
+                self.pause_chat(chat_id, retry_after_seconds)
+
+            elif error_code is not None and 400 <= error_code < 500:
+                # Other client errors won't succeed on a retry.
+                self.record_dead_letter(chat_id, message, reply_id, attempt, error_description)
+                raise ChannelPostError(f"Telegram rejected the message: {error_description}", attempt)
+
+            else:
+                time.sleep(self.get_backoff_seconds(attempt))
+
+        self.record_dead_letter(chat_id, message, reply_id, self.max_attempts, error_description)
+        raise ChannelPostError(f"Failed to post the message after {self.max_attempts} attempts: {error_description}", self.max_attempts)
+
+    def record_dead_letter(self, chat_id: str | int, message: str, reply_id: int | None, attempts: int, error: str | None) -> None:
+        # Append a message which couldn't be posted to the dead-letter file, as one JSON record per line.
+        record = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "chat_id": chat_id,
+            "reply_id": reply_id,
+            "attempts": attempts,
+            "error": error,
+            "message": message
+        }
+
+        with self.lock:
+            with open(self.dead_letter_filename, "a") as dead_letter_file:
+                dead_letter_file.write(json.dumps(record) + "\n")
+
+        logger.error(f"Message to chat {chat_id} recorded in {self.dead_letter_filename} after {attempts} attempts")
+
+
+channel_transport = ChannelTransport(bot_token=constants.credentials.get("BOT_TOKEN"),
+                                     messages_per_minute=constants.channel_messages_per_minute,
+                                     burst=constants.channel_message_burst,
+                                     max_attempts=constants.channel_post_max_attempts,
+                                     backoff_base_seconds=constants.channel_post_backoff_base_seconds,
+                                     backoff_max_seconds=constants.channel_post_backoff_max_seconds,
+                                     dead_letter_filename=constants.channel_dead_letter_filename)
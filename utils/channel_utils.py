@@ -1,38 +1,43 @@
 import requests
-import time
 
+from utils.channel_transport import channel_transport
 import utils.constants as constants
-from utils.logger import logger
 
 
-def post_message(message: str, reply_id: int = None):
+def send_message(message: str, reply_id: int = None, chat_id: str = None):
     """
-    Post a message to the channel
+    Send a message to a channel through the channel transport, which rate limits the posts and retries the failed ones.
 
     Args:
         message (str): The message to post
         reply_id (int): The id of the message to reply to, if any
+        chat_id (str): The id of the channel to post to, defaults to the channel set in the constants
 
     Returns:
         int: The id of the message that was posted
+
+    Raises:
+        ChannelPostError: If the message couldn't be posted.
     """
 
-    payload = {
-        "chat_id": constants.channel_id,
-        "text": message,
-        "reply_to_message_id": reply_id
-    }
+    return channel_transport.send(constants.channel_id if chat_id is None else chat_id, message, reply_id)
+
 
-    while True:
-        response = requests.post(
-            f'https://api.telegram.org/bot{constants.credentials["BOT_TOKEN"]}/sendMessage', json=payload).json()
+def post_message(message: str, reply_id: int = None, chat_id: str = None):
+    """
+    Post a message to a channel, blocking until it's posted. The main loop posts through the channel outbox instead, this is for the scripts
+    which post directly.
+
+    Args:
+        message (str): The message to post
+        reply_id (int): The id of the message to reply to, if any
+        chat_id (str): The id of the channel to post to, defaults to the channel set in the constants
 
-        if response.get("ok"):
-            time.sleep(constants.channel_message_sleep_timeout)
-            return response["result"]["message_id"]
+    Returns:
+        int: The id of the message that was posted
+    """
 
-        else:
-            logger.error(f"Failed to post message: {response['description']}. Retrying...")
+    return send_message(message, reply_id, chat_id)
 
 
 def get_channel_name(channel_id: int):
@@ -7,26 +7,73 @@ parser.add_argument("--mode", choices=["dev", "prod"], help="Override the mode f
 parser.add_argument("--pl", help="Override the mode from pair list filename (Default \"pair_list.csv\")")
 parser.add_argument("--cid", help="Override the ID of the canel to post.")
 parser.add_argument("--timeframe", help="Override the timeframe from .env.params")
-args = parser.parse_args()
+parser.add_argument("--ingestion", choices=["rest", "websocket"], help="Override the kline ingestion mode from .env.params")
+parser.add_argument("--rest_url", help="Override the base URL of the klines REST API, e.g. to point to a local replay server")
+parser.add_argument("--ws_url", help="Override the base URL of the klines websocket streams, e.g. to point to a local replay server")
+# Unknown arguments are ignored, so the modules can be imported by other programs (e.g. the test runner) with their own arguments.
+args, _ = parser.parse_known_args()
 
 credentials = dotenv_values("./.env.secret")
 
 params = dotenv_values("./.env.params")
 
-# Override mode if provided as a runtime argument
-mode = args.mode if args.mode else credentials["MODE"]
+# Override mode if provided as a runtime argument. Without the secrets (e.g. in a fresh checkout), the modules can still be imported in dev mode,
+# but nothing can be posted.
+mode = args.mode if args.mode else credentials.get("MODE", "dev")
 
-credentials["CHANNEL_ID"] = credentials["CHANNEL_ID"] if mode.lower() == "prod" else credentials["DEV_CHANNEL_ID"]
+credentials["CHANNEL_ID"] = credentials.get("CHANNEL_ID") if mode.lower() == "prod" else credentials.get("DEV_CHANNEL_ID")
 
 validation_mode = True if params["validation_mode"].lower() == "true" else False
-channel_message_sleep_timeout = int(params['channel_message_sleep_timeout'])
+# The posts to each chat are rate limited by a token bucket, which allows channel_message_burst posts at once and refills at
+# channel_messages_per_minute posts per minute (Telegram allows about 20 per minute in a group or channel).
+channel_messages_per_minute = float(params["channel_messages_per_minute"])
+channel_message_burst = int(params["channel_message_burst"])
+
+# The retry policy of the posts: the failed requests are retried with an exponential backoff, up to channel_post_max_attempts attempts. The messages
+# which can't be posted are appended to the dead-letter file.
+channel_post_max_attempts = int(params["channel_post_max_attempts"])
+channel_post_backoff_base_seconds = float(params["channel_post_backoff_base_seconds"])
+channel_post_backoff_max_seconds = float(params["channel_post_backoff_max_seconds"])
+channel_dead_letter_filename = params["channel_dead_letter_filename"]
 
 if mode.lower() == "dev":
     validation_mode = True
-    channel_message_sleep_timeout = 3
 
 market_type = params["market_type"]
+
+# The base URL's of the Binance REST API and websocket streams for the market type. Both can be overridden through the runtime arguments to point
+# to a local replay server (utils/kline_replay_server.py).
+if market_type == "futures":
+    binance_rest_url = "https://fapi.binance.com/fapi/v1"
+    binance_ws_url = "wss://fstream.binance.com"
+else:
+    binance_rest_url = "https://api.binance.com/api/v3"
+    binance_ws_url = "wss://stream.binance.com:9443"
+
+binance_rest_url = args.rest_url if args.rest_url else binance_rest_url
+binance_ws_url = args.ws_url if args.ws_url else binance_ws_url
+
+# The fetcher used for the REST klines, "threaded" (requests in a thread pool) or "async" (aiohttp), and the maximum number of concurrent
+# connections to the klines endpoint, which is also the size of the thread pool / connection pool.
+kline_fetcher = params["kline_fetcher"]
+fetch_concurrency = int(params["fetch_concurrency"])
+
+# If true, long histories are backfilled by splitting the time range into 1000-candle windows which are fetched concurrently, instead of paginating
+# through the range one request at a time.
+parallel_backfill = True if params["parallel_backfill"].lower() == "true" else False
+
+# The request weight per minute the klines fetchers are allowed to use. Binance allows 2400 per minute on futures and 6000 on spot, shared by every
+# process on the same IP, so the budget is kept below that.
+request_weight_budget = int(params["request_weight_budget"])
+
+# The kline ingestion mode. "rest" polls the REST API right after every candle close, "websocket" keeps the candles updated from the kline
+# streams and runs the algorithm as soon as a candle closes.
+ingestion_mode = args.ingestion if args.ingestion else params["ingestion_mode"]
+# The main loop runs right after each candle close, delayed by candle_close_grace_seconds. If intra_candle_entry_checks is enabled, the entries of the
+# posted positions are also checked every main_loop_interval seconds between the closes.
 main_loop_interval = int(params["main_loop_interval"])
+candle_close_grace_seconds = float(params["candle_close_grace_seconds"])
+intra_candle_entry_checks = True if params["intra_candle_entry_checks"].lower() == "true" else False
 price_rounding_precision = int(params["price_rounding_precision"])
 
 # The lower order timeframe
@@ -48,7 +95,14 @@ timeframe_minutes = {
     "1d": 1440
 }
 
-mock_api_url = credentials["MOCK_API_URL"]
+mock_api_url = credentials.get("MOCK_API_URL")
+
+# The directory of the persistent candle store, which keeps the closed candles of each pair between restarts.
+candle_store_dir = params["candle_store_dir"]
+
+# The dtype of the prices in the CandleFrames the algorithm works on. "float32" halves the memory of the prices of each pair, at the cost of rounding
+# the prices to about 7 significant digits.
+candle_price_dtype = params["candle_price_dtype"]
 
 num_pairs_engaged = params["num_pairs_engaged"]
 
@@ -62,6 +116,13 @@ pair_list_filename = args.pl if args.pl else "pair_list.csv"
 # Override the channel ID configuration
 channel_id = args.cid if args.cid else credentials["CHANNEL_ID"]
 
+# The channels the signals are fanned out to in prod mode, in addition to channel_id, each with its own leverage and validation settings.
+channel_list_filename = params["channel_list_filename"]
+
+# The directory of the state journal, which keeps the positions and the state of each pair between restarts. Each timeframe and channel has its
+# own journal, since the message IDs of the positions are specific to the channel.
+state_journal_dir = params["state_journal_dir"]
+
 start_times_filename = f"{timeframe}.env.starttimes"
 
 start_times = dotenv_values(f"./{start_times_filename}")
@@ -1,5 +1,6 @@
 import logging
 
+from utils.channel_config import channel_configs
 from utils.channel_utils import get_channel_name
 from algo_code.general_utils import get_pair_list
 import utils.constants as constants
@@ -63,6 +64,9 @@ def initialize():
     # set_console_logging_level()
 
     channel_name = get_channel_name(constants.credentials["CHANNEL_ID"])
+    # The signals are also fanned out to the channels of the channel list, if any.
+    if len(channel_configs) > 1:
+        channel_name += f" (and {', '.join(get_channel_name(channel_config.channel_id) for channel_config in channel_configs[1:])})"
 
     if constants.mode != "DEV":
         confirm_start(channel_name)
@@ -0,0 +1,174 @@
+# A local stand-in for the Binance kline feed, used to test the websocket ingestion mode offline. The server replays candles from CSV files, one per
+# symbol, named {SYMBOL}.csv with the columns time, open, high, low, close. It answers both the klines REST endpoint (for the backfill) and the
+# combined kline streams, so the bot can be pointed at it with:
+#
+#   python -m utils.kline_replay_server --data_dir replay_data --start_time "2024-12-20 00:00:00"
+#   python main.py --ingestion websocket --rest_url http://localhost:8765/fapi/v1 --ws_url ws://localhost:8765
+#
+# The candles before --start_time are served as history. Starting from --start_time, each candle is replayed in --candle_seconds real seconds,
+# split into --updates_per_candle kline events, the last one of which marks the candle as closed.
+
+import argparse
+import asyncio
+import http
+import json
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+import websockets
+
+parser = argparse.ArgumentParser(description="Local kline replay server")
+parser.add_argument("--data_dir", default="replay_data", help="Directory containing the {SYMBOL}.csv candle files")
+parser.add_argument("--timeframe", default="15m", help="The timeframe of the candles in the CSV files")
+parser.add_argument("--start_time", required=True, help="The open time of the first replayed candle, the candles before it are history")
+parser.add_argument("--candle_seconds", type=float, default=2, help="Real seconds it takes to replay one candle")
+parser.add_argument("--updates_per_candle", type=int, default=3, help="Number of kline events sent for each candle")
+parser.add_argument("--port", type=int, default=8765)
+
+
+class KlineReplayServer:
+    def __init__(self, data_dir: str, timeframe: str, start_time: pd.Timestamp, candle_seconds: float, updates_per_candle: int):
+        self.timeframe = timeframe
+        self.timeframe_ms = int(pd.Timedelta(timeframe).total_seconds() * 1000)
+        self.candle_seconds = candle_seconds
+        self.updates_per_candle = updates_per_candle
+
+        # The candles of each symbol, keyed by their open time in milliseconds.
+        self.candles: dict[str, dict[int, list[float]]] = {}
+        self.data_dir = data_dir
+
+        # The open time of the candle being replayed, and how many of its updates have been sent.
+        self.forming_open_time_ms = int(start_time.timestamp() * 1000)
+        self.update_step = 0
+
+        # The connected websocket clients and the symbols each one has subscribed to.
+        self.subscriptions: dict = {}
+
+    def load_symbol(self, symbol: str) -> bool:
+        if symbol in self.candles:
+            return True
+
+        try:
+            candle_df = pd.read_csv(f"{self.data_dir}/{symbol}.csv")
+        except FileNotFoundError:
+            return False
+
+        if pd.api.types.is_numeric_dtype(candle_df["time"]):
+            open_times_ms = candle_df["time"].astype("int64")
+        else:
+            open_times_ms = pd.to_datetime(candle_df["time"], utc=True).astype("int64") // 10 ** 6
+
+        self.candles[symbol] = {int(open_time_ms): [float(row.open), float(row.high), float(row.low), float(row.close)]
+                                for open_time_ms, row in zip(open_times_ms, candle_df.itertuples())}
+
+        return True
+
+    def forming_candle(self, symbol: str) -> list[float] | None:
+        # The candle being replayed, as it would look at the current update step. The price moves linearly from open to close over the updates.
+        candle = self.candles[symbol].get(self.forming_open_time_ms)
+        if candle is None:
+            return None
+
+        if self.update_step >= self.updates_per_candle:
+            return candle
+
+        open_price, high, low, close = candle
+        partial_close = open_price + (close - open_price) * self.update_step / self.updates_per_candle
+        return [open_price, max(open_price, partial_close), min(open_price, partial_close), partial_close]
+
+    def kline_rows(self, symbol: str, start_time_ms: int, end_time_ms: int, limit: int) -> list[list]:
+        # Klines in the same row format as the Binance REST API, never going past the candle being replayed.
+        rows = []
+        for open_time_ms in sorted(self.candles[symbol].keys()):
+            if open_time_ms < start_time_ms or open_time_ms > min(end_time_ms, self.forming_open_time_ms):
+                continue
+
+            candle = self.forming_candle(symbol) if open_time_ms == self.forming_open_time_ms else self.candles[symbol][open_time_ms]
+            rows.append([open_time_ms, *[str(price) for price in candle], "0", open_time_ms + self.timeframe_ms - 1, "0", 0, "0", "0", "0"])
+
+            if len(rows) >= limit:
+                break
+
+        return rows
+
+    async def process_request(self, path: str, request_headers):
+        # Plain HTTP requests to the klines endpoint are answered here, websocket handshakes are passed on to the handler.
+        parsed_path = urlparse(path)
+        if not parsed_path.path.endswith("/klines"):
+            return None
+
+        query = {key: values[0] for key, values in parse_qs(parsed_path.query).items()}
+        symbol = query["symbol"]
+
+        if not self.load_symbol(symbol):
+            return http.HTTPStatus.BAD_REQUEST, [], json.dumps({"code": -1121, "msg": "Invalid symbol."}).encode()
+
+        rows = self.kline_rows(symbol, int(query.get("startTime", 0)), int(query.get("endTime", 2 ** 62)), int(query.get("limit", 500)))
+
+        return http.HTTPStatus.OK, [("Content-Type", "application/json")], json.dumps(rows).encode()
+
+    async def handle_stream(self, web_socket, path: str):
+        streams = parse_qs(urlparse(path).query).get("streams", [""])[0].split("/")
+        symbols = [stream.split("@")[0].upper() for stream in streams if stream]
+        self.subscriptions[web_socket] = [symbol for symbol in symbols if self.load_symbol(symbol)]
+
+        try:
+            await web_socket.wait_closed()
+        finally:
+            del self.subscriptions[web_socket]
+
+    def kline_event(self, symbol: str) -> str | None:
+        candle = self.forming_candle(symbol)
+        if candle is None:
+            return None
+
+        return json.dumps({
+            "stream": f"{symbol.lower()}@kline_{self.timeframe}",
+            "data": {
+                "e": "kline",
+                "s": symbol,
+                "k": {
+                    "t": self.forming_open_time_ms,
+                    "T": self.forming_open_time_ms + self.timeframe_ms - 1,
+                    "s": symbol,
+                    "i": self.timeframe,
+                    "o": str(candle[0]),
+                    "h": str(candle[1]),
+                    "l": str(candle[2]),
+                    "c": str(candle[3]),
+                    "x": self.update_step >= self.updates_per_candle
+                }
+            }
+        })
+
+    async def replay(self):
+        while True:
+            await asyncio.sleep(self.candle_seconds / self.updates_per_candle)
+            self.update_step += 1
+
+            for web_socket, symbols in list(self.subscriptions.items()):
+                for symbol in symbols:
+                    event = self.kline_event(symbol)
+                    if event is not None:
+                        await web_socket.send(event)
+
+            if self.update_step >= self.updates_per_candle:
+                print(f"Replayed candle {pd.to_datetime(self.forming_open_time_ms, unit='ms')}")
+                self.forming_open_time_ms += self.timeframe_ms
+                self.update_step = 0
+
+
+async def serve(args):
+    replay_server = KlineReplayServer(data_dir=args.data_dir,
+                                      timeframe=args.timeframe,
+                                      start_time=pd.to_datetime(args.start_time, utc=True),
+                                      candle_seconds=args.candle_seconds,
+                                      updates_per_candle=args.updates_per_candle)
+
+    async with websockets.serve(replay_server.handle_stream, "localhost", args.port, process_request=replay_server.process_request):
+        print(f"Replay server listening on localhost:{args.port}")
+        await replay_server.replay()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(parser.parse_args()))
@@ -1,4 +1,5 @@
 import logging
+import os
 from typing import Union, Any
 
 import colorlog
@@ -26,6 +27,7 @@ console_handler.setLevel(logging.INFO)
 
 # Create a file handler and set its level to DEBUG
 current_time = time.strftime("%Y-%m-%d_%H-%M-%S")
+os.makedirs("logs", exist_ok=True)
 file_handler = logging.FileHandler(f'logs/logs-{current_time}.log')
 file_handler.setLevel(logging.DEBUG)
 
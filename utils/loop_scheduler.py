@@ -0,0 +1,57 @@
+import time
+from typing import Callable
+
+import utils.constants as constants
+
+
+class CandleCloseScheduler:
+    """
+    Schedules the main loop iterations on the candle boundaries of the timeframe, instead of a fixed sleep which doesn't know when candles close.
+
+    Each iteration is run right after a candle closes, delayed by a small grace period so the exchange has the closed candle and the newly opened
+    one available. Optionally, a cheap check (e.g. registering the entries of the already posted positions) is run every check_interval seconds
+    while waiting for the next close. The check is skipped when the close is less than half an interval away, so the stretch of the candle after
+    the last check has to be covered by the iteration after the close (e.g. the entries are checked against the closed candle then).
+    """
+
+    def __init__(self, timeframe: str, grace_seconds: float, check_interval_seconds: float):
+        self.timeframe_seconds: int = constants.timeframe_minutes[timeframe] * 60
+        self.grace_seconds: float = grace_seconds
+        self.check_interval_seconds: float = check_interval_seconds
+
+    def get_next_close_time(self, now: float = None) -> float:
+        """
+        Get the close time of the currently forming candle. Candle open times are aligned to multiples of the timeframe since the UNIX epoch.
+
+        Args:
+            now (float): The current UNIX timestamp in seconds, defaults to the current time.
+
+        Returns:
+            float: The UNIX timestamp of the next candle close, in seconds.
+        """
+
+        now = time.time() if now is None else now
+
+        return (now // self.timeframe_seconds + 1) * self.timeframe_seconds
+
+    def wait_for_next_close(self, between_closes_check: Callable[[], None] = None) -> None:
+        """
+        Block until the grace period after the next candle close has passed.
+
+        Args:
+            between_closes_check (Callable[[], None]): A function which is called every check_interval seconds while waiting, or None to just sleep
+                                                       until the next close.
+        """
+
+        wake_time = self.get_next_close_time() + self.grace_seconds
+
+        while (remaining_seconds := wake_time - time.time()) > 0:
+            if between_closes_check is None:
+                time.sleep(remaining_seconds)
+                break
+
+            time.sleep(min(remaining_seconds, self.check_interval_seconds))
+
+            # The check isn't run if the close is about to be processed anyway. The iteration after the close checks the whole closed candle.
+            if wake_time - time.time() > self.check_interval_seconds / 2:
+                between_closes_check()
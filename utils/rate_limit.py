@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket. The bucket holds up to capacity tokens and is refilled continuously at refill_rate tokens per second. Each request
+    takes its cost in tokens out of the bucket, waiting for the refill if there aren't enough tokens left.
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity: float = capacity
+        self.refill_rate: float = refill_rate
+
+        self.tokens: float = capacity
+        self.last_refill_time: float = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __refill(self) -> None:
+        # Must be called with the lock held.
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill_time) * self.refill_rate)
+        self.last_refill_time = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Try to take tokens out of the bucket without blocking.
+
+        Args:
+            tokens (float): The number of tokens to take. Costs larger than the capacity are capped to it, so they can still be acquired.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the number of seconds to wait before there are enough tokens in the bucket.
+        """
+
+        tokens = min(tokens, self.capacity)
+
+        with self.lock:
+            self.__refill()
+
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+
+            return (tokens - self.tokens) / self.refill_rate
+
+    def acquire(self, tokens: float = 1) -> None:
+        # Block the calling thread until the tokens are taken.
+        while (wait_seconds := self.reserve(tokens)) > 0:
+            time.sleep(wait_seconds)
+
+    async def acquire_async(self, tokens: float = 1) -> None:
+        # Same as acquire, without blocking the event loop.
+        while (wait_seconds := self.reserve(tokens)) > 0:
+            await asyncio.sleep(wait_seconds)
+
+    def limit_tokens(self, tokens: float) -> None:
+        # Lower the tokens left in the bucket, e.g. when the server reports that more of the budget has been used than the bucket accounts for.
+        with self.lock:
+            self.__refill()
+            self.tokens = min(self.tokens, tokens)